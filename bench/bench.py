@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+
+"""benchmark the outage-detection path, with no Pi and no network
+
+Runs pi-power-relay checks against a fake network (fakes.FakeNetwork)
+and a fake GPIO (fakes.FakeGPIO), for every combination of host
+count, tries, timeout and sequential/concurrent probing, and measures:
+
+    healthy     wall time of a check when every host answers - the
+                fast path taken on nearly every run
+    cpu         CPU time used by that check (all threads)
+    decision    time from the start of a check during an outage until
+                the relay pin goes HIGH
+
+and, for a run from the cron while the network is up, in a new Python
+each time, as on every run on a Pi:
+
+    import      time to import the program, after Python has started
+    healthy     wall time of the whole run, starting Python and all
+    cpu         CPU time used by the run
+    modules     number of modules loaded by the end of the run
+
+It probes a TCP port opened on localhost, so it needs no network.
+
+Fake sleeps are scaled by --scale, so slow timeouts don't make the
+benchmark slow.  Times in the results are as measured, so only
+compare runs made with the same scale.
+
+    bench/bench.py -o before.json
+    ... change something ...
+    bench/bench.py -o after.json -C before.json
+
+With -C, any time more than --threshold percent worse than in the
+earlier results is reported, and the exit status is 1.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import resource
+import subprocess
+import tempfile
+import platform
+
+# run from a source tree without installing
+SRC = os.path.join( os.path.dirname( os.path.abspath( __file__ )), '..',
+                    'src' )
+sys.path.insert( 0, SRC )
+
+from pi_power_relay_moxad import pi_power_relay, probes, relay, fakes
+
+PIN = 25
+
+HOST_COUNTS = [ 1, 2, 4, 8 ]
+TRIES       = [ 1, 3 ]
+TIMEOUTS    = [ 1, 2 ]
+MODES       = [ 'sequential', 'concurrent' ]
+
+# what a run from the cron does, and a run that just imports it
+COLD_RUN = "import sys\n" \
+           "from pi_power_relay_moxad.pi_power_relay import main\n" \
+           "result = main()\n" \
+           "sys.stdout.write( '{:d}\\n'.format( len( sys.modules )))\n" \
+           "sys.exit( result )\n"
+COLD_IMPORT = "import sys, time\n" \
+              "start = time.time()\n" \
+              "import pi_power_relay_moxad.pi_power_relay\n" \
+              "sys.stdout.write( '{:f}\\n'.format( time.time() - start ))\n"
+
+# results worse than the earlier ones by less than this many
+# seconds are noise, whatever the percentage
+MIN_DIFF = 0.005
+
+
+def median( values ):
+    values = sorted( values )
+    n = len( values )
+    if n % 2:
+        return( values[ n // 2 ] )
+    return(( values[ n // 2 - 1 ] + values[ n // 2 ] ) / 2.0 )
+
+
+def make_opts( hosts, tries, timeout, mode, lock_file, gpio ):
+    """return the options for a check, as main() would build them"""
+
+    argv = [ 'pi-power-relay', '-q', '--no-health', '-P', 'fake',
+             '-H', ','.join( hosts ), '-t', str( tries ),
+             '-x', str( timeout ), '-p', str( PIN ), '-L', lock_file ]
+    if mode == 'concurrent':
+        argv.append( '-c' )
+
+    opts = pi_power_relay.get_options( argv )
+    opts[ 'health' ]      = None
+    opts[ 'recorder' ]    = None
+    opts[ 'history' ]     = None
+    opts[ 'events' ]      = None
+    opts[ 'resolver' ]    = None
+    opts[ 'peers' ]       = None
+    opts[ 'gpio' ]        = gpio
+    opts[ 'have-gpio' ]   = True    # drive the fake GPIO
+
+    # don't wait for the power cycle to finish
+    opts[ 'daemon-flag' ] = True
+    return( opts )
+
+
+def run_healthy( net, opts, repeat ):
+    """time checks while every host answers
+
+    Returns:
+        ( median wall secs, median cpu secs )
+    """
+
+    walls = []
+    cpus  = []
+    for i in range( repeat ):
+        wall_start = time.time()
+        cpu_start  = time.process_time()
+        pi_power_relay.check( opts, {} )
+        cpus.append( time.process_time() - cpu_start )
+        walls.append( time.time() - wall_start )
+
+    return( median( walls ), median( cpus ))
+
+
+def run_decision( net, gpio, opts, repeat ):
+    """time from the start of an outage until the relay pin goes HIGH
+
+    Returns:
+        median secs, or None if the relay never went HIGH
+    """
+
+    took = []
+    for i in range( repeat ):
+        del gpio.events[:]
+        del net.outages[:]
+        state = {}
+
+        start = time.time()
+        net.outage( start, None )
+        pi_power_relay.check( opts, state )
+        high = gpio.wait_for( PIN, fakes.HIGH, 5 )
+
+        # let the relay finish dropping power before cancelling the
+        # cycle, so it goes back to idle without ever locking the device
+        for device in opts[ 'devices' ]:
+            r = state.get( device[ 'device-name' ], {} ).get( 'relay' )
+            if r is not None:
+                while r.busy() and r.state != relay.POWER_OFF:
+                    time.sleep( 0.001 )
+                r.cancel()
+        del net.outages[:]
+
+        if high is None:
+            return( None )
+        took.append( high - start )
+
+    return( median( took ))
+
+
+def _child_cpu():
+    usage = resource.getrusage( resource.RUSAGE_CHILDREN )
+    return( usage.ru_utime + usage.ru_stime )
+
+
+def run_cold_start( repeat, tmpdir ):
+    """time runs from the cron while the network is up, each in a new
+    Python
+
+    Returns:
+        result dictionary
+    """
+
+    # a port that answers, for the run to probe
+    listener = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+    listener.bind(( '127.0.0.1', 0 ))
+    listener.listen( 16 )
+    listener.setblocking( False )
+    host = 'tcp:127.0.0.1:{:d}'.format( listener.getsockname()[1] )
+
+    env = dict( os.environ )
+    env[ 'PYTHONPATH' ] = os.pathsep.join(
+        [ SRC ] + [ p for p in [ env.get( 'PYTHONPATH' ) ] if p ] )
+    argv = [ sys.executable, '-c', COLD_RUN, '-q', '-H', host, '-t', '1',
+             '-L', os.path.join( tmpdir, 'cold-lock' ) ]
+
+    imports = []
+    walls   = []
+    cpus    = []
+    modules = None
+    try:
+        # the first run writes the .pyc files and health index
+        for i in range( repeat + 1 ):
+            output = subprocess.check_output(
+                [ sys.executable, '-c', COLD_IMPORT ], env=env )
+            imports.append( float( output ))
+
+            cpu_start  = _child_cpu()
+            wall_start = time.time()
+            output = subprocess.check_output( argv, env=env )
+            walls.append( time.time() - wall_start )
+            cpus.append( _child_cpu() - cpu_start )
+            modules = int( output.split()[-1] )
+
+            # the connections are never used
+            while True:
+                try:
+                    listener.accept()[0].close()
+                except socket.error:
+                    break
+    finally:
+        listener.close()
+
+    return({
+        'name':     'cold start, network up',
+        'hosts':    1,
+        'tries':    1,
+        'timeout':  2,
+        'mode':     'cron',
+        'import':   median( imports[ 1: ] ),
+        'healthy':  median( walls[ 1: ] ),
+        'cpu':      median( cpus[ 1: ] ),
+        'decision': None,
+        'modules':  modules,
+    })
+
+
+def run( scale, repeat ):
+    """run all the benchmarks
+
+    Returns:
+        results dictionary
+    """
+
+    net  = fakes.FakeNetwork( time_scale=scale, seed=1 )
+    gpio = fakes.FakeGPIO()
+    probes.register( 'fake', net.probe )
+
+    tmpdir = tempfile.mkdtemp( prefix='pi-power-relay-bench.' )
+    lock_file = os.path.join( tmpdir, 'lock' )
+
+    results = []
+    try:
+        result = run_cold_start( repeat, tmpdir )
+        results.append( result )
+        print_cold_start( result )
+
+        for num_hosts in HOST_COUNTS:
+            hosts = [ '10.0.0.{:d}'.format( n + 1 )
+                      for n in range( num_hosts ) ]
+            for host in hosts:
+                net.add_host( host, rtt=0.02 )
+            for tries in TRIES:
+                for timeout in TIMEOUTS:
+                    for mode in MODES:
+                        opts = make_opts( hosts, tries, timeout, mode,
+                                          lock_file, gpio )
+                        ( healthy, cpu ) = run_healthy( net, opts, repeat )
+                        decision = run_decision( net, gpio, opts, repeat )
+                        result = {
+                            'name':     "hosts={:d} tries={:d} " \
+                                        "timeout={:d} {}".format( num_hosts,
+                                            tries, timeout, mode ),
+                            'hosts':    num_hosts,
+                            'tries':    tries,
+                            'timeout':  timeout,
+                            'mode':     mode,
+                            'healthy':  healthy,
+                            'cpu':      cpu,
+                            'decision': decision,
+                        }
+                        results.append( result )
+                        print_result( result )
+    finally:
+        shutil.rmtree( tmpdir, True )
+
+    return({
+        'version':  1,
+        'time':     int( time.time()),
+        'python':   platform.python_version(),
+        'machine':  platform.machine(),
+        'scale':    scale,
+        'repeat':   repeat,
+        'results':  results,
+    })
+
+
+def _ms( secs ):
+    if secs is None:
+        return( '       -' )
+    return( "{:8.1f}".format( secs * 1000 ))
+
+
+def print_result( result ):
+    print( "{0:<42s} healthy {1} ms  cpu {2} ms  decision {3} ms".format(
+        result[ 'name' ], _ms( result[ 'healthy' ] ), _ms( result[ 'cpu' ] ),
+        _ms( result[ 'decision' ] )))
+    sys.stdout.flush()
+
+
+def print_cold_start( result ):
+    print( "{0:<42s} import  {1} ms  run {2} ms  cpu {3} ms  "
+           "{4:d} modules".format( result[ 'name' ], _ms( result[ 'import' ] ),
+        _ms( result[ 'healthy' ] ), _ms( result[ 'cpu' ] ),
+        result[ 'modules' ] ))
+    sys.stdout.flush()
+
+
+def compare( new, old, threshold ):
+    """report results that got worse
+
+    Returns:
+        number of regressions
+    """
+
+    if new[ 'scale' ] != old[ 'scale' ]:
+        print( "warning: comparing runs with different --scale" )
+
+    old_results = dict(( r[ 'name' ], r ) for r in old[ 'results' ] )
+    regressions = 0
+    for result in new[ 'results' ]:
+        before = old_results.get( result[ 'name' ] )
+        if before is None:
+            continue
+        for key in ( 'import', 'healthy', 'cpu', 'decision' ):
+            if result.get( key ) is None or before.get( key ) is None:
+                continue
+            diff = result[ key ] - before[ key ]
+            if diff > MIN_DIFF and \
+               diff > before[ key ] * threshold / 100.0:
+                regressions = regressions + 1
+                print( "REGRESSION {0:s} {1:s}: {2} -> {3} ms".format(
+                    result[ 'name' ], key, _ms( before[ key ] ).strip(),
+                    _ms( result[ key ] ).strip()))
+
+    print( "{0:d} regressions".format( regressions ))
+    return( regressions )
+
+
+def main( argv=sys.argv ):
+    progname = os.path.basename( argv[0] )
+
+    scale     = 0.1
+    repeat    = 3
+    threshold = 20
+    out_file  = ""
+    old_file  = ""
+
+    num_args = len( argv )
+    i = 1
+    while i < num_args:
+        try:
+            arg = argv[i]
+            if arg == '-h' or arg == '--help':
+                print( "usage: {} [options]*".format( progname ))
+                print( """\
+        [-h|--help]                print this help info
+        [-n|--repeat num]          runs of each benchmark ({})
+        [-o|--output string]       write results to JSON file
+        [-s|--scale num]           multiply fake sleeps by this ({})
+        [-C|--compare string]      compare with earlier JSON results
+        [-T|--threshold num]       percent worse that is a regression ({})\
+        """.format( repeat, scale, threshold ))
+                return(0)
+            elif arg == '-n' or arg == '--repeat':
+                i = i + 1
+                repeat = int( argv[i] )
+            elif arg == '-o' or arg == '--output':
+                i = i + 1
+                out_file = argv[i]
+            elif arg == '-s' or arg == '--scale':
+                i = i + 1
+                scale = float( argv[i] )
+            elif arg == '-C' or arg == '--compare':
+                i = i + 1
+                old_file = argv[i]
+            elif arg == '-T' or arg == '--threshold':
+                i = i + 1
+                threshold = float( argv[i] )
+            else:
+                sys.stderr.write( "{}: unknown option: {}\n".format(
+                    progname, arg ))
+                return(1)
+        except IndexError:
+            sys.stderr.write( "{}: missing value for {}\n".format(
+                progname, argv[ i - 1 ] ))
+            return(1)
+        except ValueError:
+            sys.stderr.write( "{}: bad value for {}: {}\n".format(
+                progname, argv[ i - 1 ], argv[i] ))
+            return(1)
+        i = i + 1
+
+    old = None
+    if old_file:
+        with open( old_file ) as f:
+            old = json.load( f )
+
+    new = run( scale, repeat )
+
+    if out_file:
+        with open( out_file, "w" ) as f:
+            json.dump( new, f, indent=2, sort_keys=True )
+            f.write( "\n" )
+
+    if old is not None and compare( new, old, threshold ):
+        return(1)
+
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,166 @@
+"""the clock used for decisions
+
+Everything that decides when to probe, reset, or honour a lock or a
+maintenance period gets the time from here, rather than from the time
+module, and uses timer() and wait() rather than threading directly:
+
+    now = clock.now()
+    clock.timer( 15, power_on )
+
+Normally this is the real time.  A simulation (see simulate.py) swaps
+in a VirtualClock with use(), and the same code then runs through
+weeks of virtual time in seconds.
+"""
+
+import time
+import heapq
+import threading
+
+
+class Clock( object ):
+    """the real time"""
+
+    def now( self ):
+        return( time.time())
+
+    def localtime( self, secs=None ):
+        return( time.localtime( secs ))
+
+    def sleep( self, secs ):
+        time.sleep( secs )
+
+    def timer( self, delay, func ):
+        """call func after delay seconds, from its own thread
+
+        Returns:
+            the timer.  Its cancel() stops it, if it hasn't run yet
+        """
+
+        t = threading.Timer( delay, func )
+        t.daemon = True
+        t.start()
+        return( t )
+
+    def wait( self, event, timeout=None ):
+        """wait for a threading.Event.  Returns True if it is set"""
+
+        return( event.wait( timeout ))
+
+
+class _VirtualTimer( object ):
+    def __init__( self, when, func ):
+        self.when = when
+        self.func = func
+        self.cancelled = False
+
+    def cancel( self ):
+        self.cancelled = True
+
+
+class VirtualClock( Clock ):
+    """time that only moves when it is told to, or something sleeps
+
+    Timers run in the thread that moves the clock, in time order, as
+    it passes them.  It is not thread-safe, so anything using it
+    should probe sequentially.
+
+    Arguments to constructor:
+        1:  starting time (seconds since epoch)
+    """
+
+    def __init__( self, start ):
+        self.time   = float( start )
+        self.timers = []            # heap of ( when, seq, _VirtualTimer )
+        self.seq    = 0
+
+    def now( self ):
+        return( self.time )
+
+    def localtime( self, secs=None ):
+        if secs is None:
+            secs = self.time
+        return( time.localtime( secs ))
+
+    def sleep( self, secs ):
+        self.advance( self.time + secs )
+
+    def timer( self, delay, func ):
+        t = _VirtualTimer( self.time + delay, func )
+        self.seq = self.seq + 1
+        heapq.heappush( self.timers, ( t.when, self.seq, t ))
+        return( t )
+
+    def wait( self, event, timeout=None ):
+        deadline = None
+        if timeout is not None:
+            deadline = self.time + timeout
+
+        while not event.is_set():
+            if not self.run_next( deadline ):
+                if deadline is not None:
+                    self.time = max( self.time, deadline )
+                break
+
+        return( event.is_set())
+
+    def run_next( self, until=None ):
+        """move to the next timer and run it
+
+        Arguments:
+            1:  optional time not to go past
+        Returns:
+            True:   a timer was run
+            False:  there are no more timers, up to the given time
+        """
+
+        while self.timers:
+            ( when, seq, t ) = self.timers[0]
+            if until is not None and when > until:
+                return( False )
+            heapq.heappop( self.timers )
+            if t.cancelled:
+                continue
+            self.time = max( self.time, when )
+            t.func()
+            return( True )
+
+        return( False )
+
+    def advance( self, to ):
+        """move the clock to a time, running any timers on the way"""
+
+        while self.run_next( to ):
+            pass
+        self.time = max( self.time, to )
+
+
+_clock = Clock()
+
+
+def use( clock ):
+    """use another clock, such as a VirtualClock.  Returns the old one"""
+
+    global _clock
+    old = _clock
+    _clock = clock
+    return( old )
+
+
+def now():
+    return( _clock.now())
+
+
+def localtime( secs=None ):
+    return( _clock.localtime( secs ))
+
+
+def sleep( secs ):
+    _clock.sleep( secs )
+
+
+def timer( delay, func ):
+    return( _clock.timer( delay, func ))
+
+
+def wait( event, timeout=None ):
+    return( _clock.wait( event, timeout ))
@@ -0,0 +1,218 @@
+"""config file (--config), and the compiled policy
+
+Instead of a long crontab line, the options can be kept in a file:
+
+    # pi-power-relay.conf
+    hosts       = 8.8.8.8, 1.1.1.1
+    tries       = 3
+    daemon      = yes
+    maint       = 02:00-02:30, sat+sun 23:00-01:00
+
+    [device modem]
+    pin         = 25
+    hosts       = 8.8.8.8, 1.1.1.1
+    wait-time   = 900
+
+    [device router]
+    pin         = 24
+    hosts       = 192.168.1.1
+
+Each setting outside a section is the long name of an option, without
+the '--'.  Options without a value, such as daemon, take yes or no.
+Each [device name] section is a --device, with the keys --device takes.
+Lists can be delimited with commas.
+
+The file is turned into options that go in front of those on the
+command line, so the command line wins: a value given on both is taken
+from the command line, and --device or --maint on the command line
+replace all those in the file.
+
+The options are checked as usual, then compiled into a Policy: a
+dictionary that can't be changed, with the devices and maintenance
+periods compiled, and the addresses of the host names found (see
+resolver.py).  In daemon mode, a SIGHUP reads the file again and swaps
+in the new policy between checks, so a check or power cycle in
+progress carries on with the one it started with.
+"""
+
+import re
+
+from .functions import dprint
+from . import probes
+
+# options that take a value, by their long names
+VALUED = ( 'delay-exit', 'interval', 'logfile', 'pin', 'reset-time',
+           'tries', 'wait-time', 'ping-timeout', 'device-name', 'hosts',
+           'lockfile', 'probe', 'metrics-file', 'metrics-port', 'profile',
+           'record', 'quorum', 'max-loss', 'max-rtt', 'history',
+           'idle-interval', 'gateway', 'modem', 'reset-stages',
+           'control-socket', 'maint-file', 'event-log', 'event-fsync',
+           'event-max-size', 'event-max-age', 'event-keep', 'dns-ttl',
+           'gpio', 'gpio-path', 'peers', 'peer-port' )
+
+# options without a value
+FLAGS = ( 'debug', 'concurrent', 'quiet', 'daemon', 'no-health',
+          'diagnose', 'netlink', 'control' )
+
+# options given once for each item of a list
+REPEATED = ( 'maint', )
+
+# lists, delimited with ',' as options and with '+' in --device
+LISTS = ( 'hosts', 'reset-stages', 'peers' )
+
+YES = ( 'yes', 'true', 'on', '1' )
+NO  = ( 'no', 'false', 'off', '0' )
+
+
+def _split_list( val ):
+    return( [ v.strip() for v in re.split( r'[,+]', val ) if v.strip() ] )
+
+
+def read( file ):
+    """read a config file, and turn it into command-line options
+
+    Arguments:
+        1:  filename
+    Returns:
+        array of options, as they would be given on the command line
+    Exceptions:
+        Exception if the file can't be read, or has a mistake in it
+    """
+
+    try:
+        with open( file, "r" ) as f:
+            lines = f.readlines()
+    except ( IOError, OSError ) as err:
+        raise Exception( "can't read config {}: {}".format( file, err ))
+
+    args    = []
+    devices = []
+    device  = None
+
+    for ( num, line ) in enumerate( lines, 1 ):
+        where = "{}:{:d}".format( file, num )
+        line = line.split( '#', 1 )[0].strip()
+        if not line:
+            continue
+
+        m = re.match( r'^\[\s*device\s+(\S+)\s*\]$', line )
+        if m:
+            device = [ ( 'name', m.group(1) ) ]
+            devices.append( device )
+            continue
+        if line.startswith( '[' ):
+            raise Exception( "{}: unknown section {}".format( where, line ))
+
+        if '=' not in line:
+            raise Exception( "{}: not of format key = value".format( where ))
+        ( key, val ) = [ s.strip() for s in line.split( '=', 1 ) ]
+
+        # the probe type may come later, so only what doesn't depend
+        # on it is checked here
+        if key == 'hosts':
+            for host in _split_list( val ):
+                try:
+                    probes.check_target( host )
+                except Exception as err:
+                    raise Exception( "{}: {}".format( where, err ))
+
+        if device is not None:
+            if key in LISTS:
+                val = '+'.join( _split_list( val ))
+            elif ',' in val:
+                raise Exception( "{}: {} can't have a ','".format( where,
+                                                                   key ))
+            device.append(( key, val ))
+        elif key in FLAGS:
+            if val.lower() in YES:
+                args.append( '--' + key )
+            elif val.lower() not in NO:
+                raise Exception( "{}: {} must be yes or no".format( where,
+                                                                    key ))
+        elif key in VALUED:
+            if key in LISTS:
+                val = ','.join( _split_list( val ))
+            args.extend([ '--' + key, val ])
+        elif key in REPEATED:
+            # not split on '+', as in 'sat+sun 01:00-03:00'
+            for item in [ v.strip() for v in val.split( ',' ) if v.strip() ]:
+                args.extend([ '--' + key, item ])
+        else:
+            raise Exception( "{}: unknown setting: {}".format( where, key ))
+
+    for device in devices:
+        spec = ','.join( "{}={}".format( k, v ) for ( k, v ) in device )
+        args.extend([ '--device', spec ])
+
+    dprint( "read(): {0:d} options from {1:s}".format( len( args ), file ))
+    return( args )
+
+
+def merge( file_args, argv ):
+    """put the options from a config file in front of the command line
+
+    --device and --maint add to a list, rather than replace a value, so
+    if any are on the command line, those from the file are dropped.
+
+    Arguments:
+        1:  options from read()
+        2:  command-line arguments, starting with the program name
+    Returns:
+        command-line arguments
+    """
+
+    given = set()
+    for arg in argv[ 1: ]:
+        if arg in ( '--device', ):
+            given.add( '--device' )
+        elif arg in ( '-m', '--maint' ):
+            given.add( '--maint' )
+
+    kept = []
+    i = 0
+    while i < len( file_args ):
+        if file_args[i] in given:
+            i = i + 2
+            continue
+        kept.append( file_args[i] )
+        i = i + 1
+
+    return( argv[ :1 ] + kept + argv[ 1: ] )
+
+
+class Policy( dict ):
+    """a dictionary that can't be changed once made
+
+    A copy made with dict() can be.
+    """
+
+    def _frozen( self, *args, **kwargs ):
+        raise TypeError( "the policy can't be changed" )
+
+    __setitem__ = _frozen
+    __delitem__ = _frozen
+    clear       = _frozen
+    pop         = _frozen
+    popitem     = _frozen
+    setdefault  = _frozen
+    update      = _frozen
+
+
+def compile( opts ):
+    """compile checked options into a Policy
+
+    Arguments:
+        1:  options dictionary, from get_options() and setup()
+    Returns:
+        Policy
+    """
+
+    devices = tuple( Policy( d, hosts=tuple( d[ 'hosts' ] ),
+                             **{ 'reset-stages': tuple( d[ 'reset-stages' ] )})
+                     for d in opts[ 'devices' ] )
+
+    # the addresses of the host names, which probes.address_of() gives
+    if opts[ 'resolver' ] is not None:
+        opts[ 'resolver' ].load( devices, opts[ 'probe' ], opts[ 'dns-ttl' ] )
+
+    return( Policy( opts, devices=devices ))
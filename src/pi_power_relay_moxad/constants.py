@@ -0,0 +1,30 @@
+"""defaults and names the options are checked against
+
+They belong to modules that are only imported when their options are
+used, such as peers.py and eventlog.py.  Those modules take them from
+here, so the options can be parsed without importing them.
+"""
+
+# stages of the network, for --diagnose and --reset-stages.  see diagnose.py
+LINK    = 'link'
+GATEWAY = 'gateway'
+MODEM   = 'modem'
+WAN     = 'wan'
+
+STAGES       = ( LINK, GATEWAY, MODEM, WAN )
+RESET_STAGES = ( GATEWAY, MODEM, WAN )      # those a device can own
+
+# --event-fsync, and how long the daemon holds events.  see eventlog.py
+FSYNC_POLICIES = ( 'always', 'flush', 'never' )
+FLUSH_INTERVAL = 300        # most secs events wait in the daemon
+
+# secs a looked-up address is used for (--dns-ttl).  see resolver.py
+DEFAULT_TTL = 3600
+
+# UDP port of --peers (--peer-port).  see peers.py
+DEFAULT_PEER_PORT = 7045
+
+# --gpio drivers, and the --gpio-path of chardev.  see gpio.py
+GPIO_DRIVERS        = ( 'rpi', 'chardev', 'file' )
+DEFAULT_GPIO_DRIVER = 'rpi'
+DEFAULT_GPIO_CHIP   = '/dev/gpiochip0'
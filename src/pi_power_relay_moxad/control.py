@@ -0,0 +1,360 @@
+"""control socket of the daemon, and the 'control' subcommand
+
+With --control, the daemon listens on a Unix socket, by default the
+lock-file with '.sock' added, readable only by its owner.  The
+'control' subcommand talks to it:
+
+    pi-power-relay control [options] command [device]
+
+The commands are:
+
+    status          the last check, the last probe of each host,
+                    each device's relay state and timing lock, and
+                    the --peers and which devices they are resetting
+    force-reset     reset a device now, despite the timing lock.  The
+                    device can be left out if there is only one
+    check           check now, rather than at the next interval
+    pause           stop checking until resumed.  A power cycle
+                    already started carries on
+    resume          start checking again
+    reload          read the lock-files again, such as after removing
+                    one by hand
+
+A reset asked for this way waits for any check in progress, and goes
+through the same relay as the daemon's own resets, so the two can't
+overlap.  --force-reset also uses the socket, if a daemon is listening.
+
+Each connection carries one request and one reply, each a line of
+JSON.  A request is { "command": name, "device": name }, and a reply
+has "ok", and "error" if not ok.  A request can also be a plain line,
+such as 'force-reset modem', to use with socat or nc -U.
+"""
+
+import os
+import sys
+import json
+import errno
+import socket
+import select
+import threading
+
+from .functions import dprint, socket_filename
+
+COMMANDS = ( 'status', 'force-reset', 'check', 'pause', 'resume', 'reload' )
+
+TIMEOUT     = 5         # secs for a client to send its request
+MAX_REQUEST = 4096      # bytes
+
+
+def _read_line( sock, limit ):
+    data = b''
+    while b'\n' not in data and len( data ) < limit:
+        chunk = sock.recv( limit - len( data ))
+        if not chunk:
+            break
+        data = data + chunk
+    return( data.split( b'\n', 1 )[0].decode( 'utf-8', 'replace' ))
+
+
+def parse_request( line ):
+    """turn a request line into a dictionary
+
+    Arguments:
+        1:  a JSON object, or a command and optional device name
+    Returns:
+        dictionary with at least 'command'
+    Exceptions:
+        Exception if it can't be understood
+    """
+
+    line = line.strip()
+    if line.startswith( '{' ):
+        try:
+            request = json.loads( line )
+        except ValueError as err:
+            raise Exception( "bad request: {}".format( err ))
+        if not isinstance( request, dict ) or 'command' not in request:
+            raise Exception( "request has no command" )
+        return( request )
+
+    words = line.split()
+    if not words:
+        raise Exception( "empty request" )
+    request = { 'command': words[0] }
+    if len( words ) > 1:
+        request[ 'device' ] = words[1]
+    return( request )
+
+
+class Server( object ):
+    """answer requests on a Unix socket, each in its own thread
+
+    Arguments to constructor:
+        1:  path of the socket
+        2:  function called with the request dictionary, returning the
+            reply dictionary.  Exceptions become error replies
+    """
+
+    def __init__( self, path, handler ):
+        self.path    = path
+        self.handler = handler
+        self.sock    = None
+        self.thread  = None
+        ( self.stop_read, self.stop_write ) = ( None, None )
+
+    def start( self ):
+        """create the socket and start answering
+
+        A socket left behind by a daemon that died is replaced.
+
+        Exceptions:
+            Exception if another daemon is using the socket, or it
+            can't be made
+        """
+
+        if os.path.exists( self.path ):
+            try:
+                request( self.path, { 'command': 'status' }, timeout=2 )
+                raise Exception( "a daemon is already listening on {}". \
+                    format( self.path ))
+            except ( IOError, OSError ):
+                os.unlink( self.path )      # stale
+
+        self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        old_umask = os.umask( 0o077 )
+        try:
+            self.sock.bind( self.path )
+            self.sock.listen( 5 )
+        except ( IOError, OSError ) as err:
+            self.sock.close()
+            self.sock = None
+            raise Exception( "can't listen on {}: {}".format( self.path, err ))
+        finally:
+            os.umask( old_umask )
+
+        ( self.stop_read, self.stop_write ) = os.pipe()
+        self.thread = threading.Thread( target=self._run, name='control' )
+        self.thread.daemon = True
+        self.thread.start()
+        dprint( "Server.start(): listening on {0:s}".format( self.path ))
+
+    def stop( self ):
+        """stop answering, and remove the socket"""
+
+        if self.thread is None:
+            return
+        os.write( self.stop_write, b'x' )
+        self.thread.join()
+        self.thread = None
+        self.sock.close()
+        os.close( self.stop_read )
+        os.close( self.stop_write )
+        try:
+            os.unlink( self.path )
+        except OSError:
+            pass
+
+    def _run( self ):
+        while True:
+            ( ready, w, x ) = select.select(
+                [ self.sock, self.stop_read ], [], [] )
+            if self.stop_read in ready:
+                return
+            try:
+                ( conn, addr ) = self.sock.accept()
+            except ( IOError, OSError ):
+                continue
+            t = threading.Thread( target=self._serve, args=( conn, ))
+            t.daemon = True
+            t.start()
+
+    def _serve( self, conn ):
+        try:
+            conn.settimeout( TIMEOUT )
+            line = _read_line( conn, MAX_REQUEST )
+            try:
+                req = parse_request( line )
+                dprint( "Server: request {}".format( req ))
+                reply = self.handler( req )
+            except Exception as err:
+                reply = { 'ok': False, 'error': str( err ) }
+            conn.settimeout( None )
+            conn.sendall(( json.dumps( reply, sort_keys=True ) + "\n" ). \
+                encode( 'utf-8' ))
+        except ( IOError, OSError ) as err:
+            dprint( "Server: {}".format( err ))
+        finally:
+            conn.close()
+
+
+def request( path, req, timeout=60 ):
+    """send a request to the daemon, and return its reply
+
+    Arguments:
+        1:  path of the socket
+        2:  request dictionary
+        3:  secs to wait for the reply.  A reset waits for any check
+            in progress.  default = 60
+    Returns:
+        reply dictionary
+    Exceptions:
+        IOError/OSError if the daemon can't be reached
+        Exception if the reply can't be understood
+    """
+
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    try:
+        sock.settimeout( timeout )
+        sock.connect( path )
+        sock.sendall(( json.dumps( req ) + "\n" ).encode( 'utf-8' ))
+        line = _read_line( sock, 1024 * 1024 )
+    finally:
+        sock.close()
+
+    try:
+        return( json.loads( line ))
+    except ValueError:
+        raise Exception( "bad reply from daemon: {!r}".format( line ))
+
+
+def show_status( reply ):
+    """print a status reply for a person"""
+
+    import time
+
+    def when( t ):
+        if t is None:
+            return( "never" )
+        return( time.strftime( "%a %b %d, %Y %H:%M:%S", time.localtime( t )))
+
+    state = "checking"
+    if reply.get( 'paused' ):
+        state = "paused"
+    elif reply.get( 'maint-until' ):
+        state = "in maintenance until {}".format(
+            when( reply[ 'maint-until' ] ))
+    up = reply.get( 'network-up' )
+    print( "daemon {:d}: {}, last check {} ({})".format( reply[ 'pid' ],
+        state, when( reply.get( 'last-check' )),
+        { True: 'up', False: 'down', None: 'not yet' }[ up ] ))
+
+    for ( name, d ) in sorted( reply.get( 'devices', {} ).items()):
+        lock = ""
+        if d.get( 'lock-remaining' ):
+            lock = ", locked for {:d} secs".format( d[ 'lock-remaining' ] )
+        relay = "relay {}".format( d[ 'state' ] )
+        if d[ 'state' ] != 'idle' and d.get( 'since' ) is not None:
+            relay = "{} since {}".format( relay, when( d[ 'since' ] ))
+        print( "  {}: {}, last reset {}{}".format( name, relay,
+            when( d.get( 'last-reset' )), lock ))
+
+    for ( host, h ) in sorted( reply.get( 'hosts', {} ).items()):
+        if h[ 'rtt' ] is None:
+            result = "no answer"
+        else:
+            result = "{:.1f} ms".format( h[ 'rtt' ] * 1000 )
+        print( "  {}: {} at {}".format( host, result, when( h[ 'time' ] )))
+
+    peers = reply.get( 'peers' )
+    if peers is not None:
+        print( "peers of {}:".format( peers[ 'id' ] ))
+        for ( address, p ) in sorted( peers[ 'peers' ].items()):
+            print( "  {}: {}, last heard {}".format( address,
+                p[ 'id' ] or "unknown", when( p[ 'heard' ] )))
+        for ( name, lease ) in sorted( peers[ 'leases' ].items()):
+            print( "  {}: being reset by {}, for {:d} secs more".format(
+                name, lease[ 'holder' ], lease[ 'remaining' ] ))
+
+
+def main( argv ):
+    """the control subcommand
+
+    Arguments:
+        1:  command-line arguments, starting with the program name
+            and 'control'
+    Returns:
+        0:  ok
+        1:  not ok
+    """
+
+    progname  = os.path.basename( argv[0] ) + " " + argv[1]
+    lock_file = "/tmp/pi-power-relay--reset-time"
+    path      = ""
+    json_flag = False
+    words     = []
+
+    num_args = len( argv )
+    i = 2
+    while i < num_args:
+        try:
+            arg = argv[i]
+            if arg == '-h' or arg == '--help':
+                print( "usage: {} [options]* command [device]". \
+                    format( progname ))
+                print( """\
+        [-h|--help]                print this help info
+        [-j|--json]                print the reply as JSON
+        [-L|--lockfile string]     lock-file of the daemon ({})
+        [-S|--socket string]       control socket (lock-file with .sock)
+        commands: {}\
+        """.format( lock_file, ', '.join( COMMANDS )))
+                return(0)
+            elif arg == '-j' or arg == '--json':
+                json_flag = True
+            elif arg == '-L' or arg == '--lockfile':
+                i = i + 1 ; lock_file = argv[i]
+            elif arg == '-S' or arg == '--socket':
+                i = i + 1 ; path = argv[i]
+            elif arg.startswith( '-' ):
+                raise Exception( "unknown option: {}".format( arg ))
+            else:
+                words.append( arg )
+        except IndexError:
+            sys.stderr.write( "{}: missing value for {}\n".format(
+                progname, argv[ i - 1 ] ))
+            return(1)
+        except Exception as err:
+            sys.stderr.write( "{}: {}\n".format( progname, err ))
+            return(1)
+        i = i + 1
+
+    if len( words ) == 0 or len( words ) > 2:
+        sys.stderr.write( "{}: give a command, and optionally a device\n". \
+            format( progname ))
+        return(1)
+    if words[0] not in COMMANDS:
+        sys.stderr.write( "{}: unknown command: {} (use one of {})\n". \
+            format( progname, words[0], ', '.join( COMMANDS )))
+        return(1)
+
+    req = { 'command': words[0] }
+    if len( words ) > 1:
+        req[ 'device' ] = words[1]
+    if not path:
+        path = socket_filename( lock_file )
+
+    try:
+        reply = request( path, req )
+    except ( IOError, OSError ) as err:
+        if err.errno in ( errno.ENOENT, errno.ECONNREFUSED ):
+            err = "no daemon listening on {}".format( path )
+        sys.stderr.write( "{}: {}\n".format( progname, err ))
+        return(1)
+    except Exception as err:
+        sys.stderr.write( "{}: {}\n".format( progname, err ))
+        return(1)
+
+    if json_flag:
+        print( json.dumps( reply, indent=2, sort_keys=True ))
+    elif not reply.get( 'ok' ):
+        pass
+    elif req[ 'command' ] == 'status':
+        show_status( reply )
+    elif reply.get( 'message' ):
+        print( reply[ 'message' ] )
+
+    if not reply.get( 'ok' ):
+        sys.stderr.write( "{}: {}\n".format( progname,
+                                             reply.get( 'error', 'failed' )))
+        return(1)
+    return(0)
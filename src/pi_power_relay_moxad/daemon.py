@@ -0,0 +1,374 @@
+"""daemon mode
+
+Instead of being started from the cron every couple of minutes, the
+program can be started once with --daemon.  It then runs the same
+check -> lock -> reset pipeline every --interval seconds, keeping its
+state in memory between checks, until it gets a SIGTERM or SIGINT.
+
+With --netlink, changes to the local network also start a check
+straight away (see netlink.py).  Each check that finds the network up,
+with no change in between, doubles the time to the next, up to
+--idle-interval.  A change, or the network being down, goes back to
+checking every --interval.
+
+With --control, the daemon can be asked for its status, to reset a
+device, and so on, over a Unix socket (see control.py).
+
+With --peers, it agrees with other daemons watching the same devices
+which of them resets each one (see peers.py).
+
+A SIGHUP reads the options and --config file again.  The new options
+are swapped in between checks, so a check in progress finishes with the
+ones it started with, and power cycles carry on, since their relays
+are kept in the state, not the options.
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+
+from . import globals
+from . import metrics
+from . import clock
+from .functions import dprint, read_timestamp
+
+NETLINK_SETTLE = 2      # secs to let a burst of network changes finish
+
+
+class Daemon( object ):
+    """run a check function on a schedule until told to stop
+
+    Arguments to constructor:
+        1:  options dictionary built by main()
+        2:  check function.  Called as check( opts, state )
+        3:  optional reset function, for the control socket.  Called
+            as reset( opts, state, device ), returning the Relay started
+        4:  optional function to read the options again.  Called as
+            load( opts ), returning the new options
+    """
+
+    def __init__( self, opts, check, reset=None, load=None ):
+        self.opts   = opts
+        self.check  = check
+        self.reset  = reset
+        self.load   = load
+        self.reload_wanted = False
+        self.state  = {}
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.changes    = []
+        self.lock       = threading.Lock()
+        self.check_lock = threading.Lock()  # a check or reset at a time
+        self.paused     = False
+        self.probes     = {}                # host -> ( time, rtt )
+
+    def stop( self, signum=None, frame=None ):
+        """ask the daemon to stop after the current check"""
+
+        dprint( "Daemon.stop(): got signal {}. stopping".format( signum ))
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def hangup( self, signum=None, frame=None ):
+        """ask the daemon to reload its options"""
+
+        self.reload_wanted = True
+        self.wake_event.set()
+
+    def network_changed( self, change ):
+        """ask for a check now.  Called by the netlink watcher
+
+        Arguments:
+            1:  description of the change
+        """
+
+        metrics.inc( 'netlink_events_total' )
+        with self.lock:
+            self.changes.append( change )
+        self.wake_event.set()
+
+    def probe_seen( self, host, rtt, backend=None ):
+        """keep the last probe of each host.  For globals.probe_hooks"""
+
+        self.probes[ host ] = ( clock.now(), rtt )
+
+    def control( self, request ):
+        """answer a request from the control socket
+
+        Arguments:
+            1:  request dictionary, with 'command' and maybe 'device'
+        Returns:
+            reply dictionary
+        Exceptions:
+            Exception, to be sent back as an error
+        """
+
+        command = request.get( 'command' )
+        if command == 'status':
+            return( self.status())
+
+        if command == 'force-reset':
+            name = self.device_name( request.get( 'device' ))
+            # wait for any check, so the reset can't overlap one
+            with self.check_lock:
+                relay = self.reset( self.opts, self.state, name )
+            if relay is None:
+                raise Exception( "reset of {} already in progress". \
+                    format( name ))
+            return({ 'ok': True, 'message': "resetting {}".format( name ) })
+
+        if command == 'check':
+            self.wake_event.set()
+            return({ 'ok': True, 'message': "checking now" })
+
+        if command == 'pause':
+            self.paused = True
+            return({ 'ok': True, 'message': "paused" })
+
+        if command == 'resume':
+            self.paused = False
+            self.wake_event.set()
+            return({ 'ok': True, 'message': "resumed" })
+
+        if command == 'reload':
+            self.reload()
+            return({ 'ok': True, 'message': "reloaded" })
+
+        raise Exception( "unknown command: {}".format( command ))
+
+    def device_name( self, name ):
+        """return the device a request is for
+
+        Arguments:
+            1:  name given, or None
+        Returns:
+            device name
+        Exceptions:
+            Exception if there is no such device, or none was given and
+            there is more than one
+        """
+
+        names = [ d[ 'device-name' ] for d in self.opts[ 'devices' ] ]
+        if name is None:
+            if len( names ) != 1:
+                raise Exception( "which device? ({})".format(
+                    ', '.join( names )))
+            return( names[0] )
+        if name not in names:
+            raise Exception( "no device {} ({})".format( name,
+                                                        ', '.join( names )))
+        return( name )
+
+    def reload( self ):
+        """read the options again, and forget what was read from the
+        lock-files, to read them again
+
+        Exceptions:
+            Exception if the new options are no good.  The old ones
+            stay in use
+        """
+
+        opts = self.opts
+        if self.load is not None:
+            opts = self.load( self.opts )
+
+        # wait for any check to finish with the old options
+        with self.check_lock:
+            self.opts = opts
+            self.state.pop( 'maint-until', None )
+            for device in opts[ 'devices' ]:
+                dstate = self.state.get( device[ 'device-name' ] )
+                if dstate is not None:
+                    dstate.pop( 'last-reset', None )
+        dprint( "Daemon.reload(): reloaded" )
+
+    def status( self ):
+        """return the status reply for the control socket"""
+
+        now = clock.now()
+        devices = {}
+        for device in self.opts[ 'devices' ]:
+            name   = device[ 'device-name' ]
+            dstate = self.state.get( name, {} )
+            relay  = dstate.get( 'relay' )
+            last   = dstate.get( 'last-reset' )
+            if 'last-reset' not in dstate:
+                last = read_timestamp( device[ 'lock-file' ] )
+            remaining = 0
+            if last is not None:
+                remaining = max( 0, int( last + device[ 'wait-time' ] - now ))
+            relay_status = { 'state': 'idle', 'since': None }
+            if relay is not None:
+                relay_status = relay.status()
+            devices[ name ] = { 'state':          relay_status[ 'state' ],
+                                'since':          relay_status[ 'since' ],
+                                'up':             dstate.get( 'up' ),
+                                'last-reset':     last,
+                                'lock-remaining': remaining }
+
+        hosts = {}
+        for ( host, ( when, rtt )) in list( self.probes.items()):
+            hosts[ host ] = { 'time': when, 'rtt': rtt }
+
+        reply = { 'ok':          True,
+                  'pid':         os.getpid(),
+                  'paused':      self.paused,
+                  'last-check':  self.state.get( 'last-check' ),
+                  'network-up':  self.state.get( 'network-up' ),
+                  'maint-until': self.state.get( 'maint-until' ),
+                  'devices':     devices,
+                  'hosts':       hosts }
+        if self.opts.get( 'peers' ) is not None:
+            reply[ 'peers' ] = self.opts[ 'peers' ].status()
+        return( reply )
+
+    def next_interval( self, interval, changed ):
+        """return the time until the next check
+
+        Arguments:
+            1:  the time used before the last check
+            2:  True if the network changed since then
+        Returns:
+            seconds
+        """
+
+        base = self.opts[ 'interval' ]
+        if not self.opts.get( 'netlink-flag' ):
+            return( base )
+        if changed or not self.state.get( 'network-up', True ):
+            return( base )
+        return( min( interval * 2, self.opts[ 'idle-interval' ] ))
+
+    def run_once( self ):
+        """run the check function once, reporting any errors
+
+        Returns:
+            0:  ok
+            1:  the check raised an exception
+        """
+
+        try:
+            with self.check_lock:
+                return( self.check( self.opts, self.state ))
+        except Exception as err:
+            sys.stderr.write( "{}: check failed: {}\n".format(
+                globals.progname, err ))
+            return(1)
+
+    def run( self ):
+        """run checks every interval until stopped
+
+        Returns:
+            0
+        """
+
+        interval = self.opts[ 'interval' ]
+
+        signal.signal( signal.SIGTERM, self.stop )
+        signal.signal( signal.SIGINT, self.stop )
+        signal.signal( signal.SIGHUP, self.hangup )
+
+        server = None
+        if self.opts.get( 'metrics-port' ):
+            server = metrics.serve( self.opts[ 'metrics-port' ] )
+
+        watcher = None
+        if self.opts.get( 'netlink-flag' ):
+            from .netlink import Watcher
+            watcher = Watcher( self.network_changed )
+            try:
+                watcher.start()
+            except Exception as err:
+                sys.stderr.write( "{}: {}.  polling only\n".format(
+                    globals.progname, err ))
+                watcher = None
+
+        control = None
+        if self.opts.get( 'control-flag' ):
+            from .control import Server
+            globals.probe_hooks.append( self.probe_seen )
+            control = Server( self.opts[ 'control-socket' ], self.control )
+            try:
+                control.start()
+            except Exception as err:
+                sys.stderr.write( "{}: {}.  no control socket\n".format(
+                    globals.progname, err ))
+                control = None
+
+        dprint( "Daemon.run(): checking every {0:d} seconds". \
+            format( interval ))
+
+        next_time = time.time()
+        while not self.stop_event.is_set():
+            self.wake_event.clear()
+            with self.lock:
+                changed = len( self.changes ) > 0
+                self.changes = []
+            if self.paused:
+                dprint( "Daemon.run(): paused.  not checking" )
+            else:
+                self.run_once()
+
+            # keep to the schedule, rather than drifting by however
+            # long the check took.  If we overran, start again now.
+            new_interval = self.next_interval( interval, changed )
+            if new_interval != interval:
+                dprint( "Daemon.run(): now checking every {0:d} seconds". \
+                    format( new_interval ))
+                interval = new_interval
+            next_time = next_time + interval
+            now = time.time()
+            if next_time < now:
+                next_time = now
+
+            # no point checking again until a maintenance window ends
+            until = self.state.get( 'maint-until' )
+            if until is not None and until > next_time:
+                dprint( "Daemon.run(): in maintenance for {0:d} seconds". \
+                    format( int( until - now )))
+                next_time = until
+            self.wake_event.wait( next_time - now )
+            if self.stop_event.is_set():
+                break
+
+            if self.reload_wanted:
+                self.reload_wanted = False
+                try:
+                    self.reload()
+                except Exception as err:
+                    sys.stderr.write( "{}: {}\n".format( globals.progname,
+                                                         err ))
+
+            if self.changes:
+                # a change usually comes with others, such as carrier
+                # then an address then a route.  Check once they are in
+                self.stop_event.wait( NETLINK_SETTLE )
+                with self.lock:
+                    dprint( "Daemon.run(): network changed: {}". \
+                        format( '; '.join( self.changes )))
+            if self.wake_event.is_set():
+                next_time = time.time()
+
+        if control is not None:
+            control.stop()
+
+        if watcher is not None:
+            watcher.stop()
+
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+        # don't leave a device without power, as the pins are let go
+        with self.check_lock:
+            for dstate in self.state.values():
+                relay = None
+                if isinstance( dstate, dict ):
+                    relay = dstate.get( 'relay' )
+                if relay is not None and relay.busy():
+                    relay.cancel()
+
+        dprint( "Daemon.run(): stopped" )
+        return(0)
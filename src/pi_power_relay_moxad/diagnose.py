@@ -0,0 +1,166 @@
+"""find where the network is broken, before resetting anything (--diagnose)
+
+The path from the Pi to the internet is taken in stages:
+
+    link        the Pi's own interface: a default route, and carrier on
+                the interface it goes through.  Read from /proc and /sys
+    gateway     the LAN gateway of the default route, or --gateway
+    modem       the management address of the modem (--modem), such as
+                192.168.100.1
+    wan         the hosts of the device
+
+The fault is the first stage, in that order, that doesn't work.  A
+device is only reset if the fault is in a stage it is responsible for
+(--reset-stages).  An unplugged cable or a dead LAN switch then doesn't
+power cycle the modem, which would only add to the outage.
+
+The link is checked before any probes are sent, since it costs nothing,
+and no probes are sent if it is down.  The gateway and modem are only
+probed once the WAN hosts have failed, so a healthy network costs no
+more probes than without --diagnose.
+"""
+
+import os
+import socket
+import struct
+
+from .functions import dprint, ping
+from .constants import LINK, GATEWAY, MODEM, WAN, STAGES, RESET_STAGES
+
+PROC_ROUTE      = '/proc/net/route'
+PROC_IPV6_ROUTE = '/proc/net/ipv6_route'
+SYS_NET         = '/sys/class/net'
+
+RTF_UP      = 0x0001
+RTF_GATEWAY = 0x0002
+
+
+def default_route():
+    """return the default route, from /proc
+
+    The IPv4 default route with the lowest metric is used.  Without
+    one, an IPv6 default route is looked for, without a gateway.
+
+    Returns:
+        ( interface, gateway ), with gateway None if the route doesn't
+        go through one, or None if there is no default route
+    """
+
+    best = None
+    try:
+        with open( PROC_ROUTE, "r" ) as f:
+            f.readline()                    # column headings
+            for line in f:
+                fields = line.split()
+                if len( fields ) < 8:
+                    continue
+                ( iface, dest, gw, flags ) = fields[ :4 ]
+                ( metric, mask ) = ( int( fields[6] ), fields[7] )
+                flags = int( flags, 16 )
+                if dest != '00000000' or mask != '00000000' or \
+                   not ( flags & RTF_UP ):
+                    continue
+                if best is not None and metric >= best[2]:
+                    continue
+                gateway = None
+                if flags & RTF_GATEWAY:
+                    gateway = socket.inet_ntoa( struct.pack( '<L',
+                                                             int( gw, 16 )))
+                best = ( iface, gateway, metric )
+    except ( IOError, OSError, ValueError ):
+        pass
+
+    if best is not None:
+        return( best[0], best[1] )
+
+    try:
+        with open( PROC_IPV6_ROUTE, "r" ) as f:
+            for line in f:
+                fields = line.split()
+                if len( fields ) >= 10 and fields[0] == '0' * 32 and \
+                   fields[1] == '00' and fields[9] != 'lo':
+                    return( fields[9], None )
+    except ( IOError, OSError ):
+        pass
+
+    return( None )
+
+
+def link_state( iface ):
+    """return if an interface is up, with carrier, from /sys
+
+    Arguments:
+        1:  interface name
+    Returns:
+        ( ok, reason ).  reason says what is wrong, if not ok
+    """
+
+    base = os.path.join( SYS_NET, iface )
+
+    try:
+        with open( os.path.join( base, 'operstate' ), "r" ) as f:
+            operstate = f.read().strip()
+    except ( IOError, OSError ):
+        return( False, "no interface {}".format( iface ))
+
+    # carrier can't be read while the interface is administratively down
+    try:
+        with open( os.path.join( base, 'carrier' ), "r" ) as f:
+            carrier = f.read().strip()
+    except ( IOError, OSError ):
+        return( False, "interface {} is down".format( iface ))
+
+    if carrier != '1':
+        return( False, "no carrier on {}".format( iface ))
+
+    # 'unknown' is normal for interfaces that don't report their state
+    if operstate not in ( 'up', 'unknown' ):
+        return( False, "interface {} is {}".format( iface, operstate ))
+
+    return( True, None )
+
+
+def check_link():
+    """the link stage
+
+    Returns:
+        ( ok, reason, gateway ).  reason says what is wrong, if not ok.
+        gateway is that of the default route, or None
+    """
+
+    route = default_route()
+    if route is None:
+        return( False, "link: no default route", None )
+
+    ( iface, gateway ) = route
+    ( ok, reason ) = link_state( iface )
+    if not ok:
+        return( False, "link: " + reason, gateway )
+
+    dprint( "check_link(): default route via {0:s}, gateway {1}". \
+        format( iface, gateway ))
+    return( True, None, gateway )
+
+
+def locate( gateway, modem, tries=3, timeout=2, backend='system' ):
+    """find the stage at fault, once the WAN hosts have not answered
+
+    Arguments:
+        1:  gateway address, or None to skip the stage
+        2:  modem management address, or None to skip the stage
+        3:  tries for each
+        4:  timeout for each try
+        5:  probe backend
+    Returns:
+        ( stage, reason ).  The stage is WAN if the gateway and modem
+        answered
+    """
+
+    if gateway:
+        if not ping( gateway, tries, timeout, backend ):
+            return( GATEWAY, "gateway: no answer from {}".format( gateway ))
+    if modem:
+        if not ping( modem, tries, timeout, backend ):
+            return( MODEM, "modem: no answer from {}".format( modem ))
+
+    return( WAN, "wan: no answer from the hosts" )
@@ -0,0 +1,228 @@
+"""structured event log (--event-log)
+
+Every decision is written to the event log as a line of JSON, so it
+can be read by a program, such as the report subcommand:
+
+    {"event": "reset", "device": "modem", "reason": "network unreachable",
+     "t": 1792537200.123}
+
+Each has 't', the time in seconds since the epoch, to the millisecond,
+and 'event', one of:
+
+    probe           a probe of a host: host, backend, rtt (secs, or
+                    null if no answer)
+    check           the result of a check: up, and devices, the name
+                    of each device and whether it is up
+    maint-skip      a check skipped for a maintenance window: until
+    local-fault     a fault --diagnose found that resets nothing:
+                    stage, reason
+    lock-skip       a reset not done because of the timing lock:
+                    device, since (secs since the last reset), wait
+    busy-skip       a reset not done since one is still in progress:
+                    device, state
+    reset           a reset started: device, reason, forced
+    power-on        power back on after a reset: device
+    recovery        the device answering after a reset: device, secs
+                    (null if it did not recover within --delay-exit)
+    claim-lost      a reset left to a peer that claimed the device
+                    first (see peers.py): device, peer
+    peer-skip       a device not probed or reset, since a peer is
+                    resetting it: device, peer
+    peer-reset      a reset made by a peer, taken as ours for the
+                    timing lock: device, peer
+
+Events are kept in a buffer and written together, to save writes to
+the SD card.  From the cron, they are written as the run ends.  The
+daemon writes them every FLUSH_INTERVAL seconds, or once FLUSH_BYTES
+have built up, and resets and recoveries straight away.  With the
+'flush' fsync policy, each write is synced to the card; with 'always',
+every event is written and synced as it happens; with 'never', that is
+left to the kernel.
+
+Once the log grows past --event-max-size, or its first event is older
+than --event-max-age, it is rotated: compressed to file.1.gz, with
+file.1.gz moved to file.2.gz, and so on, keeping --event-keep of them.
+
+Only one run writes the log at a time, since it is only written by the
+run holding the instance lock (see instance_lock()).
+
+The --logfile text log, written by logit(), is kept as it was rather
+than sent through here.  It is for people, and for scripts written
+against its lines, which report.py reads too.  It only has the resets,
+faults and recoveries, each written as it happens, so it stays small
+and is complete after a crash, when events in the buffer are lost.  The
+event log is for programs, and has every probe and check.  Either, or
+both, can be given.
+"""
+
+import os
+import sys
+import json
+import threading
+
+from .functions import dprint
+from . import globals
+from . import timing
+from . import clock
+from .constants import FSYNC_POLICIES, FLUSH_INTERVAL
+
+FLUSH_BYTES    = 64 * 1024
+URGENT         = ( 'reset', 'power-on', 'recovery', 'local-fault',
+                   'claim-lost' )
+
+
+class EventLog( object ):
+    """a buffered, rotated log of JSON events
+
+    Arguments to constructor:
+        1:  filename
+        2:  fsync policy: always, flush or never.  default = flush
+        3:  bytes to rotate at, or 0 for no limit.  default = 1 MB
+        4:  secs to rotate at, or 0 for no limit.  default = 0
+        5:  number of rotated logs to keep.  default = 5
+        6:  most secs to keep events before writing them, or 0 to
+            only write them on flush().  default = 0
+    """
+
+    def __init__( self, file, fsync='flush', max_size=1024 * 1024,
+                  max_age=0, keep=5, flush_interval=0 ):
+        self.file     = file
+        self.fsync    = fsync
+        self.max_size = max_size
+        self.max_age  = max_age
+        self.keep     = keep
+        self.flush_interval = flush_interval
+        self.buffer   = []
+        self.buffered = 0           # bytes
+        self.first    = None        # time of first event in the file
+        self.f        = None
+        self.size     = 0
+        self.last_flush = clock.now()
+        self.lock     = threading.Lock()
+
+    def log( self, event, **fields ):
+        """add an event
+
+        Arguments:
+            1:  event name
+            2:  keyword arguments: the fields of the event
+        """
+
+        now = clock.now()
+        fields[ 'event' ] = event
+        fields[ 't' ]     = round( now, 3 )
+        line = json.dumps( fields, sort_keys=True ) + "\n"
+
+        with self.lock:
+            self.buffer.append(( now, line ))
+            self.buffered = self.buffered + len( line )
+            if self.fsync == 'always' or event in URGENT or \
+               self.buffered >= FLUSH_BYTES or \
+               ( self.flush_interval and
+                 now - self.last_flush >= self.flush_interval ):
+                self._flush()
+
+    def probe( self, host, rtt, backend=None ):
+        """log a probe.  Can be used in globals.probe_hooks"""
+
+        if rtt is not None:
+            rtt = round( rtt, 6 )
+        self.log( 'probe', host=host, backend=backend, rtt=rtt )
+
+    def flush( self ):
+        """write any events in the buffer"""
+
+        with self.lock:
+            self._flush()
+
+    def close( self ):
+        """write any events in the buffer, and close the file"""
+
+        with self.lock:
+            self._flush()
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+    def _open( self ):
+        self.f = open( self.file, "a" )
+        self.size = os.fstat( self.f.fileno()).st_size
+        self.first = None
+        if self.size:
+            # the age of the log is that of its first event
+            try:
+                with open( self.file, "r" ) as f:
+                    self.first = json.loads( f.readline())[ 't' ]
+            except ( ValueError, KeyError, TypeError ):
+                self.first = os.stat( self.file ).st_mtime
+
+    def _flush( self ):
+        self.last_flush = clock.now()
+        if not self.buffer:
+            return
+
+        with timing.span( 'event_log' ):
+            try:
+                if self.f is None:
+                    self._open()
+                if self._rotate_due():
+                    self._rotate()
+                    self._open()
+                if self.first is None:
+                    self.first = self.buffer[0][0]
+                data = ''.join( line for ( t, line ) in self.buffer )
+                self.f.write( data )
+                self.f.flush()
+                if self.fsync != 'never':
+                    os.fsync( self.f.fileno())
+                self.size = self.size + len( data )
+            except ( IOError, OSError ) as err:
+                sys.stderr.write( "{}: can't write event log: {}\n".format(
+                    globals.progname, err ))
+                if self.f is not None:
+                    self.f.close()
+                    self.f = None
+
+        self.buffer   = []
+        self.buffered = 0
+
+    def _rotate_due( self ):
+        if self.size == 0:
+            return( False )
+        if self.max_size and self.size + self.buffered > self.max_size:
+            return( True )
+        if self.max_age and self.first is not None and \
+           self.buffer[-1][0] - self.first >= self.max_age:
+            return( True )
+        return( False )
+
+    def _rotate( self ):
+        """compress the log to file.1.gz, moving the older ones up"""
+
+        import gzip
+        import shutil
+
+        self.f.close()
+        self.f = None
+
+        def rotated( n ):
+            return( "{}.{:d}.gz".format( self.file, n ))
+
+        if self.keep == 0:
+            os.unlink( self.file )
+            return
+
+        for n in range( self.keep, 0, -1 ):
+            if os.path.exists( rotated( n )):
+                if n == self.keep:
+                    os.unlink( rotated( n ))
+                else:
+                    os.rename( rotated( n ), rotated( n + 1 ))
+
+        tmp = rotated(1) + ".tmp"
+        with open( self.file, "rb" ) as f_in:
+            with gzip.open( tmp, "wb" ) as f_out:
+                shutil.copyfileobj( f_in, f_out )
+        os.rename( tmp, rotated(1) )
+        os.unlink( self.file )
+        dprint( "EventLog._rotate(): rotated {0:s}".format( self.file ))
@@ -0,0 +1,176 @@
+"""stand-ins for the network and GPIO, for benchmarks and trying things
+
+FakeNetwork is a probe backend whose hosts answer after a set
+round-trip time, lose a fraction of probes, and can be given outages:
+
+    net = FakeNetwork()
+    net.add_host( '8.8.8.8', rtt=0.02, loss=0.1 )
+    net.outage( start=time.time() + 5, length=60 )
+    probes.register( 'fake', net.probe )
+
+FakeGPIO is a GPIO driver (see gpio.py) that records every pin change
+instead of driving a real pin, for the 'gpio' option of a check:
+
+    opts[ 'gpio' ] = FakeGPIO()
+
+Neither needs a Raspberry Pi or a network.
+"""
+
+import time
+import random
+import threading
+
+from . import clock
+from .gpio import HIGH
+
+
+class FakeNetwork( object ):
+    """hosts with scripted latency, loss and outages
+
+    Arguments to constructor:
+        1:  time scale.  Every sleep is multiplied by this, so a
+            benchmark can run a slow network quickly.  default = 1.0
+        2:  seed for the random number generator used for loss
+    """
+
+    def __init__( self, time_scale=1.0, seed=None ):
+        self.time_scale = time_scale
+        self.hosts   = {}
+        self.outages = []           # ( start, end, hosts or None )
+        self.probes  = 0
+        self.random  = random.Random( seed )
+        self.lock    = threading.Lock()
+
+    def add_host( self, host, rtt=0.02, loss=0.0 ):
+        """add a host
+
+        Arguments:
+            1:  host
+            2:  round-trip time in seconds.  default = 0.02
+            3:  fraction of probes lost, 0 to 1.  default = 0
+        """
+
+        self.hosts[ host ] = { 'rtt': rtt, 'loss': loss }
+
+    def outage( self, start, length, hosts=None ):
+        """make hosts unreachable for a while
+
+        Arguments:
+            1:  time the outage starts (seconds since epoch)
+            2:  seconds it lasts.  None for one that never ends
+            3:  optional list of hosts.  default is all of them
+        """
+
+        end = None
+        if length is not None:
+            end = start + length
+        self.outages.append(( start, end, hosts ))
+
+    def reachable( self, host, now=None ):
+        """True if a host is known and not in an outage"""
+
+        if host not in self.hosts:
+            return( False )
+        if now is None:
+            now = clock.now()
+        for ( start, end, hosts ) in self.outages:
+            if hosts is not None and host not in hosts:
+                continue
+            if now >= start and ( end is None or now < end ):
+                return( False )
+        return( True )
+
+    def probe( self, host, timeout=2, cancel=None ):
+        """probe a host.  Has the arguments of a probes.BACKENDS function
+
+        Returns:
+            round-trip time in seconds, or None if no reply
+        """
+
+        with self.lock:
+            self.probes = self.probes + 1
+            lost = self.random.random() < self.hosts.get( host,
+                                                { 'loss': 0 } )[ 'loss' ]
+
+        if self.reachable( host ) and not lost:
+            rtt = self.hosts[ host ][ 'rtt' ]
+            if rtt < timeout:
+                if self._sleep( rtt, cancel ):
+                    return( None )
+                return( rtt )
+
+        self._sleep( timeout, cancel )
+        return( None )
+
+    def _sleep( self, secs, cancel ):
+        """sleep for scaled secs.  Returns True if cancelled"""
+
+        secs = secs * self.time_scale
+        if cancel is None:
+            clock.sleep( secs )
+            return( False )
+        return( clock.wait( cancel, secs ))
+
+
+class FakeGPIO( object ):
+    """a GPIO driver that records pin changes
+
+    Each change is kept in events as ( time, pin, value ).
+    """
+
+    def __init__( self ):
+        self.events = []
+        self.pins   = {}
+        self.lock   = threading.Lock()
+        self.changed = threading.Condition( self.lock )
+
+    def setup( self, pin ):
+        pass
+
+    def set( self, pin, value ):
+        with self.lock:
+            self.pins[ pin ] = value
+            self.events.append(( clock.now(), pin, value ))
+            self.changed.notify_all()
+
+    def release( self, pin ):
+        pass
+
+    def close( self ):
+        pass
+
+    def first( self, pin, value ):
+        """return the time a pin was first set to value, or None"""
+
+        with self.lock:
+            for ( when, p, v ) in self.events:
+                if p == pin and v == value:
+                    return( when )
+        return( None )
+
+    def wait_for( self, pin, value, timeout=None ):
+        """wait until a pin has been set to value
+
+        Arguments:
+            1:  pin
+            2:  value
+            3:  optional maximum seconds to wait
+        Returns:
+            time the pin was set, or None if timed out
+        """
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        with self.lock:
+            while True:
+                for ( when, p, v ) in self.events:
+                    if p == pin and v == value:
+                        return( when )
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return( None )
+                self.changed.wait( remaining )
@@ -1,17 +1,16 @@
 import os
 import sys
 import time
-import re
+import errno
+import threading
 
 from . import globals
+from . import timing
+from . import clock
 
-# see if we are running on a raspberry Pi
-try:
-    if os.uname()[4].lower().startswith( 'arm' ):
-        import RPi.GPIO as GPIO
-except ModuleNotFoundError as err:
-    sys.stderr.write( "Error: missing module: %s\n" % err )
-    sys.exit(1)
+STATE_VERSION = 2       # of the lock-file
+
+_state_lock = threading.Lock()
 
 
 def num_too_big( num, max ):
@@ -51,13 +50,14 @@ def dprint( str ):
     return None
 
 
-def ping( host, tries=3, timeout=2 ):
+def ping( host, tries=3, timeout=2, backend='system' ):
     """ping a host
 
     Arguments:
         1:  host
         2:  number of tries
         3:  timeout for ping
+        4:  probe backend (see probes.BACKENDS).  default = 'system'
     Returns:
         0:  down
         1:  up
@@ -65,16 +65,42 @@ def ping( host, tries=3, timeout=2 ):
 
     my_name = sys._getframe().f_code.co_name
 
+    from . import probes
+    ( use_backend, address ) = probes.split_target( host, backend )
+
     for i in range( tries ):
-        response = os.system( "ping -c 1 -w" + str(timeout) + " " + 
-                              host + " > /dev/null 2>&1" )
+        with timing.span( 'ping try', host=host, attempt=i+1 ):
+            rtt = None
+            if use_backend == 'system':
+                start = time.time()
+                pipe = os.popen( "ping -c 1 -w" + str(timeout) + " " +
+                                 probes.address_of( address ) + " 2>&1" )
+                output = pipe.read()
+                response = 0
+                if pipe.close() is not None:
+                    response = 1
+                # the time ping reports, since timing the command adds
+                # starting the shell and ping.  That is only a fall-back
+                if response == 0:
+                    rtt = probes.ping_time( output )
+                    if rtt is None:
+                        rtt = time.time() - start
+                report_probe( host, rtt, backend )
+            else:
+                rtt = probe_once( host, timeout, backend=backend )
+                response = 1
+                if rtt is not None:
+                    response = 0
+                report_probe( host, rtt, backend )
 
         state = "down"
         if response == 0:
             state = "up"
+        if rtt is not None:
+            state = "{0:s}, rtt={1:.1f}ms".format( state, rtt * 1000 )
 
-        msg = "ping response (timeout={0:d}) for {1:s} is {2:d} ({3:s})". \
-            format( timeout, host, response, state )
+        msg = "{0:s} response (timeout={1:d}) for {2:s} is {3:d} ({4:s})". \
+            format( use_backend, timeout, host, response, state )
 
         dprint( "{0:s}(): try #{1:d} {2:s}".format( my_name, i+1, msg ))
 
@@ -84,101 +110,405 @@ def ping( host, tries=3, timeout=2 ):
     return(0)   # down
 
 
-def test_network( hosts, tries=3, timeout=2 ):
-    """test if network reachable given an array of hosts to ping
+def report_probe( host, rtt, backend='system' ):
+    """pass the result of a probe on to everything in globals.probe_hooks
 
     Arguments:
-        1:  array of hosts
-        2:  number of pings to try for each host in host-list
+        1:  host
+        2:  round-trip time in seconds, or None if no answer
+        3:  probe backend.  default = 'system'
+    Returns:
+        None
+    Globals:
+        globals.probe_hooks
+    """
+
+    for hook in globals.probe_hooks:
+        try:
+            hook( host, rtt, backend )
+        except Exception as err:
+            dprint( "report_probe(): hook {} failed: {}".format( hook, err ))
+
+    return None
+
+
+def probe_once( host, timeout=2, cancel=None, backend='system' ):
+    """send a single probe to a host, which can be cancelled
+
+    Arguments:
+        1:  host
+        2:  timeout for the probe
+        3:  optional threading.Event.  When set, the probe is abandoned
+        4:  probe backend (see probes.BACKENDS).  default = 'system'
+    Returns:
+        round-trip time in seconds, or None if down (or cancelled)
+    """
+
+    from . import probes
+
+    with timing.span( 'probe', host=host, backend=backend ):
+        return( probes.probe( backend, host, timeout, cancel ))
+
+
+def test_networks_concurrent( groups, tries=3, timeout=2, backend='system',
+                              timeouts={}, quorums=None ):
+    """test several groups of hosts, probing all hosts and tries at once
+
+    Every try to every unique host is started at the same time.  A host
+    in more than one group is only probed once, and its result is used
+    for every group it is in.  A group is up as soon as its quorum of
+    hosts have answered, and down as soon as so many hosts have failed
+    every try that the quorum can't be reached.  When every group has
+    been decided, the outstanding probes are killed.  So the time to
+    decide the network is down is about the ping timeout, instead of
+    hosts * tries * timeout.
+
+    Arguments:
+        1:  array of arrays of hosts
+        2:  number of pings to try for each host
         3:  timeout for ping
+        4:  probe backend (see probes.BACKENDS).  default = 'system'
+        5:  optional dictionary of timeouts for particular hosts
+        6:  optional array of quorums, one per group.  default = 1 each
     Returns:
-        0:  down
-        1:  up
+        array of results, one per group:
+            0:  down
+            1:  up
     """
 
     my_name = sys._getframe().f_code.co_name
 
-    result = 0          # assume not reachable
+    if quorums is None:
+        quorums = [ 1 ] * len( groups )
+
+    hosts = unique_hosts( groups )
+    pending = dict(( host, tries ) for host in hosts )    # tries left
+    host_up = {}
+    results = [ None ] * len( groups )
+
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue   # python 2
+
+    cancel  = threading.Event()
+    answers = queue.Queue()
 
+    def worker( host, attempt ):
+        # always answer, or the count of answers below never comes
+        rtt = None
+        try:
+            rtt = probe_once( host, timeouts.get( host, timeout ), cancel,
+                              backend )
+        except Exception as err:
+            dprint( "{0:s}(): probe of {1:s} failed: {2}". \
+                format( my_name, host, err ))
+        finally:
+            answers.put(( host, attempt, rtt ))
+
+    threads = []
     for host in hosts:
-        dprint( "{0:s}(): testing host \'{1:s}\' with ping". \
-            format( my_name, host ))
-        response = ping( host, tries, timeout )
-        if response == 1:
-            result = 1       # host on network is reachable
+        for i in range( tries ):
+            t = threading.Thread( target=worker, args=( host, i + 1 ))
+            t.daemon = True
+            threads.append( t )
+
+    dprint( "{0:s}(): starting {1:d} concurrent {2:s} probes". \
+        format( my_name, len( threads ), backend ))
+    for t in threads:
+        t.start()
+
+    for n in range( len( threads )):
+        ( host, attempt, rtt ) = answers.get()
+        state = "down"
+        if rtt is not None:
+            state = "up rtt={0:.1f}ms".format( rtt * 1000 )
+        dprint( "{0:s}(): try #{1:d} for {2:s} is {3:s}". \
+            format( my_name, attempt, host, state ))
+        report_probe( host, rtt, backend )
+
+        pending[ host ] = pending[ host ] - 1
+        if rtt is not None:
+            host_up[ host ] = True
+
+        # see which groups can now be decided
+        for g in range( len( groups )):
+            if results[g] is None:
+                results[g] = quorum_result( groups[g], quorums[g],
+                                            host_up, pending )
+
+        if None not in results:
             break
 
-    state  = 'down'
-    if ( result == 1 ):
-        state = 'up'
+    # kill any probes still outstanding
+    cancel.set()
+    for t in threads:
+        t.join()
 
-    dprint( "{0:s}(): final result = {1:d} ({2:s})". \
-        format( my_name, result, state ))
+    # a group still not decided, such as with no tries, is down
+    results = [ 0 if r is None else r for r in results ]
 
-    return( result )
+    return( results )
 
 
-def reset_device( pin_num, wait_time, lock_file, vals={}, GPIO_active=True ):
-    """reset a device
+def quorum_result( hosts, quorum, host_up, pending=None ):
+    """decide a group of hosts, if it can be decided yet
 
     Arguments:
-        1:  GPIO pin number
-        2:  wait time between pin toggles
-        3:  lock-file
-        4:  optional values dictionary containing:
-                quiet-flag  (default = False)
-                device-name (default = 'device')
-        5:  flag if GPIO active.  default = True
+        1:  array of hosts
+        2:  number of hosts that must answer for the group to be up
+        3:  dictionary of host -> True if it answered, False if it is
+            known not to.  Hosts not in it are not decided yet
+        4:  optional dictionary of host -> tries still to come back.
+            A host with none left, that didn't answer, is down
     Returns:
-        0
+        1:      up.  enough hosts answered
+        0:      down.  too few hosts are left to make the quorum
+        None:   not decided yet
+    """
+
+    up = 0
+    undecided = 0
+    for host in hosts:
+        answered = host_up.get( host )
+        if answered:
+            up = up + 1
+        elif answered is None and ( pending is None or pending[ host ] > 0 ):
+            undecided = undecided + 1
+
+    if up >= quorum:
+        return(1)
+    if up + undecided < quorum:
+        return(0)
+    return( None )
+
+
+def unique_hosts( groups ):
+    """return the hosts of several groups, without duplicates, in order
+
+    Arguments:
+        1:  array of arrays of hosts
+    Returns:
+        array of hosts
+    """
+
+    seen = {}
+    hosts = []
+    for group in groups:
+        for host in group:
+            if host not in seen:
+                seen[ host ] = True
+                hosts.append( host )
+
+    return( hosts )
+
+
+def test_networks( groups, tries=3, timeout=2, concurrent=False,
+                   backend='system', timeouts={}, quorums=None ):
+    """test if the network is reachable for several groups of hosts
+
+    Each group is the list of hosts one device depends on.  A host in
+    more than one group is only probed once per call, and its result
+    is shared by every group it is in.  A group is up once its quorum of
+    hosts have answered, and down as soon as that can no longer happen,
+    without probing the rest of its hosts.
+
+    Arguments:
+        1:  array of arrays of hosts
+        2:  number of pings to try for each host
+        3:  timeout for ping
+        4:  probe all hosts and tries concurrently.  default = False
+        5:  probe backend (see probes.BACKENDS).  default = 'system'
+        6:  optional dictionary of timeouts for particular hosts
+        7:  optional array of quorums, one per group.  default = 1 each
+    Returns:
+        array of results, one per group:
+            0:  down
+            1:  up
     """
 
     my_name = sys._getframe().f_code.co_name
-    quiet_flag  = vals.get( 'quiet-flag', False )
-    device_name = vals.get( 'device-name', 'device' )
 
-    if GPIO_active:
-        GPIO.setmode( GPIO.BCM )
-        GPIO.setup( pin_num, GPIO.OUT )
+    if quorums is None:
+        quorums = [ 1 ] * len( groups )
+
+    if concurrent:
+        results = test_networks_concurrent( groups, tries, timeout, backend,
+                                            timeouts, quorums )
     else:
-        if not quiet_flag:
-            print( "GPIO not active.  simulating RESET of '{0:s}'". \
-                format( device_name ))
+        host_up = {}        # results of hosts already probed
+        results = []
+        for ( hosts, quorum ) in zip( groups, quorums ):
+            probed = {}
+            result = quorum_result( hosts, quorum, probed )
+            for host in hosts:
+                if result is not None:
+                    break
+                if host in host_up:
+                    dprint( "{0:s}(): re-using result for \'{1:s}\'". \
+                        format( my_name, host ))
+                else:
+                    dprint( "{0:s}(): testing host \'{1:s}\' with {2:s}". \
+                        format( my_name, host, backend ))
+                    host_up[ host ] = ping( host, tries,
+                        timeouts.get( host, timeout ), backend )
+                probed[ host ] = ( host_up[ host ] == 1 )
+                result = quorum_result( hosts, quorum, probed )
+            if result is None:
+                result = 0
+            results.append( result )
+
+    for g in range( len( groups )):
+        state  = 'down'
+        if ( results[g] == 1 ):
+            state = 'up'
+        dprint( "{0:s}(): final result for {1:s} = {2:d} ({3:s})". \
+            format( my_name, ','.join( groups[g] ), results[g], state ))
+
+    return( results )
+
+
+def test_network( hosts, tries=3, timeout=2, concurrent=False,
+                  backend='system', quorum=1 ):
+    """test if network reachable given an array of hosts to ping
+
+    Arguments:
+        1:  array of hosts
+        2:  number of pings to try for each host in host-list
+        3:  timeout for ping
+        4:  probe all hosts and tries concurrently.  default = False
+        5:  probe backend (see probes.BACKENDS).  default = 'system'
+        6:  number of hosts that must answer.  default = 1
+    Returns:
+        0:  down
+        1:  up
+    """
 
-    dprint( "{0:s}(): setting PIN {1:d} HIGH". \
-            format( my_name, pin_num ))
-    if GPIO_active:
-        GPIO.output( pin_num, GPIO.HIGH )
+    return( test_networks( [ hosts ], tries, timeout, concurrent,
+                           backend, {}, [ quorum ] )[0] )
 
-    dprint( "{0:s}(): sleeping for {1:d} seconds". \
-        format( my_name, wait_time ))
-    time.sleep( wait_time )
 
-    dprint( "{0:s}(): setting PIN {1:d} LOW". \
-            format( my_name, pin_num ))
-    if GPIO_active:
-        GPIO.output( pin_num, GPIO.LOW )
+def read_state( file, quiet=False ):
+    """read the state of a device from its lock-file
 
-        # shut it all down
-        GPIO.cleanup()
+    State file format (version 2) is a JSON object, with:
+        version         2
+        device          device name
+        last-reset      seconds since epoch of the last reset
+        reset-time      human readable string of it
+        reset-reason    why it was reset
+        probe           the last outcome of probing its hosts: up,
+                        reason if not up, and since (seconds since
+                        epoch) when it has been that way
+        addresses       the addresses of its hosts' names, as name ->
+                        [ address, seconds since epoch looked up ]
+    Version 1 files, of a timestamp line then a human readable line,
+    are still read.
 
-    write_timestamp( lock_file, vals )
+    Arguments:
+        1:  lock filename
+        2:  optional flag to not report a file that can't be understood
+    Returns:
+        state dictionary.  Empty if there is no file, or it can't be
+        understood, which is reported on stderr
+    """
 
-    return(0)
+    my_name = sys._getframe().f_code.co_name
+    with timing.span( 'read_state' ):
+        try:
+            with open( file, "r" ) as f:
+                dprint( "{}(): reading state in {}".format( my_name, file ))
+                data = f.read()
+        except ( IOError, OSError ) as err:
+            return({})          # no lock
+
+    line = data.split( "\n", 1 )[0].strip()
+    if is_int( line ):
+        return({ 'version': 1, 'last-reset': int( line ) })
+
+    import json
+
+    try:
+        state = json.loads( data )
+        if not isinstance( state, dict ):
+            raise ValueError( "not an object" )
+        if state.get( 'last-reset' ) is not None and \
+           not isinstance( state[ 'last-reset' ], int ):
+            raise ValueError( "bad last-reset" )
+    except ValueError as err:
+        if not quiet:
+            sys.stderr.write( "{}: ignoring corrupt state in {}: {}\n". \
+                format( globals.progname, file, err ))
+        return({})
+
+    return( state )
+
+
+def write_state( file, state ):
+    """write the state of a device to its lock-file, atomically
+
+    It is written to a temporary file, which is synced, then renamed
+    over the old one, so the lock-file is always whole, even after a
+    crash or loss of power.
+
+    Arguments:
+        1:  lock filename
+        2:  state dictionary, as from read_state()
+    Exceptions:
+        IOError/OSError if the file can't be written
+    """
+
+    import json
+
+    state = dict( state, version=STATE_VERSION )
+    tmp = "{}.{:d}.tmp".format( file, os.getpid())
+    with timing.span( 'write_state' ):
+        try:
+            with open( tmp, "w" ) as f:
+                f.write( json.dumps( state, sort_keys=True ) + "\n" )
+                f.flush()
+                os.fsync( f.fileno())
+            os.rename( tmp, file )
+        except ( IOError, OSError ):
+            try:
+                os.unlink( tmp )
+            except OSError:
+                pass
+            raise
+
+
+def update_state( file, changes ):
+    """change some of the state in a lock-file
+
+    Arguments:
+        1:  lock filename
+        2:  dictionary of the values to change
+    Returns:
+        the new state dictionary
+    Exceptions:
+        IOError/OSError if the file can't be written
+    """
+
+    # a relay writes from its own thread, so read, change and write
+    # one at a time.  Anything corrupt is about to be replaced
+    with _state_lock:
+        state = read_state( file, quiet=True )
+        state.update( changes )
+        write_state( file, state )
+    return( state )
 
 
 def write_timestamp( file, vals={} ):
-    """write a timestamp to a file
+    """write the time of a reset to a lock-file
 
-    time-stamp file format:
-        line1:  seconds since epoch - to be read by this program
-        line2:  human readable string of reset time
     Arguments:
         1:  filename
         2:  optional values dictionary containing:
-                device-name (default = 'device')
+                device-name  (default = 'device')
+                reset-reason (default = 'network unreachable')
     Returns:
-        0
+        0:  ok
+        1:  it couldn't be written, which is reported on stderr
     """
 
     my_name = sys._getframe().f_code.co_name
@@ -187,22 +517,26 @@ def write_timestamp( file, vals={} ):
     dprint( "{0:s}(): writing timestamp lock to {1:s}". \
             format( my_name, file ))
 
-    now_num = int( time.time())
-    now_str = time.strftime( "%a %b %d, %Y %H:%M:%S" )
+    now_num = int( clock.now())
+    now_str = time.strftime( "%a %b %d, %Y %H:%M:%S", clock.localtime())
     try:
-        f = open( file, "w" )
-        f.write( str( now_num ) + "\n" )
-        f.write( "reset {} at {}\n". \
-            format( device_name, now_str ))
-        f.close()
-    except (IOError) as err:
-        pass
+        update_state( file, { 'device':       device_name,
+                              'last-reset':   now_num,
+                              'reset-time':   now_str,
+                              'reset-reason': vals.get( 'reset-reason',
+                                                "network unreachable" ) })
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "{}: can't write lock-file: {}\n".format(
+            globals.progname, err ))
+        return(1)
 
     return(0)
 
 
 def logit( file, message ):
-    """log a message
+    """log a message to the --logfile text log
+
+    See eventlog.py for the JSON event log, and why both are kept.
 
     Arguments:
         1:  filename
@@ -214,62 +548,85 @@ def logit( file, message ):
 
     my_name = sys._getframe().f_code.co_name
 
-    try:
-        f = open( file, "a" )
-        now = time.strftime( "%a %b %d, %Y @ %H:%M" )
-        f.write( now + ": " + message )
-        f.close()
-    except (IOError) as err:
-        err_code, err_msg  = err.args
-        raise Exception( "%s(): %s: %s" % \
-            ( my_name, err_msg, file ))
+    with timing.span( 'logit' ):
+        try:
+            f = open( file, "a" )
+            now = time.strftime( "%a %b %d, %Y @ %H:%M", clock.localtime())
+            f.write( now + ": " + message )
+            f.close()
+        except (IOError) as err:
+            err_code, err_msg  = err.args
+            raise Exception( "%s(): %s: %s" % \
+                ( my_name, err_msg, file ))
 
     return(0)
 
 
-def is_reset_locked( file, wait_time ):
-    """test if there is a lock in place for resetting
-
-    reads a file previously written on last reset.
-    1st line is Unix epoch timestamp.
+def read_timestamp( file ):
+    """read the reset timestamp previously written to a lock file
 
     Arguments:
         1:  lock filename
-        2:  number seconds to honour lock since last reset
     Returns:
-        False:  no lock
-        True:   locked
+        seconds since epoch of last reset, or None if no valid lock
     """
 
     my_name = sys._getframe().f_code.co_name
-    try:
-        f = open( file, "r" )
-        dprint( "{}(): checking timestamp in {}".format( my_name, file ))
 
-        # get the last reset timestamp - its on the 1st line
-        last_time = int( f.readline().rstrip())
-        if is_int( last_time ) == False:
-            return( False )   # give up - no lock
+    last_time = read_state( file ).get( 'last-reset' )
+    if last_time is None:
+        return( None )          # no lock
 
-        now = int( time.time())
-        diff = now - last_time
-        f.close()
+    dprint( "{0:s}(): Got last reset timestamp of {1:d}". \
+        format( my_name, last_time ))
 
-        dprint( "{0:s}(): Got last reset timestamp of {1:d}". \
-            format( my_name, last_time ))
-        dprint( "{0:s}(): {1:d} seconds since last reboot". \
-            format( my_name, diff ))
+    return( last_time )
 
-        if diff < wait_time:
-            dprint( "{0:s}(): reset lock in place. {1:d} < {2:d} seconds". \
-                format( my_name, diff, wait_time ))
-            return( True )   # locked
 
-    except (IOError) as err:
-        pass
-        return( False )       # no lock
+def instance_filename( lock_file ):
+    """return the name of the instance lock file for a lock-file"""
 
-    return( False )
+    return( lock_file + ".pid" )
+
+
+def socket_filename( lock_file ):
+    """return the name of the default control socket for a lock-file"""
+
+    return( lock_file + ".sock" )
+
+
+def instance_lock( file ):
+    """make sure only one of us runs at a time
+
+    Takes an exclusive flock() on the file, without waiting, and writes
+    our pid in it.  The lock is held until the process exits, or the
+    file returned is closed.  The file is never removed, since another
+    run could have it open.
+
+    Arguments:
+        1:  filename
+    Returns:
+        the open file, or None if another process holds the lock
+    Exceptions:
+        IOError/OSError if the file can't be opened
+    """
+
+    import fcntl
+
+    f = open( file, "a+" )
+    try:
+        fcntl.flock( f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB )
+    except ( IOError, OSError ) as err:
+        f.close()
+        if err.errno in ( errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK ):
+            return( None )
+        raise
+
+    f.seek(0)
+    f.truncate()
+    f.write( "{:d}\n".format( os.getpid()))
+    f.flush()
+    return( f )
 
 
 def is_int(s):
@@ -289,52 +646,97 @@ def is_int(s):
         return False
 
 
-def convert_times( time_range ):
-    """convert a string of HH:MM-HH:MM and return ( start-time, end_time )
+def parse_device( spec, defaults ):
+    """parse a device specification given to --device
+
+    The specification is a comma-delimited list of key=value pairs.
+    The keys are:
 
-    the return times are HH * 60 + MM for the number of seconds into the 
-    current day.  You can't cross over a 24 hour boundary.
-    ie: you can't say 22:30-01:30. 
-    Hours are given in 24-hour format.
-    There is no distinction for AM and PM.
+        name        name of the device.  Required
+        pin         GPIO pin number
+        hosts       hosts to ping for this device, delimited with '+'
+        quorum      number of the hosts that must answer
+        max-loss    reset if the hosts lose more than this % of probes
+        max-rtt     reset if their 95th percentile rtt is more (ms)
+        reset-stages  stages of the network (see diagnose.py) a fault
+                    in which resets this device, delimited with '+'
+        reset-time  seconds between setting pin HIGH, then LOW
+        wait-time   seconds to wait to reset again
+        lockfile    lock-file for this device
+
+    For example:
+        name=modem,pin=25,hosts=8.8.8.8+1.1.1.1,wait-time=900
+
+    Anything not given is taken from the defaults.  If no lockfile
+    is given, the default lock-file with '-' and the name added is used,
+    so that devices don't share a lock.
 
     Arguments:
-        1:  HH:MM-HH:MM
+        1:  specification string
+        2:  dictionary of defaults, with keys: pin, hosts, quorum,
+            max-loss, max-rtt, reset-stages, reset-time, wait-time,
+            lock-file
     Returns:
-        ( start-time-mins, end-time-mins )
+        dictionary with keys: device-name, pin, hosts, quorum,
+        max-loss, max-rtt, reset-stages, reset-time, wait-time,
+        lock-file
     Exceptions:
         Exception
     """
 
-    range = re.compile( '^(\d+:\d+)-(\d+:\d+)$' )
-    m = range.match( time_range )
-    if m:
-        try:
-            start_time = m.group(1).split(':')
-            end_time   = m.group(2).split(':')
-
-            s_hr  = int( start_time[0] )
-            s_min = int( start_time[1] )
-            e_hr  = int( end_time[0] )
-            e_min = int( end_time[1] )
-        except TypeError as err:
-            raise Exception( err )
-
-        if ( e_hr < s_hr ):
-            err = "maintenance time range given has end hour before start hour"
-            raise Exception( err )
-
-        if ( e_hr == s_hr ) and ( e_min < s_min ):
-            err = "maintenance time range given has end time before start time"
-            raise Exception( err )
-
-        if ( s_hr > 24 ) or ( e_hr > 24 ) or ( s_min > 59 ) or ( e_min > 59 ):
-            err = "nonsense maintenance time given"
-            raise Exception( err )
-
-        maint_start = s_hr * 60 + s_min
-        maint_stop  = e_hr * 60 + e_min
-        return( maint_start, maint_stop )
-    else:
-        err = "maintenance time range not of format: HH:MM-HH:MM"
-        raise Exception( err )
+    device = {
+        'device-name':  None,
+        'pin':          defaults[ 'pin' ],
+        'hosts':        defaults[ 'hosts' ],
+        'quorum':       defaults[ 'quorum' ],
+        'max-loss':     defaults[ 'max-loss' ],
+        'max-rtt':      defaults[ 'max-rtt' ],
+        'reset-stages': defaults[ 'reset-stages' ],
+        'reset-time':   defaults[ 'reset-time' ],
+        'wait-time':    defaults[ 'wait-time' ],
+        'lock-file':    None,
+    }
+
+    for item in spec.split( ',' ):
+        if '=' not in item:
+            raise Exception( "device setting not of format key=value: " \
+                "\'{}\'".format( item ))
+        ( key, val ) = item.split( '=', 1 )
+        key = key.strip()
+        val = val.strip()
+
+        if key == 'name':
+            device[ 'device-name' ] = val
+        elif key == 'hosts':
+            device[ 'hosts' ] = [ h for h in val.split( '+' ) if h ]
+        elif key == 'reset-stages':
+            device[ 'reset-stages' ] = [ s for s in val.split( '+' ) if s ]
+        elif key == 'lockfile':
+            device[ 'lock-file' ] = val
+        elif key in ( 'pin', 'quorum', 'max-loss', 'max-rtt',
+                      'reset-time', 'wait-time' ):
+            if is_int( val ) == False:
+                raise Exception( "Not an integer for {}: \'{}\'". \
+                    format( key, val ))
+            device[ key ] = int( val )
+        else:
+            raise Exception( "unknown device setting: \'{}\'".format( key ))
+
+    if not device[ 'device-name' ]:
+        raise Exception( "device has no name: \'{}\'".format( spec ))
+    if not device[ 'hosts' ]:
+        raise Exception( "device {} has no hosts". \
+            format( device[ 'device-name' ] ))
+    if ( device[ 'pin' ] > 27 ) or ( device[ 'pin' ] < 0 ):
+        raise Exception( "invalid pin num: \'{}\'".format( device[ 'pin' ] ))
+    if ( device[ 'max-loss' ] > 100 ) or ( device[ 'max-loss' ] < 0 ):
+        raise Exception( "invalid max-loss: \'{}\'". \
+            format( device[ 'max-loss' ] ))
+    if device[ 'max-rtt' ] < 0:
+        raise Exception( "invalid max-rtt: \'{}\'". \
+            format( device[ 'max-rtt' ] ))
+    if device[ 'lock-file' ] is None:
+        device[ 'lock-file' ] = "{}-{}".format( defaults[ 'lock-file' ],
+                                                device[ 'device-name' ] )
+
+    return( device )
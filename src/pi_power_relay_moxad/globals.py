@@ -1,2 +1,6 @@
 debug_flag = False
 progname   = None
+
+# functions called as hook( host, rtt, backend ) for every probe result.
+# rtt is the round-trip time in seconds, or None if there was no answer
+probe_hooks = []
@@ -0,0 +1,235 @@
+"""GPIO drivers, that set the pins the relays are on
+
+A driver is looked up by name in DRIVERS:
+
+    rpi         the RPi.GPIO module.  The original behaviour, but it is
+                not supported on the newest Pis
+    chardev     the Linux GPIO character device, /dev/gpiochipN, with
+                ioctl line requests (the v1 uAPI).  Root is not needed,
+                only read and write access to the device, which the
+                gpio group has on Raspberry Pi OS
+    file        a fake, which appends each change to a file as a line
+                of "time pin value", to try the relay on any Linux box
+
+Every driver has:
+
+    setup( pin )        ask for a pin as an output, set LOW
+    set( pin, value )   set a pin HIGH or LOW, asking for it first if
+                        need be
+    release( pin )      let go of a pin, unless the pins are kept
+    close()             let go of all the pins
+
+From the cron, a pin is asked for at each reset and let go after it,
+as RPi.GPIO.cleanup() did.  The daemon keeps its pins from when it
+starts, so a reset is one ioctl on chardev, with nothing to set up.
+"""
+
+import os
+import struct
+import threading
+
+from .functions import dprint
+from . import clock
+from .constants import DEFAULT_GPIO_DRIVER as DEFAULT_DRIVER, \
+    DEFAULT_GPIO_CHIP as DEFAULT_CHIP
+
+HIGH = 1
+LOW  = 0
+
+LABEL = b'pi-power-relay'       # consumer of the lines we hold
+
+# from linux/gpio.h
+GPIOHANDLES_MAX           = 64
+GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+
+# struct gpiohandle_request: lineoffsets, flags, default_values,
+# consumer_label, lines, fd.  And struct gpiohandle_data: values
+_HANDLE_REQUEST = "@{0:d}II{0:d}B32sIi".format( GPIOHANDLES_MAX )
+_HANDLE_DATA    = "@{0:d}B".format( GPIOHANDLES_MAX )
+
+
+def _iowr( type, nr, size ):
+    return(( 3 << 30 ) | ( size << 16 ) | ( type << 8 ) | nr )
+
+
+GPIO_GET_LINEHANDLE_IOCTL = _iowr( 0xB4, 0x03,
+                                   struct.calcsize( _HANDLE_REQUEST ))
+GPIOHANDLE_SET_LINE_VALUES_IOCTL = _iowr( 0xB4, 0x09,
+                                          struct.calcsize( _HANDLE_DATA ))
+
+
+class RPiDriver( object ):
+    """pins set with the RPi.GPIO module, imported when first used
+
+    Arguments to constructor:
+        1:  not used
+        2:  flag to keep pins between resets.  default = False
+    """
+
+    def __init__( self, path="", keep=False ):
+        self.keep = keep
+        self.pins = set()           # pins set up as outputs
+        self.GPIO = None
+        self.lock = threading.Lock()
+
+    def _request( self, pin, value ):
+        if self.GPIO is None:
+            import RPi.GPIO as GPIO
+            self.GPIO = GPIO
+
+        self.GPIO.setmode( self.GPIO.BCM )
+        self.GPIO.setup( pin, self.GPIO.OUT, initial=value )
+        self.pins.add( pin )
+
+    def setup( self, pin ):
+        with self.lock:
+            if pin not in self.pins:
+                self._request( pin, LOW )
+
+    def set( self, pin, value ):
+        with self.lock:
+            if pin not in self.pins:
+                self._request( pin, value )
+            else:
+                self.GPIO.output( pin, value )
+
+    def release( self, pin ):
+        if self.keep:
+            return
+        with self.lock:
+            self._cleanup( pin )
+
+    def close( self ):
+        with self.lock:
+            for pin in list( self.pins ):
+                self._cleanup( pin )
+
+    def _cleanup( self, pin ):
+        if pin in self.pins:
+            # just our pin, so other relays are left alone
+            self.GPIO.cleanup( pin )
+            self.pins.discard( pin )
+
+
+class ChardevDriver( object ):
+    """pins set through a GPIO character device, such as /dev/gpiochip0
+
+    The pin is the line offset on the chip, which on a Pi is its BCM
+    number.  Each pin is asked for as a line handle, which sets it too.
+
+    Arguments to constructor:
+        1:  device.  default = /dev/gpiochip0
+        2:  flag to keep pins between resets.  default = False
+    """
+
+    def __init__( self, path="", keep=False ):
+        self.path  = path or DEFAULT_CHIP
+        self.keep  = keep
+        self.lines = {}             # pin -> fd of its line handle
+        self.lock  = threading.Lock()
+
+    def _request( self, pin, value ):
+        import fcntl
+
+        offsets = [ pin ] + [ 0 ] * ( GPIOHANDLES_MAX - 1 )
+        values  = [ value ] + [ 0 ] * ( GPIOHANDLES_MAX - 1 )
+        request = bytearray( struct.pack( _HANDLE_REQUEST, *( offsets +
+            [ GPIOHANDLE_REQUEST_OUTPUT ] + values + [ LABEL, 1, -1 ] )))
+
+        chip = os.open( self.path, os.O_RDWR | getattr( os, 'O_CLOEXEC', 0 ))
+        try:
+            fcntl.ioctl( chip, GPIO_GET_LINEHANDLE_IOCTL, request )
+        finally:
+            os.close( chip )
+
+        fd = struct.unpack( _HANDLE_REQUEST, bytes( request ))[-1]
+        self.lines[ pin ] = fd
+        dprint( "ChardevDriver: line {0:d} of {1:s} is fd {2:d}". \
+            format( pin, self.path, fd ))
+
+    def setup( self, pin ):
+        with self.lock:
+            if pin not in self.lines:
+                self._request( pin, LOW )
+
+    def set( self, pin, value ):
+        import fcntl
+
+        with self.lock:
+            if pin not in self.lines:
+                self._request( pin, value )
+                return
+            data = bytearray( struct.pack( _HANDLE_DATA, *( [ value ] +
+                [ 0 ] * ( GPIOHANDLES_MAX - 1 ))))
+            fcntl.ioctl( self.lines[ pin ], GPIOHANDLE_SET_LINE_VALUES_IOCTL,
+                         data )
+
+    def release( self, pin ):
+        if self.keep:
+            return
+        with self.lock:
+            if pin in self.lines:
+                os.close( self.lines.pop( pin ))
+
+    def close( self ):
+        with self.lock:
+            for pin in list( self.lines ):
+                os.close( self.lines.pop( pin ))
+
+
+class FileDriver( object ):
+    """a fake, appending each pin change to a file
+
+    Each line is the time in seconds since the epoch, the pin and its
+    value, such as "1792537200.123 25 1".
+
+    Arguments to constructor:
+        1:  filename
+        2:  not used
+    """
+
+    def __init__( self, path="", keep=False ):
+        if not path:
+            raise Exception( "the file GPIO driver needs a file" )
+        self.path = path
+        self.lock = threading.Lock()
+
+    def setup( self, pin ):
+        pass
+
+    def set( self, pin, value ):
+        with self.lock:
+            with open( self.path, "a" ) as f:
+                f.write( "{0:.3f} {1:d} {2:d}\n".format( clock.now(), pin,
+                                                         value ))
+
+    def release( self, pin ):
+        pass
+
+    def close( self ):
+        pass
+
+
+DRIVERS = {
+    'rpi':      RPiDriver,
+    'chardev':  ChardevDriver,
+    'file':     FileDriver,
+}
+
+
+def open_driver( name=DEFAULT_DRIVER, path="", keep=False ):
+    """make a driver.  Nothing is touched until a pin is used
+
+    Arguments:
+        1:  driver name, from DRIVERS.  default = rpi
+        2:  optional device, or file for the file driver
+        3:  optional flag to keep pins between resets
+    Returns:
+        driver
+    Exceptions:
+        Exception if there is no such driver
+    """
+
+    if name not in DRIVERS:
+        raise Exception( "unknown GPIO driver: \'{}\'".format( name ))
+    return( DRIVERS[ name ]( path, keep ))
@@ -0,0 +1,178 @@
+"""persistent host health index
+
+Keeps, for each host probed, an exponentially weighted moving average
+(EWMA) of how often it answers and of its round-trip time.  It is
+saved in a small file next to the lock-file, so every run can use what
+earlier runs learned:
+
+  - hosts are probed most reliable, then fastest, first, so on a healthy
+    network the check is usually done after one quick probe
+  - each host gets a timeout based on its own round-trip time, rather
+    than the global --ping-timeout
+
+The file is JSON:
+
+    { "version": 1,
+      "hosts": { "8.8.8.8": { "success": 0.98, "rtt": 0.021,
+                              "count": 412, "updated": 1700000000 } } }
+"""
+
+import os
+import time
+import json
+import math
+import threading
+
+from .functions import dprint
+
+VERSION = 1
+
+ALPHA       = 0.3       # weight of the newest sample in the EWMAs
+RTT_FACTOR  = 4         # timeout is this many times the average rtt ...
+MIN_TIMEOUT = 1         # ... but at least this many seconds
+MIN_COUNT   = 3         # samples needed before a timeout is adapted
+
+
+def health_filename( lock_file ):
+    """return the name of the health index file for a lock-file"""
+
+    return( lock_file + ".health" )
+
+
+class HealthIndex( object ):
+    """success rate and round-trip time of hosts, saved between runs
+
+    Arguments to constructor:
+        1:  filename of the index
+    """
+
+    def __init__( self, file ):
+        self.file    = file
+        self.hosts   = {}
+        self.changed = False
+        self.lock    = threading.Lock()
+
+    def load( self ):
+        """read the index from its file.  A missing or bad file is ignored
+
+        Returns:
+            self
+        """
+
+        my_name = "HealthIndex.load"
+        try:
+            with open( self.file, "r" ) as f:
+                data = json.load( f )
+            if data.get( 'version' ) == VERSION:
+                self.hosts = data.get( 'hosts', {} )
+                dprint( "{0:s}(): read {1:d} hosts from {2:s}". \
+                    format( my_name, len( self.hosts ), self.file ))
+            else:
+                dprint( "{0:s}(): ignoring {1:s}: unknown version". \
+                    format( my_name, self.file ))
+        except ( IOError, OSError ):
+            pass
+        except ValueError as err:
+            dprint( "{0:s}(): ignoring {1:s}: {2}". \
+                format( my_name, self.file, err ))
+
+        return( self )
+
+    def save( self ):
+        """write the index to its file, if it changed, replacing it atomically
+
+        Returns:
+            0
+        Exceptions:
+            IOError/OSError if the file can't be written
+        """
+
+        with self.lock:
+            if not self.changed:
+                return(0)
+            data = json.dumps({ 'version': VERSION, 'hosts': self.hosts },
+                              sort_keys=True )
+            self.changed = False
+
+        tmp = "{}.{:d}.tmp".format( self.file, os.getpid())
+        with open( tmp, "w" ) as f:
+            f.write( data + "\n" )
+        os.rename( tmp, self.file )
+
+        dprint( "HealthIndex.save(): wrote {0:s}".format( self.file ))
+        return(0)
+
+    def record( self, host, rtt, backend=None ):
+        """add the result of a probe.  Can be used in globals.probe_hooks
+
+        Arguments:
+            1:  host
+            2:  round-trip time in seconds, or None if no answer
+            3:  probe backend (not used)
+        """
+
+        success = 0.0
+        if rtt is not None:
+            success = 1.0
+
+        with self.lock:
+            entry = self.hosts.get( host )
+            if entry is None:
+                entry = { 'success': success, 'rtt': rtt, 'count': 0 }
+                self.hosts[ host ] = entry
+            else:
+                entry[ 'success' ] = ALPHA * success + \
+                    ( 1 - ALPHA ) * entry[ 'success' ]
+                if rtt is not None:
+                    if entry.get( 'rtt' ) is None:
+                        entry[ 'rtt' ] = rtt
+                    else:
+                        entry[ 'rtt' ] = ALPHA * rtt + \
+                            ( 1 - ALPHA ) * entry[ 'rtt' ]
+            entry[ 'count' ] = entry[ 'count' ] + 1
+            entry[ 'updated' ] = int( time.time())
+            self.changed = True
+
+    def order( self, hosts ):
+        """return hosts sorted most reliable, then fastest, first
+
+        Hosts not seen before are treated as reliable, but slow, so they
+        go after hosts known to be good.  Ties keep the given order.
+
+        Arguments:
+            1:  array of hosts
+        Returns:
+            array of hosts
+        """
+
+        def key( host ):
+            entry = self.hosts.get( host )
+            if entry is None:
+                return( -1.0, float( 'inf' ))
+            rtt = entry.get( 'rtt' )
+            if rtt is None:
+                rtt = float( 'inf' )
+            # round, so tiny differences in the averages don't matter
+            return( -round( entry[ 'success' ], 1 ), rtt )
+
+        with self.lock:
+            return( sorted( hosts, key=key ))
+
+    def timeout( self, host, default ):
+        """return a timeout for a host based on its average round-trip time
+
+        Arguments:
+            1:  host
+            2:  timeout to use if not enough is known.  Also the maximum
+        Returns:
+            timeout in whole seconds
+        """
+
+        with self.lock:
+            entry = self.hosts.get( host )
+            if entry is None or entry.get( 'rtt' ) is None or \
+               entry[ 'count' ] < MIN_COUNT:
+                return( default )
+            timeout = int( math.ceil( entry[ 'rtt' ] * RTT_FACTOR ))
+
+        return( max( MIN_TIMEOUT, min( default, timeout )))
@@ -0,0 +1,235 @@
+"""recent probe history of each host, to find a network going bad
+
+ping() only says whether a host answered at all, so a modem that
+loses 40% of packets, or takes 2 seconds to answer, still looks up.
+In daemon mode, the outcome of the last --history probes of each host
+is kept in a ring buffer, from which its loss, median and 95th
+percentile round-trip times are known at any time.  A device can then
+be reset when its hosts are degraded (--max-loss, --max-rtt), before
+they fail completely.
+
+Each host takes a fixed amount of memory, however long the daemon runs:
+a float and a byte per sample, and a count for each of NUM_BINS
+round-trip time bins.  Adding a sample takes the same time whatever the
+size of the buffer: the count of the sample it replaces is taken off,
+and that of the new one added.  The percentiles are read off the bin
+counts, so they are within a bin (about 9%) of the exact value.
+"""
+
+import math
+import array
+import threading
+
+from .functions import dprint
+
+DEFAULT_SIZE    = 100       # samples kept per host
+MIN_SAMPLES     = 10        # samples needed before a host is judged
+ALPHA           = 0.1       # weight of the newest sample in the EWMAs
+
+BIN_MIN         = 0.001     # round-trip time of the lowest bin (secs)
+BINS_PER_OCTAVE = 8
+NUM_BINS        = 14 * BINS_PER_OCTAVE      # 1 ms up to about 16 secs
+LOST            = NUM_BINS                  # bin of a probe not answered
+
+NAN = float( 'nan' )
+
+
+def bin_of( rtt ):
+    """return the bin of a round-trip time, or LOST if None"""
+
+    if rtt is None:
+        return( LOST )
+    if rtt <= BIN_MIN:
+        return(0)
+    b = int( math.log( rtt / BIN_MIN, 2 ) * BINS_PER_OCTAVE )
+    return( min( b, NUM_BINS - 1 ))
+
+
+def bin_value( b ):
+    """return the round-trip time in the middle of a bin"""
+
+    return( BIN_MIN * 2 ** (( b + 0.5 ) / BINS_PER_OCTAVE ))
+
+
+class Ring( object ):
+    """the last size probes of a host
+
+    Arguments to constructor:
+        1:  number of probes to keep
+    """
+
+    def __init__( self, size ):
+        self.size   = size
+        self.rtts   = array.array( 'f', [ NAN ] * size )
+        self.bins   = array.array( 'B', [ LOST ] * size )
+        self.counts = [ 0 ] * ( NUM_BINS + 1 )
+        self.next   = 0             # where the next sample goes
+        self.length = 0
+        self.ewma_rtt  = None
+        self.ewma_loss = None
+
+    def add( self, rtt ):
+        """add a probe
+
+        Arguments:
+            1:  round-trip time in seconds, or None if no answer
+        """
+
+        b = bin_of( rtt )
+        if self.length == self.size:
+            self.counts[ self.bins[ self.next ]] -= 1
+        else:
+            self.length = self.length + 1
+
+        self.bins[ self.next ] = b
+        if rtt is None:
+            self.rtts[ self.next ] = NAN
+        else:
+            self.rtts[ self.next ] = rtt
+        self.counts[ b ] += 1
+        self.next = ( self.next + 1 ) % self.size
+
+        lost = 0.0
+        if rtt is None:
+            lost = 1.0
+        if self.ewma_loss is None:
+            self.ewma_loss = lost
+        else:
+            self.ewma_loss = ALPHA * lost + ( 1 - ALPHA ) * self.ewma_loss
+        if rtt is not None:
+            if self.ewma_rtt is None:
+                self.ewma_rtt = rtt
+            else:
+                self.ewma_rtt = ALPHA * rtt + ( 1 - ALPHA ) * self.ewma_rtt
+
+    def loss( self ):
+        """return the fraction of the probes kept that were not answered"""
+
+        if self.length == 0:
+            return( None )
+        return( self.counts[ LOST ] / float( self.length ))
+
+    def percentile( self, p ):
+        """return a percentile of the round-trip times of answered probes
+
+        Arguments:
+            1:  percentile, 0 to 1
+        Returns:
+            seconds, or None if none were answered
+        """
+
+        answered = self.length - self.counts[ LOST ]
+        if answered == 0:
+            return( None )
+        rank = max( 1, int( math.ceil( p * answered )))
+        total = 0
+        for b in range( NUM_BINS ):
+            total = total + self.counts[b]
+            if total >= rank:
+                return( bin_value( b ))
+        return( bin_value( NUM_BINS - 1 ))
+
+    def clear( self ):
+        self.__init__( self.size )
+
+
+class History( object ):
+    """probe history of every host.  record() is for globals.probe_hooks
+
+    Arguments to constructor:
+        1:  number of probes to keep for each host
+    """
+
+    def __init__( self, size=DEFAULT_SIZE ):
+        self.size  = size
+        self.hosts = {}             # host -> Ring
+        self.lock  = threading.Lock()
+
+    def record( self, host, rtt, backend=None ):
+        """add the result of a probe.  Can be used in globals.probe_hooks
+
+        Arguments:
+            1:  host
+            2:  round-trip time in seconds, or None if no answer
+            3:  probe backend (not used)
+        """
+
+        with self.lock:
+            ring = self.hosts.get( host )
+            if ring is None:
+                ring = Ring( self.size )
+                self.hosts[ host ] = ring
+            ring.add( rtt )
+
+    def stats( self, host ):
+        """return what is known of a host
+
+        Arguments:
+            1:  host
+        Returns:
+            dictionary with keys: samples, loss (0 to 1), p50 and p95
+            (secs), ewma-loss and ewma-rtt.  Values not known are None
+        """
+
+        with self.lock:
+            ring = self.hosts.get( host )
+            if ring is None:
+                return({ 'samples': 0, 'loss': None, 'p50': None,
+                         'p95': None, 'ewma-loss': None, 'ewma-rtt': None })
+            return({ 'samples':     ring.length,
+                     'loss':        ring.loss(),
+                     'p50':         ring.percentile( 0.5 ),
+                     'p95':         ring.percentile( 0.95 ),
+                     'ewma-loss':   ring.ewma_loss,
+                     'ewma-rtt':    ring.ewma_rtt })
+
+    def clear( self, hosts ):
+        """forget the history of hosts, such as after a reset
+
+        Arguments:
+            1:  array of hosts
+        """
+
+        with self.lock:
+            for host in hosts:
+                if host in self.hosts:
+                    self.hosts[ host ].clear()
+
+    def degraded( self, hosts, quorum, max_loss, max_rtt ):
+        """see if the hosts of a device are too lossy or slow
+
+        Only hosts with at least MIN_SAMPLES probes are judged.  The
+        device is degraded if fewer of them than the quorum are within
+        the limits.
+
+        Arguments:
+            1:  array of hosts
+            2:  number of hosts that must be good
+            3:  most loss allowed, in percent, or 0 for no limit
+            4:  most 95th percentile round-trip time allowed, in ms, or
+                0 for no limit
+        Returns:
+            a description of what is wrong, or None if not degraded
+        """
+
+        judged = 0
+        bad    = []
+        for host in hosts:
+            st = self.stats( host )
+            if st[ 'samples' ] < min( MIN_SAMPLES, self.size ):
+                continue
+            judged = judged + 1
+            if max_loss and st[ 'loss' ] * 100 > max_loss:
+                bad.append( "{} loss {:.0f}%".format( host,
+                                                      st[ 'loss' ] * 100 ))
+            elif max_rtt and st[ 'p95' ] is not None and \
+                 st[ 'p95' ] * 1000 > max_rtt:
+                bad.append( "{} p95 rtt {:.0f}ms".format( host,
+                                                          st[ 'p95' ] * 1000 ))
+
+        if judged == 0 or judged - len( bad ) >= min( quorum, judged ):
+            return( None )
+
+        reason = "degraded: " + ", ".join( bad )
+        dprint( "History.degraded(): {}".format( reason ))
+        return( reason )
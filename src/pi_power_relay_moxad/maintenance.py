@@ -0,0 +1,574 @@
+"""maintenance windows, when devices are not reset
+
+A window is given to --maint as one of:
+
+    HH:MM-HH:MM                         every day
+    DAYS HH:MM-HH:MM                    every week, on the days given:
+                                        mon, mon-fri, sat+sun, ...
+    YYYY-MM-DD HH:MM-HH:MM              on one day
+    YYYY-MM-DD HH:MM-YYYY-MM-DD HH:MM   from one time to another
+
+A window whose end is before its start goes past midnight, so
+22:30-01:30 is from 10:30pm to 1:30am the next day.  24:00 is the end
+of a day.  A window runs from the start of its first minute up to, but
+not including, its last one.
+
+With --maint-file, windows are read from a CSV or iCalendar file, such
+as the maintenance schedule an ISP publishes.  In a CSV file, each row
+is a window, as one column, as above; or as two, its start and end; or
+as three, the days or date, the start and the end:
+
+    # days,    start, end
+    mon-fri,   01:00, 03:00
+    2026-11-03 22:00, 2026-11-04 04:00
+
+In an iCalendar file, each VEVENT is a window, from DTSTART to DTEND
+(or DTSTART plus DURATION).  A daily or weekly RRULE repeats it.
+Times in UTC (ending in Z) are changed to local time; any others are
+taken as local.  Cancelled events are left out.
+
+The windows are parsed once and compiled into a Schedule: weekly
+windows as seconds into the week, and dated ones as seconds of local
+time, each sorted, with overlapping and touching windows merged.  Both
+questions asked of it - are we in a window now, and when does it end -
+are then a binary search.  A compiled --maint-file is cached in the
+file given to load(), and only parsed again once the file is changed.
+"""
+
+import os
+import re
+import csv
+import json
+import time
+import bisect
+import calendar
+import datetime
+
+from .functions import dprint
+from . import clock
+
+DAY    = 24 * 60 * 60
+WEEK   = 7 * DAY
+MONDAY = 3 * DAY        # the epoch was a Thursday.  + MONDAY -> Monday is 0
+EPOCH  = datetime.date( 1970, 1, 1 ).toordinal()
+
+DAYS = ( 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun' )
+ICAL_DAYS = ( 'MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU' )
+
+MAX_OCCURRENCES = 10000     # of a limited RRULE
+CACHE_VERSION   = 1
+
+_TIME  = r'(\d{1,2}):(\d{2})'
+_DATE  = r'(\d{4})-(\d{2})-(\d{2})'
+_DAILY = re.compile( r'^' + _TIME + r'\s*-\s*' + _TIME + r'$' )
+_WEEKLY = re.compile( r'^([a-z+\-]+)\s+' + _TIME + r'\s*-\s*' + _TIME + r'$' )
+_DATED = re.compile( r'^' + _DATE + r'[\sT]+' + _TIME + r'\s*-\s*' + _TIME +
+                     r'$' )
+_SPAN  = re.compile( r'^' + _DATE + r'[\sT]+' + _TIME + r'\s*-\s*' + _DATE +
+                     r'[\sT]+' + _TIME + r'$' )
+
+
+def cache_filename( lock_file ):
+    """return the name of the maintenance cache file for a lock-file"""
+
+    return( lock_file + ".maint" )
+
+
+def _secs( hour, minute ):
+    hour   = int( hour )
+    minute = int( minute )
+    if hour > 24 or minute > 59 or ( hour == 24 and minute ):
+        raise Exception( "nonsense maintenance time given" )
+    return( hour * 3600 + minute * 60 )
+
+
+def _date( year, month, day ):
+    """return seconds of local time at the start of a day"""
+
+    try:
+        ordinal = datetime.date( int( year ), int( month ),
+                                 int( day )).toordinal()
+    except ValueError:
+        raise Exception( "nonsense maintenance date given" )
+    return(( ordinal - EPOCH ) * DAY )
+
+
+def _days( spec ):
+    """turn mon, mon-fri, sat+sun, ... into an array of days, Monday 0"""
+
+    days = []
+    for part in spec.split( '+' ):
+        ends = part.split( '-' )
+        if len( ends ) > 2 or not all( e[ :3 ] in DAYS for e in ends ):
+            raise Exception( "unknown days in maintenance time: {}". \
+                format( spec ))
+        first = DAYS.index( ends[0][ :3 ] )
+        last  = DAYS.index( ends[-1][ :3 ] )
+        day = first
+        while True:
+            days.append( day )
+            if day == last:
+                break
+            day = ( day + 1 ) % 7
+    return( days )
+
+
+def parse( spec ):
+    """parse a window, as given to --maint
+
+    Arguments:
+        1:  window
+    Returns:
+        ( weekly, dated ): arrays of ( start, end ).  Weekly ones are
+        seconds into the week from Monday, and can end after WEEK.
+        Dated ones are seconds of local time, as if it were UTC
+    Exceptions:
+        Exception if it isn't understood
+    """
+
+    text = spec.strip().lower()
+    weekly = []
+    dated  = []
+
+    def length( start, end ):
+        if end == start:
+            raise Exception( "maintenance time range given has the same " \
+                "start and end: {}".format( spec ))
+        if end < start:
+            end = end + DAY
+        return( end - start )
+
+    m = _DAILY.match( text )
+    if m:
+        start = _secs( m.group(1), m.group(2) )
+        secs  = length( start, _secs( m.group(3), m.group(4) ))
+        for day in range(7):
+            weekly.append(( day * DAY + start, day * DAY + start + secs ))
+        return( weekly, dated )
+
+    m = _WEEKLY.match( text )
+    if m:
+        start = _secs( m.group(2), m.group(3) )
+        secs  = length( start, _secs( m.group(4), m.group(5) ))
+        for day in _days( m.group(1) ):
+            weekly.append(( day * DAY + start, day * DAY + start + secs ))
+        return( weekly, dated )
+
+    m = _DATED.match( text )
+    if m:
+        day   = _date( m.group(1), m.group(2), m.group(3) )
+        start = _secs( m.group(4), m.group(5) )
+        secs  = length( start, _secs( m.group(6), m.group(7) ))
+        dated.append(( day + start, day + start + secs ))
+        return( weekly, dated )
+
+    m = _SPAN.match( text )
+    if m:
+        start = _date( m.group(1), m.group(2), m.group(3) ) + \
+                _secs( m.group(4), m.group(5) )
+        end   = _date( m.group(6), m.group(7), m.group(8) ) + \
+                _secs( m.group(9), m.group(10) )
+        if end <= start:
+            raise Exception( "maintenance time range given has end time " \
+                "before start time: {}".format( spec ))
+        dated.append(( start, end ))
+        return( weekly, dated )
+
+    raise Exception( "maintenance time not of format: [DAYS|YYYY-MM-DD] " \
+        "HH:MM-HH:MM: {}".format( spec ))
+
+
+def merge( windows ):
+    """sort windows, and merge those that overlap or touch
+
+    Arguments:
+        1:  array of ( start, end )
+    Returns:
+        array of ( start, end ), sorted, none overlapping
+    """
+
+    merged = []
+    for ( start, end ) in sorted( windows ):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = ( merged[-1][0], end )
+        else:
+            merged.append(( start, end ))
+    return( merged )
+
+
+def _local( t ):
+    """return seconds of local time, as if it were UTC, for a time"""
+
+    return( calendar.timegm( clock.localtime( t )))
+
+
+def _epoch( local ):
+    """return the time for seconds of local time, as from _local()"""
+
+    return( time.mktime( time.gmtime( local )[ :8 ] + ( -1, )))
+
+
+class Schedule( object ):
+    """maintenance windows, compiled for quick look-ups
+
+    Arguments to constructor:
+        1:  array of weekly ( start, end ), as from parse()
+        2:  array of dated ( start, end ), as from parse()
+    """
+
+    def __init__( self, weekly=(), dated=() ):
+        # a weekly window past the end of the week goes on at its start
+        split = []
+        for ( start, end ) in weekly:
+            ( start, end ) = ( start % WEEK, start % WEEK + end - start )
+            if end - start >= WEEK:
+                split.append(( 0, WEEK ))
+            elif end > WEEK:
+                split.append(( start, WEEK ))
+                split.append(( 0, end - WEEK ))
+            else:
+                split.append(( start, end ))
+
+        self.weekly = tuple( merge( split ))
+        self.dated  = tuple( merge( dated ))
+        self.weekly_starts = [ w[0] for w in self.weekly ]
+        self.dated_starts  = [ d[0] for d in self.dated ]
+
+    def __len__( self ):
+        return( len( self.weekly ) + len( self.dated ))
+
+    def _containing( self, local ):
+        """return the end of the window a local time is in, or None"""
+
+        ends = []
+        offset = ( local + MONDAY ) % WEEK
+        i = bisect.bisect_right( self.weekly_starts, offset ) - 1
+        if i >= 0 and offset < self.weekly[i][1]:
+            ends.append( local + self.weekly[i][1] - offset )
+
+        i = bisect.bisect_right( self.dated_starts, local ) - 1
+        if i >= 0 and local < self.dated[i][1]:
+            ends.append( self.dated[i][1] )
+
+        if ends:
+            return( max( ends ))
+        return( None )
+
+    def _end( self, local ):
+        """follow windows that run into each other to the last one"""
+
+        end = None
+        for i in range( len( self ) + 2 ):
+            later = self._containing( local )
+            if later is None:
+                break
+            end = local = later
+        return( end )
+
+    def window_end( self, t ):
+        """see if a time is in a maintenance window
+
+        Arguments:
+            1:  time (seconds since epoch)
+        Returns:
+            when the window ends (seconds since epoch), or None if the
+            time is not in one
+        """
+
+        local = _local( t )
+        end = self._end( local )
+        if end is None:
+            return( None )
+        return( _epoch( end ))
+
+    def to_json( self ):
+        return({ 'weekly': self.weekly, 'dated': self.dated })
+
+    @classmethod
+    def from_json( cls, data ):
+        return( cls([ tuple( w ) for w in data[ 'weekly' ]],
+                    [ tuple( d ) for d in data[ 'dated' ]] ))
+
+
+def _csv_windows( file, lines ):
+    """parse the rows of a CSV file.  Returns ( weekly, dated )"""
+
+    weekly = []
+    dated  = []
+    for ( num, row ) in enumerate( csv.reader( lines ), 1 ):
+        row = [ col.strip() for col in row ]
+        while row and not row[-1]:
+            row.pop()
+        if not row or row[0].startswith( '#' ):
+            continue
+        if len( row ) == 1:
+            spec = row[0]
+        elif len( row ) == 2:
+            spec = "{}-{}".format( *row )
+        elif len( row ) == 3:
+            spec = "{} {}-{}".format( *row )
+        else:
+            raise Exception( "{}:{:d}: too many columns".format( file, num ))
+        try:
+            ( w, d ) = parse( spec )
+        except Exception as err:
+            if num == 1 and all( re.match( r'^[a-z ]+$', col, re.I )
+                                 for col in row ):
+                continue            # a heading
+            raise Exception( "{}:{:d}: {}".format( file, num, err ))
+        weekly.extend( w )
+        dated.extend( d )
+    return( weekly, dated )
+
+
+def _ical_time( value, params ):
+    """return seconds of local time for an iCalendar DATE or DATE-TIME"""
+
+    m = re.match( r'^(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})(Z?))?$',
+                  value )
+    if not m:
+        raise Exception( "bad date: {}".format( value ))
+    secs = _date( m.group(1), m.group(2), m.group(3) )
+    if m.group(4) is not None:
+        secs = secs + int( m.group(4) ) * 3600 + int( m.group(5) ) * 60 + \
+               int( m.group(6) )
+        if m.group(7):
+            secs = calendar.timegm( time.localtime( secs ))
+    return( secs )
+
+
+def _ical_duration( value ):
+    m = re.match( r'^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?' \
+                  r'(?:(\d+)S)?)?$', value )
+    if not m:
+        raise Exception( "bad duration: {}".format( value ))
+    ( w, d, h, mi, s ) = [ int( g or 0 ) for g in m.groups() ]
+    return(( w * 7 + d ) * DAY + h * 3600 + mi * 60 + s )
+
+
+def _ical_event( event ):
+    """turn the properties of a VEVENT into ( weekly, dated )"""
+
+    if event.get( 'STATUS', ( '', {} ))[0].upper() == 'CANCELLED':
+        return( [], [] )
+    if 'DTSTART' not in event:
+        raise Exception( "event has no DTSTART" )
+
+    start = _ical_time( *event[ 'DTSTART' ] )
+    if 'DTEND' in event:
+        end = _ical_time( *event[ 'DTEND' ] )
+    elif 'DURATION' in event:
+        end = start + _ical_duration( event[ 'DURATION' ][0] )
+    elif event[ 'DTSTART' ][1].get( 'VALUE' ) == 'DATE':
+        end = start + DAY
+    else:
+        raise Exception( "event has no DTEND or DURATION" )
+    if end <= start:
+        raise Exception( "event ends before it starts" )
+
+    if 'RRULE' not in event:
+        return( [], [( start, end )] )
+
+    rule = dict( part.split( '=', 1 ) for part in
+                 event[ 'RRULE' ][0].upper().split( ';' ) if '=' in part )
+    freq = rule.get( 'FREQ' )
+    if freq not in ( 'DAILY', 'WEEKLY' ):
+        raise Exception( "RRULE FREQ={} not supported".format( freq ))
+
+    first = ( start // DAY + 3 ) % 7        # weekday of DTSTART, Monday 0
+    days = [ first ]
+    if freq == 'DAILY':
+        days = list( range(7) )
+    elif 'BYDAY' in rule:
+        days = []
+        for day in rule[ 'BYDAY' ].split( ',' ):
+            if day[ -2: ] not in ICAL_DAYS or day[ :-2 ]:
+                raise Exception( "RRULE BYDAY={} not supported".format( day ))
+            days.append( ICAL_DAYS.index( day ))
+    interval = int( rule.get( 'INTERVAL', 1 ))
+
+    # a rule that repeats for ever is a weekly window.  One with an end
+    # is made into the dated windows it stands for
+
+    if 'UNTIL' not in rule and 'COUNT' not in rule:
+        if interval != 1:
+            raise Exception( "RRULE INTERVAL without UNTIL or COUNT " \
+                "not supported" )
+        offset = start % DAY
+        return([( day * DAY + offset, day * DAY + offset + end - start )
+                 for day in days ], [] )
+
+    until = None
+    if 'UNTIL' in rule:
+        until = _ical_time( rule[ 'UNTIL' ], {} )
+    count = int( rule.get( 'COUNT', MAX_OCCURRENCES ))
+
+    dated = []
+    day_start = start - start % DAY
+    week = day_start - first * DAY          # Monday of DTSTART's week
+    n = 0
+    while len( dated ) < min( count, MAX_OCCURRENCES ):
+        if freq == 'DAILY':
+            bases = [ day_start + n * interval * DAY ]
+        else:
+            bases = [ week + n * interval * WEEK + d * DAY
+                      for d in sorted( days ) ]
+        n = n + 1
+        for base in bases:
+            s = base + start % DAY
+            if s < start or len( dated ) >= count:
+                continue
+            if until is not None and s > until:
+                return( [], dated )
+            dated.append(( s, s + end - start ))
+    return( [], dated )
+
+
+def _ical_windows( file, lines ):
+    """parse the VEVENTs of an iCalendar file.  Returns ( weekly, dated )"""
+
+    # lines starting with a space or tab carry on the one before
+    unfolded = []
+    for ( num, line ) in enumerate( lines, 1 ):
+        line = line.rstrip( '\r\n' )
+        if line[ :1 ] in ( ' ', '\t' ) and unfolded:
+            unfolded[-1] = ( unfolded[-1][0], unfolded[-1][1] + line[1:] )
+        elif line:
+            unfolded.append(( num, line ))
+
+    weekly = []
+    dated  = []
+    event  = None
+    for ( num, line ) in unfolded:
+        where = "{}:{:d}".format( file, num )
+        ( name, sep, value ) = line.partition( ':' )
+        parts  = name.split( ';' )
+        name   = parts[0].upper()
+        params = dict( p.upper().split( '=', 1 ) for p in parts[1:]
+                       if '=' in p )
+
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {}
+            start = where
+        elif name == 'END' and value.upper() == 'VEVENT' and \
+             event is not None:
+            try:
+                ( w, d ) = _ical_event( event )
+            except Exception as err:
+                raise Exception( "{}: {}".format( start, err ))
+            weekly.extend( w )
+            dated.extend( d )
+            event = None
+        elif event is not None:
+            event[ name ] = ( value.strip(), params )
+
+    return( weekly, dated )
+
+
+def read( file ):
+    """read the windows in a CSV or iCalendar file
+
+    Arguments:
+        1:  filename
+    Returns:
+        ( weekly, dated ), as from parse()
+    Exceptions:
+        Exception if the file can't be read, or has a mistake in it
+    """
+
+    try:
+        with open( file, "r" ) as f:
+            lines = f.readlines()
+    except ( IOError, OSError ) as err:
+        raise Exception( "can't read maintenance file {}: {}".format( file,
+                                                                      err ))
+
+    if any( line.strip().upper() == 'BEGIN:VCALENDAR' for line in lines[:5] ):
+        return( _ical_windows( file, lines ))
+    return( _csv_windows( file, lines ))
+
+
+def _cache_key( file ):
+    st = os.stat( file )
+    return({ 'version': CACHE_VERSION,
+             'file':    os.path.abspath( file ),
+             'mtime':   st.st_mtime,
+             'size':    st.st_size,
+             'tz':      list( time.tzname ) + [ time.timezone ] })
+
+
+def load( file, cache_file ):
+    """read the windows in a file, using the cached Schedule if the file
+    hasn't changed since it was made
+
+    Arguments:
+        1:  CSV or iCalendar file
+        2:  cache file, or "" for none
+    Returns:
+        Schedule
+    Exceptions:
+        Exception if the file can't be read, or has a mistake in it
+    """
+
+    try:
+        key = _cache_key( file )
+    except OSError as err:
+        raise Exception( "can't read maintenance file {}: {}".format( file,
+                                                                      err ))
+
+    if cache_file:
+        try:
+            with open( cache_file, "r" ) as f:
+                cached = json.load( f )
+            if cached.get( 'key' ) == key:
+                dprint( "load(): using cached windows in {}". \
+                    format( cache_file ))
+                return( Schedule.from_json( cached ))
+        except ( IOError, OSError, ValueError, KeyError, TypeError ):
+            pass
+
+    ( weekly, dated ) = read( file )
+    schedule = Schedule( weekly, dated )
+    dprint( "load(): {:d} windows in {}".format( len( schedule ), file ))
+
+    if cache_file:
+        data = schedule.to_json()
+        data[ 'key' ] = key
+        tmp_file = "{}.{:d}.tmp".format( cache_file, os.getpid())
+        try:
+            with open( tmp_file, "w" ) as f:
+                json.dump( data, f )
+            os.rename( tmp_file, cache_file )
+        except ( IOError, OSError ) as err:
+            dprint( "load(): can't write {}: {}".format( cache_file, err ))
+
+    return( schedule )
+
+
+def compile( specs, file="", cache_file="" ):
+    """compile the windows given to --maint and --maint-file
+
+    Arguments:
+        1:  array of windows, as given to --maint
+        2:  optional file given to --maint-file
+        3:  optional cache file for it
+    Returns:
+        Schedule
+    Exceptions:
+        Exception if a window isn't understood
+    """
+
+    weekly = []
+    dated  = []
+    for spec in specs:
+        ( w, d ) = parse( spec )
+        weekly.extend( w )
+        dated.extend( d )
+
+    if file:
+        schedule = load( file, cache_file )
+        weekly.extend( schedule.weekly )
+        dated.extend( schedule.dated )
+
+    return( Schedule( weekly, dated ))
@@ -0,0 +1,404 @@
+"""Prometheus metrics
+
+Counters and histograms of what the program does: probes and their
+round-trip times, how long each check takes, resets, resets skipped
+because of a lock or a maintenance period, and how long devices take
+to recover.
+
+They can be written to a node_exporter textfile (--metrics-file), which
+is replaced atomically.  From the cron, the counters in the existing
+file are read back first, so they keep counting up across runs.  With
+--daemon they can also be served over HTTP on localhost
+(--metrics-port), at /metrics.
+
+Adding to a counter or histogram doesn't take a lock.  Each thread
+adds to its own dictionary, and the dictionaries are only added up
+when the metrics are written out.  Those of threads that have ended,
+such as the ones probing hosts at each check, are then folded into one
+total and dropped.  Gauges are only set now and then, so they are kept
+in one dictionary, under a lock.  When metrics are not enabled, inc(),
+gauge() and observe() return straight away.
+"""
+
+import os
+import re
+import time
+import threading
+
+from .functions import dprint
+
+PREFIX = 'pi_power_relay_'
+
+# name -> ( type, help )
+METRICS = {
+    'probe_attempts_total':
+        ( 'counter', 'Probes sent, by host' ),
+    'probe_failures_total':
+        ( 'counter', 'Probes that got no answer, by host' ),
+    'probe_rtt_seconds':
+        ( 'histogram', 'Round-trip time of answered probes, by host' ),
+    'check_duration_seconds':
+        ( 'histogram', 'Time taken by a complete check' ),
+    'resets_total':
+        ( 'counter', 'Resets started, by device' ),
+    'resets_locked_total':
+        ( 'counter', 'Resets not done because of the timing lock, by device' ),
+    'local_faults_total':
+        ( 'counter', 'Faults found by --diagnose that reset nothing, by stage' ),
+    'peer_claims_lost_total':
+        ( 'counter', 'Resets left to a peer resetting the device, by device' ),
+    'netlink_events_total':
+        ( 'counter', 'Network changes seen with --netlink' ),
+    'maintenance_skips_total':
+        ( 'counter', 'Checks skipped during a maintenance period' ),
+    'recovery_seconds':
+        ( 'histogram', 'Time for a device to recover after a reset' ),
+    'recovery_failures_total':
+        ( 'counter', 'Resets after which the device did not recover' ),
+    'host_loss_ratio':
+        ( 'gauge', 'Fraction of the recent probes of a host not answered' ),
+    'host_rtt_p95_seconds':
+        ( 'gauge', '95th percentile of recent round-trip times of a host' ),
+    'last_write_timestamp_seconds':
+        ( 'gauge', 'When these metrics were written' ),
+}
+
+BUCKETS = {
+    'probe_rtt_seconds':
+        ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10 ),
+    'check_duration_seconds':
+        ( 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300 ),
+    'recovery_seconds':
+        ( 5, 10, 15, 30, 45, 60, 90, 120, 180, 300, 600 ),
+}
+
+_registry = None
+
+
+class Registry( object ):
+    """metric values, kept as one dictionary per thread for counters
+
+    The keys of the dictionaries are ( name, labels ), where labels is
+    a tuple of ( label, value ) pairs.
+    """
+
+    def __init__( self ):
+        self.local  = threading.local()
+        self.shards = []            # ( thread, dictionary ) of each thread
+        self.folded = {}            # counts of threads that have ended
+        self.gauges = {}
+        self.lock   = threading.Lock()  # not taken to add to a shard
+
+    def shard( self ):
+        """return the dictionary of the calling thread"""
+
+        try:
+            return( self.local.shard )
+        except AttributeError:
+            shard = {}
+            with self.lock:
+                self._fold()
+                self.shards.append(( threading.current_thread(), shard ))
+            self.local.shard = shard
+            return( shard )
+
+    def _fold( self ):
+        # a thread that has ended adds nothing more, so its dictionary
+        # can be added to the total and let go.  Called with the lock
+
+        live = []
+        for ( thread, shard ) in self.shards:
+            if thread.is_alive():
+                live.append(( thread, shard ))
+                continue
+            for ( key, value ) in shard.items():
+                self.folded[ key ] = self.folded.get( key, 0 ) + value
+        self.shards = live
+
+    def add( self, name, labels, value ):
+        shard = self.shard()
+        key = ( name, labels )
+        shard[ key ] = shard.get( key, 0 ) + value
+
+    def set( self, name, labels, value ):
+        with self.lock:
+            self.gauges[ ( name, labels ) ] = value
+
+    def collect( self ):
+        """add up the dictionaries of all the threads
+
+        Returns:
+            dictionary of ( name, labels ) -> value
+        """
+
+        with self.lock:
+            self._fold()
+            shards = [ shard for ( thread, shard ) in self.shards ]
+            totals = dict( self.folded )
+            totals.update( self.gauges )
+
+        for shard in shards:
+            # copy() doesn't let go of the GIL, so it is safe while
+            # the owning thread carries on adding to the shard
+            for ( key, value ) in shard.copy().items():
+                totals[ key ] = totals.get( key, 0 ) + value
+
+        return( totals )
+
+
+def _type_of( name ):
+    """return the type of a metric, or of the histogram a series is part of"""
+
+    for suffix in ( '_bucket', '_sum', '_count' ):
+        if name.endswith( suffix ) and name[ :-len( suffix ) ] in BUCKETS:
+            return( 'histogram' )
+    return( METRICS.get( name, ( 'counter', '' ))[0] )
+
+
+def enable():
+    """start keeping metrics
+
+    Returns:
+        the Registry
+    """
+
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return( _registry )
+
+
+def enabled():
+    return( _registry is not None )
+
+
+def inc( name, labels=(), value=1 ):
+    """add to a counter.  Does nothing if metrics are not enabled
+
+    Arguments:
+        1:  metric name, without the prefix
+        2:  optional tuple of ( label, value ) pairs
+        3:  amount to add.  default = 1
+    """
+
+    if _registry is None:
+        return
+    _registry.add( name, labels, value )
+
+
+def gauge( name, value, labels=() ):
+    """set a gauge.  Does nothing if metrics are not enabled
+
+    Arguments:
+        1:  metric name, without the prefix
+        2:  value
+        3:  optional tuple of ( label, value ) pairs
+    """
+
+    if _registry is None:
+        return
+    _registry.set( name, labels, value )
+
+
+def observe( name, value, labels=() ):
+    """add a value to a histogram.  Does nothing if metrics are not enabled
+
+    Arguments:
+        1:  metric name, without the prefix
+        2:  value
+        3:  optional tuple of ( label, value ) pairs
+    """
+
+    if _registry is None:
+        return
+
+    for le in BUCKETS[ name ]:
+        if value <= le:
+            _registry.add( name + '_bucket', labels + (( 'le', str( le )),),
+                           1 )
+    _registry.add( name + '_bucket', labels + (( 'le', '+Inf' ),), 1 )
+    _registry.add( name + '_sum', labels, value )
+    _registry.add( name + '_count', labels, 1 )
+
+
+def probe_hook( host, rtt, backend ):
+    """record a probe.  For globals.probe_hooks"""
+
+    labels = (( 'host', host ),)
+    inc( 'probe_attempts_total', labels )
+    if rtt is None:
+        inc( 'probe_failures_total', labels )
+    else:
+        observe( 'probe_rtt_seconds', rtt, labels )
+
+
+def _labels_str( labels ):
+    if not labels:
+        return( '' )
+    return( '{' + ','.join( '{}="{}"'.format( k, v.replace( '"', '\\"' ))
+                            for ( k, v ) in labels ) + '}' )
+
+
+def _number_str( value ):
+    if isinstance( value, float ) and not value.is_integer():
+        return( repr( value ))
+    return( str( int( value )))
+
+
+def render():
+    """return all the metrics in the Prometheus text format"""
+
+    if _registry is None:
+        return( '' )
+
+    _registry.set( 'last_write_timestamp_seconds', (), time.time())
+    totals = _registry.collect()
+
+    # every histogram needs all its buckets, even those still at 0
+    for ( name, labels ) in list( totals ):
+        metric = name[ :-len( '_count' ) ]
+        if name.endswith( '_count' ) and metric in BUCKETS:
+            for le in BUCKETS[ metric ]:
+                key = ( metric + '_bucket', labels + (( 'le', str( le )),))
+                totals.setdefault( key, 0 )
+
+    # group the series under the metric they belong to
+    by_metric = {}
+    for ( ( name, labels ), value ) in totals.items():
+        metric = name
+        if _type_of( name ) == 'histogram':
+            metric = re.sub( r'_(bucket|sum|count)$', '', name )
+        by_metric.setdefault( metric, [] ).append(( name, labels, value ))
+
+    lines = []
+    for metric in sorted( by_metric ):
+        ( type, help ) = METRICS.get( metric, ( 'counter', '' ))
+        lines.append( "# HELP {}{} {}".format( PREFIX, metric, help ))
+        lines.append( "# TYPE {}{} {}".format( PREFIX, metric, type ))
+        for ( name, labels, value ) in sorted( by_metric[ metric ],
+                                               key=_sort_key ):
+            lines.append( "{}{}{} {}".format( PREFIX, name,
+                _labels_str( labels ), _number_str( value )))
+
+    return( "\n".join( lines ) + "\n" )
+
+
+def _sort_key( series ):
+    ( name, labels, value ) = series
+    # keep histogram buckets in order of their bound
+    bound = 0.0
+    for ( k, v ) in labels:
+        if k == 'le':
+            bound = float( v )
+    return( name, tuple( l for l in labels if l[0] != 'le' ), bound )
+
+
+_line_re  = re.compile( r'^(\w+)(?:\{(.*)\})?\s+(\S+)$' )
+_label_re = re.compile( r'(\w+)="((?:[^"\\]|\\.)*)"' )
+
+
+def load_textfile( file ):
+    """add the counters and histograms in an existing textfile
+
+    Used from the cron, so counts carry on from the last run.
+    A missing file is ignored.
+
+    Arguments:
+        1:  filename
+    Returns:
+        number of series read
+    """
+
+    if _registry is None:
+        return(0)
+
+    count = 0
+    try:
+        f = open( file, "r" )
+    except ( IOError, OSError ):
+        return(0)
+
+    with f:
+        for line in f:
+            if line.startswith( '#' ):
+                continue
+            m = _line_re.match( line.strip())
+            if not m or not m.group(1).startswith( PREFIX ):
+                continue
+            name = m.group(1)[ len( PREFIX ): ]
+            if _type_of( name ) == 'gauge':
+                continue
+            labels = tuple(( k, v.replace( '\\"', '"' ))
+                for ( k, v ) in _label_re.findall( m.group(2) or '' ))
+            try:
+                value = float( m.group(3))
+            except ValueError:
+                continue
+            _registry.add( name, labels, value )
+            count = count + 1
+
+    dprint( "load_textfile(): read {0:d} series from {1:s}". \
+        format( count, file ))
+    return( count )
+
+
+def write_textfile( file ):
+    """write the metrics to a textfile, replacing it atomically
+
+    Arguments:
+        1:  filename
+    Returns:
+        0
+    Exceptions:
+        IOError/OSError if the file can't be written
+    """
+
+    data = render()
+    tmp = "{}.{:d}.tmp".format( file, os.getpid())
+    with open( tmp, "w" ) as f:
+        f.write( data )
+    os.chmod( tmp, 0o644 )
+    os.rename( tmp, file )
+
+    return(0)
+
+
+def serve( port, address='127.0.0.1' ):
+    """serve the metrics over HTTP at /metrics, from a thread
+
+    Arguments:
+        1:  TCP port
+        2:  address to listen on.  default = 127.0.0.1
+    Returns:
+        the server
+    """
+
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    class Handler( BaseHTTPRequestHandler ):
+        def do_GET( self ):
+            if self.path.split( '?' )[0] not in ( '/', '/metrics' ):
+                self.send_error( 404 )
+                return
+            body = render().encode( 'utf-8' )
+            self.send_response( 200 )
+            self.send_header( 'Content-Type',
+                              'text/plain; version=0.0.4; charset=utf-8' )
+            self.send_header( 'Content-Length', str( len( body )))
+            self.end_headers()
+            self.wfile.write( body )
+
+        def log_message( self, format, *args ):
+            dprint( "metrics: " + ( format % args ))
+
+    server = HTTPServer(( address, port ), Handler )
+    t = threading.Thread( target=server.serve_forever )
+    t.daemon = True
+    t.start()
+
+    dprint( "serve(): metrics on http://{0:s}:{1:d}/metrics". \
+        format( address, port ))
+    return( server )
@@ -0,0 +1,293 @@
+"""watch for network changes with rtnetlink (--netlink)
+
+In daemon mode, a check normally only happens every --interval
+seconds, so an outage isn't noticed until the next one.  With
+--netlink, the daemon also listens to the kernel's rtnetlink
+notifications, and checks straight away when:
+
+    - an interface comes or goes, or goes up or down, or gains or
+      loses carrier
+    - an address is added to or removed from an interface
+    - a default route is added or removed
+
+Other changes, such as routes to the local network being refreshed,
+are ignored.  Since something is now watching the local end of the
+network, the daemon can poll less often while nothing is happening,
+up to --idle-interval.
+
+Linux only.  No privileges are needed to listen.  To try it out
+without touching the real network:
+
+    unshare -n sh -c 'ip link add v0 type veth peer name v1 ;
+        pi-power-relay --daemon --netlink -d & sleep 5 ;
+        ip link set v0 up ; ip link set v1 up ; sleep 5 ;
+        ip link set v1 down ; sleep 5 ; kill %1'
+"""
+
+import os
+import socket
+import struct
+import select
+import threading
+
+from .functions import dprint
+
+# from linux/rtnetlink.h and linux/netlink.h
+
+NLMSG_ERROR     = 2
+NLMSG_DONE      = 3
+NLMSG_OVERRUN   = 4
+
+NLM_F_REQUEST   = 0x001
+NLM_F_DUMP      = 0x300
+
+RTM_NEWLINK     = 16
+RTM_DELLINK     = 17
+RTM_GETLINK     = 18
+RTM_NEWADDR     = 20
+RTM_DELADDR     = 21
+RTM_NEWROUTE    = 24
+RTM_DELROUTE    = 25
+
+RTMGRP_LINK         = 0x001
+RTMGRP_IPV4_IFADDR  = 0x010
+RTMGRP_IPV4_ROUTE   = 0x040
+RTMGRP_IPV6_IFADDR  = 0x100
+RTMGRP_IPV6_ROUTE   = 0x400
+
+GROUPS = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | \
+         RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE
+
+IFF_UP          = 0x00001
+IFF_RUNNING     = 0x00040
+IFF_LOWER_UP    = 0x10000
+IFF_STATE       = IFF_UP | IFF_RUNNING | IFF_LOWER_UP
+
+IFLA_IFNAME     = 3
+RT_SCOPE_HOST   = 254
+RT_TABLE_MAIN   = 254
+
+_nlmsghdr  = struct.Struct( '=IHHII' )
+_ifinfomsg = struct.Struct( '=BxHiII' )
+_ifaddrmsg = struct.Struct( '=BBBBi' )
+_rtmsg     = struct.Struct( '=BBBBBBBBI' )
+_rtattr    = struct.Struct( '=HH' )
+
+RECV_SIZE  = 65536
+
+
+def _align( n ):
+    return(( n + 3 ) & ~3 )
+
+
+def _attrs( data, pos, end ):
+    """return the rtattrs in data[pos:end], as { type: payload }"""
+
+    attrs = {}
+    while pos + _rtattr.size <= end:
+        ( length, type ) = _rtattr.unpack_from( data, pos )
+        if length < _rtattr.size or pos + length > end:
+            break               # truncated
+        attrs[ type ] = data[ pos + _rtattr.size : pos + length ]
+        pos = pos + _align( length )
+    return( attrs )
+
+
+class Watcher( object ):
+    """listen for rtnetlink notifications in a thread
+
+    Arguments to constructor:
+        1:  function called with a description of each change that
+            matters, such as 'eth0 lost carrier'.  Called from the
+            watcher's thread
+    """
+
+    def __init__( self, callback ):
+        self.callback = callback
+        self.sock     = None
+        self.thread   = None
+        self.links    = {}          # index -> ( name, flags & IFF_STATE )
+        self.dumped   = False
+        ( self.stop_read, self.stop_write ) = ( None, None )
+
+    def start( self ):
+        """open the netlink socket and start listening
+
+        Exceptions:
+            Exception if rtnetlink can't be used, such as on anything
+            other than Linux
+        """
+
+        if not hasattr( socket, 'AF_NETLINK' ):
+            raise Exception( "rtnetlink is not available on this system" )
+
+        try:
+            self.sock = socket.socket( socket.AF_NETLINK, socket.SOCK_RAW,
+                                       socket.NETLINK_ROUTE )
+            self.sock.bind(( 0, GROUPS ))
+        except ( IOError, OSError ) as err:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            raise Exception( "can't listen to rtnetlink: {}".format( err ))
+
+        # learn the interfaces there are now, so changes to them can
+        # be told from new ones
+        try:
+            self._dump_links()
+        except ( IOError, OSError ) as err:
+            dprint( "Watcher.start(): can't list interfaces: {}". \
+                format( err ))
+
+        ( self.stop_read, self.stop_write ) = os.pipe()
+        self.thread = threading.Thread( target=self._run, name='netlink' )
+        self.thread.daemon = True
+        self.thread.start()
+        dprint( "Watcher.start(): listening to rtnetlink" )
+
+    def _dump_links( self ):
+        request = _nlmsghdr.pack( _nlmsghdr.size + _ifinfomsg.size,
+                                  RTM_GETLINK, NLM_F_REQUEST | NLM_F_DUMP,
+                                  1, 0 ) + \
+                  _ifinfomsg.pack( socket.AF_UNSPEC, 0, 0, 0, 0 )
+        self.sock.settimeout( 5 )
+        try:
+            self.sock.send( request )
+            self.dumped = False
+            while not self.dumped:
+                self.parse( self.sock.recv( RECV_SIZE ))
+        finally:
+            self.sock.settimeout( None )
+
+    def stop( self ):
+        """stop listening, and close the socket"""
+
+        if self.thread is None:
+            return
+        os.write( self.stop_write, b'x' )
+        self.thread.join()
+        self.thread = None
+        self.sock.close()
+        os.close( self.stop_read )
+        os.close( self.stop_write )
+
+    def _run( self ):
+        while True:
+            ( ready, w, x ) = select.select(
+                [ self.sock, self.stop_read ], [], [] )
+            if self.stop_read in ready:
+                return
+            try:
+                data = self.sock.recv( RECV_SIZE )
+            except ( IOError, OSError ) as err:
+                # ENOBUFS: the kernel dropped notifications because we
+                # were slow.  Something changed, so say so
+                self._report( "lost notifications ({})".format( err ))
+                continue
+            for event in self.parse( data ):
+                self._report( event )
+
+    def _report( self, event ):
+        dprint( "Watcher: {}".format( event ))
+        try:
+            self.callback( event )
+        except Exception as err:
+            dprint( "Watcher: callback failed: {}".format( err ))
+
+    def parse( self, data ):
+        """return the changes that matter in a buffer of netlink messages
+
+        Arguments:
+            1:  bytes received from the socket
+        Returns:
+            list of descriptions
+        """
+
+        events = []
+        pos = 0
+        while pos + _nlmsghdr.size <= len( data ):
+            ( length, type, flags, seq, pid ) = \
+                _nlmsghdr.unpack_from( data, pos )
+            if length < _nlmsghdr.size or pos + length > len( data ):
+                break
+            body = pos + _nlmsghdr.size
+            end  = pos + length
+            pos  = pos + _align( length )
+
+            if type in ( RTM_NEWLINK, RTM_DELLINK ):
+                event = self._link( type, data, body, end )
+            elif type in ( RTM_NEWADDR, RTM_DELADDR ):
+                event = self._addr( type, data, body, end )
+            elif type in ( RTM_NEWROUTE, RTM_DELROUTE ):
+                event = self._route( type, data, body, end )
+            elif type == NLMSG_DONE:
+                self.dumped = True
+                event = None
+            elif type == NLMSG_OVERRUN:
+                event = "lost notifications (overrun)"
+            else:
+                event = None
+            if event is not None:
+                events.append( event )
+
+        return( events )
+
+    def _link( self, type, data, body, end ):
+        # NEWLINK is also sent for changes we don't care about, such as
+        # the MTU, so only report changes of state
+
+        if body + _ifinfomsg.size > end:
+            return( None )
+        ( family, iftype, index, flags, change ) = \
+            _ifinfomsg.unpack_from( data, body )
+        name = _attrs( data, body + _ifinfomsg.size, end ).get(
+            IFLA_IFNAME, b'' ).rstrip( b'\0' ).decode( 'utf-8', 'replace' )
+        if not name:
+            name = "interface {:d}".format( index )
+
+        old = self.links.get( index )
+        if type == RTM_DELLINK:
+            self.links.pop( index, None )
+            return( "{} removed".format( name ))
+
+        state = flags & IFF_STATE
+        self.links[ index ] = ( name, state )
+        if old is None:
+            return( "{} appeared".format( name ))
+        if old[1] == state:
+            return( None )
+
+        if ( old[1] ^ state ) & IFF_LOWER_UP:
+            if state & IFF_LOWER_UP:
+                return( "{} gained carrier".format( name ))
+            return( "{} lost carrier".format( name ))
+        if ( old[1] ^ state ) & IFF_UP:
+            if state & IFF_UP:
+                return( "{} up".format( name ))
+            return( "{} down".format( name ))
+        if state & IFF_RUNNING:
+            return( "{} running".format( name ))
+        return( "{} not running".format( name ))
+
+    def _addr( self, type, data, body, end ):
+        if body + _ifaddrmsg.size > end:
+            return( None )
+        ( family, prefixlen, flags, scope, index ) = \
+            _ifaddrmsg.unpack_from( data, body )
+        if scope == RT_SCOPE_HOST:
+            return( None )          # such as 127.0.0.1 on lo
+        name = self.links.get( index, ( "interface {:d}".format( index ),))[0]
+        if type == RTM_NEWADDR:
+            return( "address added to {}".format( name ))
+        return( "address removed from {}".format( name ))
+
+    def _route( self, type, data, body, end ):
+        if body + _rtmsg.size > end:
+            return( None )
+        fields = _rtmsg.unpack_from( data, body )
+        ( dst_len, table ) = ( fields[1], fields[4] )
+        if dst_len != 0 or table != RT_TABLE_MAIN:
+            return( None )
+        if type == RTM_NEWROUTE:
+            return( "default route added" )
+        return( "default route removed" )
@@ -0,0 +1,476 @@
+"""coordination with other instances watching the same devices (--peers)
+
+Two Pis can watch the same modem, so that one can be down without the
+modem going unwatched.  But each would find the network down at about
+the same time, and each reset the modem, and their lock-files can't
+see each other's resets.  With --peers, daemons on the LAN tell each
+other what they find, and which of them is resetting a device, over
+UDP.  Devices are matched by name, so each must give a device the
+same name.
+
+Each message is a datagram holding a JSON dictionary, with 'type',
+'from' (the id of the sender, its host name and port) and:
+
+    verdict     devices: the name of each device and whether it was
+                found up, and resetting: the secs left of the lease of
+                each device the sender is resetting.  Sent after each
+                check
+    claim       device, time: asks the peers for a lease to reset a
+                device
+    grant       device: the claim may go ahead
+    deny        device, holder: it may not, as holder is resetting it,
+                or claimed it first.  secs: the secs left of the lease,
+                if the sender is resetting it
+    reset       device, secs: the device is being reset, and how long
+                the lease lasts
+    done        device, up: the power cycle is over, and whether the
+                device recovered (null if not watched)
+
+An instance that missed a reset message, such as one started during
+the power cycle, learns of it from the next verdict or deny.
+
+Before resetting a device, an instance claims it, and waits up to
+CLAIM_WAIT secs for the replies, sending the claim again half way.  It
+resets the device unless a peer denies the claim; a peer that doesn't
+answer is taken to be down.  A peer denies a claim if it is resetting
+the device, or if it knows of an earlier claim, its own or one it
+granted, comparing the time of each claim and then the ids.  Otherwise
+it grants the claim, and holds off claiming the device itself for
+CLAIM_LEASE secs, until the reset message comes.  A claim also loses
+if an earlier one is heard of while waiting.  So of claims made at
+once, the earliest wins, and only it.
+
+While a peer has the lease, its hosts aren't probed, and the peer's
+verdicts are taken instead.  Its reset is written to the lock-file, as
+if made here, so the timing lock applies to it too.
+
+The same --peers can be given to every instance, as an instance
+leaves itself out once it hears its own messages.
+
+Messages are only taken from the addresses given with --peers, but
+are not signed, so the LAN has to be trusted.  Only IPv4 is used.
+"""
+
+import os
+import sys
+import json
+import socket
+import select
+import threading
+import time
+
+from .functions import dprint
+from . import globals
+from . import clock
+from .constants import DEFAULT_PEER_PORT as DEFAULT_PORT
+
+CLAIM_WAIT   = 1.0          # most secs to wait for replies to a claim
+CLAIM_LEASE  = 10           # secs a granted claim holds off other claims
+LEASE_MARGIN = 30           # secs added to the lease over a power cycle
+MAX_MESSAGE  = 8192
+
+TYPES = ( 'verdict', 'claim', 'grant', 'deny', 'reset', 'done' )
+
+
+def parse_peer( spec ):
+    """split a peer into its host and port
+
+    Arguments:
+        1:  host, or host:port
+    Returns:
+        tuple of host and port
+    Exceptions:
+        Exception if the port is no good
+    """
+
+    ( host, sep, port ) = spec.partition( ':' )
+    if not sep:
+        return(( host, DEFAULT_PORT ))
+    try:
+        port = int( port )
+    except ValueError:
+        port = 0
+    if not host or port < 1 or port > 65535:
+        raise Exception( "bad peer: \'{}\' (use host:port)".format( spec ))
+    return(( host, port ))
+
+
+class Peers( object ):
+    """talk to the other instances, in a thread of its own
+
+    Arguments to constructor:
+        1:  array of peers, as host or host:port
+        2:  UDP port to listen on
+    """
+
+    def __init__( self, peers, port=DEFAULT_PORT ):
+        self.specs     = peers
+        self.port      = port
+        self.id        = "{}:{:d}".format( socket.gethostname(), port )
+        self.addresses = []
+        self.sock      = None
+        self.thread    = None
+        ( self.stop_read, self.stop_write ) = ( None, None )
+
+        self.cond     = threading.Condition()
+        self.heard    = {}          # address -> time last heard from
+        self.names    = {}          # address -> id of the peer
+        self.leases   = {}          # device -> [ peer id, until, since,
+                                    #   ( time, id ) if only claimed ]
+        self.own      = {}          # device -> until, for our resets
+        self.pending  = {}          # device -> ( time, id ) of our claim
+        self.replies  = {}          # device -> { address: holder or None }
+        self.verdicts = {}          # device -> ( peer id, up, time )
+        self.resets   = {}          # device -> ( peer id, time )
+
+    def start( self ):
+        """look up the peers, and start listening
+
+        Exceptions:
+            Exception if a peer can't be found, or the port is in use
+        """
+
+        for spec in self.specs:
+            ( host, port ) = parse_peer( spec )
+            try:
+                address = socket.gethostbyname( host )
+            except socket.error as err:
+                raise Exception( "can't find peer {}: {}".format( host, err ))
+            self.addresses.append(( address, port ))
+
+        self.sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+        try:
+            self.sock.bind(( '', self.port ))
+        except ( IOError, OSError ) as err:
+            self.sock.close()
+            self.sock = None
+            raise Exception( "can't listen on UDP port {:d}: {}".format(
+                self.port, err ))
+
+        ( self.stop_read, self.stop_write ) = os.pipe()
+        self.thread = threading.Thread( target=self._run, name='peers' )
+        self.thread.daemon = True
+        self.thread.start()
+        dprint( "Peers.start(): {0:s} listening on port {1:d}".format(
+            self.id, self.port ))
+
+    def close( self ):
+        """stop listening"""
+
+        if self.thread is None:
+            return
+        os.write( self.stop_write, b'x' )
+        self.thread.join()
+        self.thread = None
+        self.sock.close()
+        os.close( self.stop_read )
+        os.close( self.stop_write )
+
+    def claim( self, device, secs, force=False ):
+        """claim the lease to reset a device
+
+        Waits up to CLAIM_WAIT secs for the peers to answer, unless
+        forced, when the peers are just told.
+
+        Arguments:
+            1:  device name
+            2:  secs the power cycle may take.  The lease is
+                LEASE_MARGIN secs more
+            3:  optional flag to take the lease, whatever the peers say
+        Returns:
+            None if we have the lease, or the id of the peer that has
+        """
+
+        with self.cond:
+            holder = self._holder( device )
+            if holder is not None and holder != self.id and not force:
+                return( holder )
+            mine = ( clock.now(), self.id )
+            self.pending[ device ] = mine
+            self.replies[ device ] = {}
+
+        secs    = secs + LEASE_MARGIN
+        message = { 'type': 'claim', 'device': device, 'time': mine[0] }
+        holder  = None
+        start   = time.time()
+        sent    = 0
+        with self.cond:
+            while not force:
+                replies = self.replies[ device ]
+                denied  = [ h for h in replies.values() if h is not None ]
+                if denied:
+                    holder = denied[0]
+                    break
+                # a reset, or an earlier claim, heard of while we waited
+                holder = self._holder( device )
+                if holder is None:
+                    other = self._claimed( device )
+                    if other is not None and other < mine:
+                        holder = other[1]
+                if holder is not None and holder != self.id:
+                    break
+                holder = None
+                if len( replies ) >= len( self.addresses ):
+                    break
+                elapsed = time.time() - start
+                if elapsed >= CLAIM_WAIT:
+                    break
+                if elapsed >= sent * CLAIM_WAIT / 2:
+                    self._send_all( message )
+                    sent = sent + 1
+                    continue
+                self.cond.wait( sent * CLAIM_WAIT / 2 - elapsed )
+
+            del self.pending[ device ]
+            del self.replies[ device ]
+            if holder is None:
+                self.own[ device ] = clock.now() + secs
+                self.leases.pop( device, None )
+
+        if holder is not None:
+            dprint( "Peers.claim(): {0:s} is being reset by {1:s}".format(
+                device, holder ))
+            return( holder )
+
+        dprint( "Peers.claim(): got the lease of {0:s} for {1:d} secs". \
+            format( device, secs ))
+        self._send_all({ 'type': 'reset', 'device': device, 'secs': secs })
+        return( None )
+
+    def done( self, device, up=None ):
+        """give up the lease of a device, once its power cycle is over
+
+        Arguments:
+            1:  device name
+            2:  optional flag for whether it recovered
+        """
+
+        with self.cond:
+            if self.own.pop( device, None ) is None:
+                return
+        self._send_all({ 'type': 'done', 'device': device, 'up': up })
+
+    def share( self, verdicts ):
+        """tell the peers whether each device was found up
+
+        Arguments:
+            1:  dictionary of device name -> True if up
+        """
+
+        with self.cond:
+            now = clock.now()
+            resetting = dict(( device, int( until - now ) + 1 )
+                             for ( device, until ) in self.own.items()
+                             if until > now )
+        self._send_all({ 'type': 'verdict', 'devices': verdicts,
+                         'resetting': resetting })
+
+    def held( self ):
+        """return dictionary of device -> id of the peer resetting it
+
+        Only peers that won their claim are counted, not those we only
+        granted a claim to, as another peer's claim may yet win.
+        """
+
+        with self.cond:
+            now = clock.now()
+            return( dict(( device, lease[0] ) for ( device, lease )
+                         in self.leases.items()
+                         if lease[2] is not None and lease[1] > now ))
+
+    def verdict( self, device ):
+        """return the last verdict on a device of the peer resetting it
+
+        Arguments:
+            1:  device name
+        Returns:
+            True if it found the device up since the reset started
+        """
+
+        with self.cond:
+            lease = self.leases.get( device )
+            found = self.verdicts.get( device )
+            if lease is None or found is None:
+                return( False )
+            ( peer, up, t ) = found
+            if peer != lease[0] or lease[2] is None or t < lease[2]:
+                return( False )
+            return( up )
+
+    def take_resets( self ):
+        """return, and forget, the resets peers made since the last call
+
+        Returns:
+            dictionary of device -> ( peer id, time )
+        """
+
+        with self.cond:
+            resets = self.resets
+            self.resets = {}
+            return( resets )
+
+    def status( self ):
+        """return the peers and leases, for the control socket"""
+
+        with self.cond:
+            now = clock.now()
+            peers = {}
+            for address in self.addresses:
+                key = "{}:{:d}".format( *address )
+                peers[ key ] = { 'id':    self.names.get( address ),
+                                 'heard': self.heard.get( address ) }
+            leases = {}
+            for ( device, ( peer, until, since, claim )) in \
+                    self.leases.items():
+                if since is not None and until > now:
+                    leases[ device ] = { 'holder': peer,
+                                         'remaining': int( until - now ) }
+            for ( device, until ) in self.own.items():
+                if until > now:
+                    leases[ device ] = { 'holder': self.id,
+                                         'remaining': int( until - now ) }
+            return({ 'id': self.id, 'peers': peers, 'leases': leases })
+
+    def _holder( self, device ):
+        """return who is resetting a device, or None.  Locked"""
+
+        now = clock.now()
+        if self.own.get( device, 0 ) > now:
+            return( self.id )
+        lease = self.leases.get( device )
+        if lease is not None and lease[2] is not None and lease[1] > now:
+            return( lease[0] )
+        return( None )
+
+    def _claimed( self, device ):
+        """return the ( time, id ) of the claim of a device we granted,
+        or None.  Locked"""
+
+        lease = self.leases.get( device )
+        if lease is not None and lease[2] is None and \
+           lease[1] > clock.now():
+            return( lease[3] )
+        return( None )
+
+    def _adopt( self, device, peer, secs, now ):
+        """note that a peer is resetting a device.  Locked"""
+
+        lease = self.leases.get( device )
+        if lease is None or lease[0] != peer or lease[2] is None:
+            self.resets[ device ] = ( peer, now )
+            lease = [ peer, now, now, None ]
+            self.leases[ device ] = lease
+        lease[1] = now + int( secs )
+        self.cond.notify_all()
+
+    def _send( self, message, address ):
+        message = dict( message, **{ 'from': self.id })
+        try:
+            self.sock.sendto( json.dumps( message ).encode( 'utf-8' ),
+                              address )
+        except ( IOError, OSError ) as err:
+            dprint( "Peers._send(): can't send to {0}: {1}".format(
+                address, err ))
+
+    def _send_all( self, message ):
+        for address in self.addresses:
+            self._send( message, address )
+
+    def _run( self ):
+        while True:
+            ( ready, w, x ) = select.select(
+                [ self.sock, self.stop_read ], [], [] )
+            if self.stop_read in ready:
+                return
+            try:
+                ( data, address ) = self.sock.recvfrom( MAX_MESSAGE )
+                message = json.loads( data.decode( 'utf-8' ))
+            except ( IOError, OSError, ValueError ):
+                continue
+            if address not in self.addresses or \
+               not isinstance( message, dict ) or \
+               message.get( 'type' ) not in TYPES:
+                continue
+            if message.get( 'from' ) == self.id:
+                # we are in the list.  Don't wait for our own replies
+                with self.cond:
+                    self.addresses = [ a for a in self.addresses
+                                       if a != address ]
+                    self.cond.notify_all()
+                continue
+            try:
+                self._receive( message, address )
+            except Exception as err:
+                sys.stderr.write( "{}: bad message from peer {}: {}\n". \
+                    format( globals.progname, address[0], err ))
+
+    def _receive( self, message, address ):
+        kind = message[ 'type' ]
+        peer = str( message[ 'from' ] )
+        now  = clock.now()
+        dprint( "Peers: {0:s} from {1:s}".format( kind, peer ))
+
+        with self.cond:
+            self.heard[ address ] = now
+            self.names[ address ] = peer
+
+            if kind == 'verdict':
+                for ( device, up ) in message[ 'devices' ].items():
+                    self.verdicts[ device ] = ( peer, bool( up ), now )
+                for ( device, secs ) in message[ 'resetting' ].items():
+                    self._adopt( device, peer, secs, now )
+                return
+
+            device = str( message[ 'device' ] )
+
+            if kind == 'claim':
+                claim = ( float( message[ 'time' ] ), peer )
+                holder = self._holder( device )
+                if holder == peer:
+                    holder = None
+                if holder is None:
+                    # the earliest claim we know of wins
+                    known = [ c for c in ( self.pending.get( device ),
+                                           self._claimed( device ))
+                              if c is not None and c[1] != peer and
+                                 c < claim ]
+                    if known:
+                        holder = min( known )[1]
+                if holder is not None:
+                    reply = { 'type': 'deny', 'device': device,
+                              'holder': holder }
+                    if self.own.get( device, 0 ) > now:
+                        reply[ 'secs' ] = int( self.own[ device ] - now ) + 1
+                    self._send( reply, address )
+                    return
+                lease = self.leases.get( device )
+                if lease is None or lease[2] is None or lease[1] <= now:
+                    self.leases[ device ] = [ peer, now + CLAIM_LEASE, None,
+                                              claim ]
+                self._send({ 'type': 'grant', 'device': device }, address )
+                self.cond.notify_all()
+
+            elif kind in ( 'grant', 'deny' ):
+                replies = self.replies.get( device )
+                if replies is not None:
+                    holder = None
+                    if kind == 'deny':
+                        holder = str( message[ 'holder' ] )
+                    replies[ address ] = holder
+                    self.cond.notify_all()
+                if kind == 'deny' and 'secs' in message:
+                    self._adopt( device, peer, message[ 'secs' ], now )
+
+            elif kind == 'reset':
+                self._adopt( device, peer, message[ 'secs' ], now )
+
+            elif kind == 'done':
+                lease = self.leases.get( device )
+                if lease is None or lease[0] != peer or lease[2] is None:
+                    # a reset we didn't hear of
+                    self.resets[ device ] = ( peer, now )
+                if lease is not None and lease[0] == peer:
+                    del self.leases[ device ]
+                if message.get( 'up' ) is not None:
+                    self.verdicts[ device ] = ( peer, bool( message[ 'up' ] ),
+                                                now )
@@ -21,7 +21,8 @@ RPi.GPIO module installed, by either doing a:
     sudo apt-get install rpi.gpio
 on a Debian based Linux box, or installing from the Python Package Index:
         pip install RPi.GPIO
-This module will only be imported if run on a Raspberry Pi.
+This module will only be imported if run on a Raspberry Pi, and then
+only when a device is reset, or the daemon starts.
 
 There is an option called -e or --delay-exit, which may not be clear why.
 The reason for this is that if you do not use the --quiet option, then
@@ -35,15 +36,47 @@ before you spit out the message and then exit.
 The default is no delay.  A good value to use would be 180 seconds.
 """
 
+import time
+_import_start = time.time()     # for --profile
+
 import os
 import sys
-import time
-import re
-import getpass
+import importlib
+
+# only what a run from the cron needs while the network is up is
+# imported here.  The rest, such as the relay, the maintenance calendar
+# and everything only used with an option, is imported when used, to
+# start quickly on a small Pi.  Their defaults are in constants.py
 
 from . import __version__
-from .globals import progname, debug_flag
-from .functions import *
+from . import globals
+from .globals import progname
+from .functions import dprint, is_int, num_too_big, logit, parse_device, \
+    unique_hosts, test_networks, read_state, update_state, \
+    read_timestamp, write_timestamp, instance_filename, instance_lock, \
+    socket_filename
+from . import probes
+from . import timing
+from . import clock
+from .constants import RESET_STAGES, WAN, LINK, FSYNC_POLICIES, \
+    FLUSH_INTERVAL, DEFAULT_TTL, DEFAULT_PEER_PORT, GPIO_DRIVERS, \
+    DEFAULT_GPIO_DRIVER, DEFAULT_GPIO_CHIP
+
+_import_end = time.time()
+
+HEALTH_SAVE_INTERVAL = 10 * 60      # secs between saves in daemon mode
+
+# options that can't be changed by reloading the config, as they are
+# only used when the daemon starts
+RESTART_OPTIONS = ( 'daemon-flag', 'have-gpio', 'health-flag', 'lock-file',
+                    'metrics-port', 'netlink-flag', 'control-flag',
+                    'control-socket', 'record-file', 'profile-file',
+                    'history-size', 'event-log', 'event-fsync',
+                    'event-max-size', 'event-max-age', 'event-keep',
+                    'gpio-driver', 'gpio-path', 'peer-hosts', 'peer-port' )
+
+# subcommands.  Each is a module with a main( argv )
+SUBCOMMANDS = ( 'tune', 'control', 'report' )
 
 
 def die( error ):
@@ -64,6 +97,605 @@ def die( error ):
     sys.exit(1)
 
 
+def check( opts, state=None ):
+    """check the network, and reset any device that is unreachable
+
+    This is one complete pass: maintenance check, network test, then
+    the lock check and reset for each device.  It is run once from the
+    cron, or repeatedly by the daemon.  Hosts shared by more than one
+    device are only probed once.  With --diagnose, a device is only
+    reset if the fault is in one of its reset-stages.  With --max-loss
+    or --max-rtt, a device whose hosts answer is still reset if they
+    have been too lossy or slow.  With --peers, a device another
+    instance is resetting is neither probed nor reset.
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  optional state dictionary kept between calls by the daemon.
+            Each device has a dictionary in it, under its name, holding
+            the last reset time and its relay, so the lock-file only
+            has to be read once.  'network-up' is set to whether every
+            device could reach its hosts, and 'last-check' to when the
+            check started, and 'maint-until' to when the maintenance
+            window it was skipped for ends.
+    Returns:
+        0:  ok
+    """
+
+    if state is None:
+        state = {}
+
+    start_time = time.time()
+
+    # in a maintenance window?  The daemon sleeps until it ends
+
+    schedule = opts[ 'maint' ]
+    if schedule is not None and len( schedule ):
+        until = schedule.window_end( clock.now())
+        timing.add_span( 'maintenance', start_time, time.time())
+        if until is not None:
+            dprint( "now in maintenance window until {0:s}.  Quitting.". \
+                format( time.strftime( "%a %b %d %H:%M",
+                                       clock.localtime( until ))))
+            state[ 'maint-until' ] = until
+            from . import metrics
+            metrics.inc( 'maintenance_skips_total' )
+            log_event( opts, 'maint-skip', until=until )
+            write_metrics( opts )
+            return(0)
+        dprint( "not in a maintenance window." )
+        state.pop( 'maint-until', None )
+
+    # with --diagnose, there is no point probing anything if our own
+    # link is down, and resetting the modem won't fix it
+
+    gateway = opts[ 'gateway' ]
+    if opts[ 'diagnose-flag' ]:
+        from . import diagnose
+        with timing.span( 'check_link' ):
+            ( link_ok, reason, route_gateway ) = diagnose.check_link()
+        if not link_ok:
+            state[ 'network-up' ] = False
+            local_fault( opts, LINK, reason )
+            write_metrics( opts )
+            return(0)
+        if not gateway:
+            gateway = route_gateway
+
+    # with --peers, a device another instance is resetting isn't
+    # probed.  Its verdict is taken instead
+
+    devices = opts[ 'devices' ]
+    peers   = opts[ 'peers' ]
+    leased  = {}
+    if peers is not None:
+        adopt_resets( opts, state )
+        leased = peers.held()
+    probed  = [ d for d in devices if d[ 'device-name' ] not in leased ]
+
+    # see if the network still reachable, for each device
+
+    groups  = [ d[ 'hosts' ] for d in probed ]
+    quorums = [ d[ 'quorum' ] for d in probed ]
+
+    # probe the hosts known to be good first, with timeouts to suit them
+    health   = opts[ 'health' ]
+    timeouts = {}
+    if health is not None:
+        groups = [ health.order( hosts ) for hosts in groups ]
+        for host in unique_hosts( groups ):
+            timeouts[ host ] = health.timeout( host, opts[ 'ping-timeout' ] )
+
+    recorder = opts[ 'recorder' ]
+    if recorder is not None:
+        recorder.check_start( clock.now(), opts[ 'ping-timeout' ] )
+
+    with timing.span( 'test_networks' ):
+        results = test_networks( groups, opts[ 'ping-tries' ],
+                                 opts[ 'ping-timeout' ],
+                                 opts[ 'concurrent-flag' ], opts[ 'probe' ],
+                                 timeouts, quorums )
+
+    if recorder is not None:
+        recorder.check_end()
+
+    if leased:
+        found   = iter( results )
+        results = [ int( peers.verdict( d[ 'device-name' ] ))
+                    if d[ 'device-name' ] in leased else next( found )
+                    for d in devices ]
+
+    # hosts that answer can still be too lossy or slow to be usable
+
+    reasons = [ None ] * len( devices )
+    history = opts[ 'history' ]
+    if history is not None:
+        for ( i, device ) in enumerate( devices ):
+            if device[ 'device-name' ] in leased:
+                continue
+            if results[i] and ( device[ 'max-loss' ] or device[ 'max-rtt' ] ):
+                reasons[i] = history.degraded( device[ 'hosts' ],
+                    device[ 'quorum' ], device[ 'max-loss' ],
+                    device[ 'max-rtt' ] )
+                if reasons[i] is not None:
+                    results[i] = 0
+        write_history_metrics( history, groups )
+
+    state[ 'network-up' ] = all( results )
+    state[ 'last-check' ] = start_time
+    for ( device, up, degraded ) in zip( devices, results, reasons ):
+        dstate = state.setdefault( device[ 'device-name' ], {} )
+        dstate[ 'up' ] = bool( up )
+        if not up and device[ 'device-name' ] in leased:
+            degraded = "being reset by {}".format(
+                leased[ device[ 'device-name' ]] )
+        if not up:
+            degraded = degraded or "network unreachable"
+        save_outcome( opts, device, dstate, degraded )
+    log_event( opts, 'check', up=state[ 'network-up' ],
+               devices=dict(( d[ 'device-name' ], bool( up ))
+                            for ( d, up ) in zip( devices, results )))
+    if peers is not None:
+        peers.share( dict(( d[ 'device-name' ], bool( up ))
+                          for ( d, up ) in zip( devices, results )
+                          if d[ 'device-name' ] not in leased ))
+
+    if health is not None:
+        save_health( opts, state )
+
+    # find where the fault is, once for all the devices
+
+    stage  = WAN
+    reason = None
+    if opts[ 'diagnose-flag' ] and not all( results ):
+        from . import diagnose
+        with timing.span( 'locate' ):
+            ( stage, reason ) = diagnose.locate( gateway, opts[ 'modem' ],
+                opts[ 'ping-tries' ], opts[ 'ping-timeout' ], opts[ 'probe' ] )
+        dprint( "fault located at stage {0:s}: {1:s}".format( stage, reason ))
+
+    started = []
+    faults  = []
+    for ( device, up, degraded ) in zip( devices, results, reasons ):
+        if up:
+            # still up
+            dprint( "Nothing to do for {0:s}. All is well.". \
+                format( device[ 'device-name' ] ))
+            continue
+
+        if device[ 'device-name' ] in leased:
+            peer = leased[ device[ 'device-name' ]]
+            dprint( "{0:s} is being reset by {1:s}.  skipping". \
+                format( device[ 'device-name' ], peer ))
+            log_event( opts, 'peer-skip', device=device[ 'device-name' ],
+                       peer=peer )
+            continue
+
+        if opts[ 'diagnose-flag' ] and degraded is None and \
+           stage not in device[ 'reset-stages' ]:
+            if stage not in faults:
+                local_fault( opts, stage, reason )
+                faults.append( stage )
+            dprint( "{0:s} is not reset for a fault in the {1:s}". \
+                format( device[ 'device-name' ], stage ))
+            continue
+
+        dstate = state.setdefault( device[ 'device-name' ], {} )
+        relay = check_device( opts, device, dstate, degraded or reason )
+        if relay is not None:
+            started.append( relay )
+            if history is not None:
+                # don't judge the device on how it was before the reset
+                history.clear( device[ 'hosts' ] )
+
+    decided = time.time()
+    if opts[ 'metrics-file' ] or opts[ 'metrics-port' ]:
+        from . import metrics
+        metrics.observe( 'check_duration_seconds', decided - start_time )
+    timing.add_span( 'check', start_time, decided )
+
+    # with the network up, look up any host names that are due.  Not
+    # before, so DNS being down can't slow finding the network down
+    if opts[ 'resolver' ] is not None and any( results ):
+        opts[ 'resolver' ].refresh()
+
+    # the daemon carries on checking while the power cycles run
+    if not opts[ 'daemon-flag' ]:
+        for relay in started:
+            relay.wait()
+
+    write_metrics( opts )
+    write_record( opts )
+    return(0)
+
+
+def adopt_resets( opts, state ):
+    """take the resets made by --peers since the last check as our own,
+    so the timing lock applies to them
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  state dictionary, as for check()
+    """
+
+    resets = opts[ 'peers' ].take_resets()
+    for device in opts[ 'devices' ]:
+        name = device[ 'device-name' ]
+        if name not in resets:
+            continue
+        ( peer, when ) = resets[ name ]
+        dprint( "{0:s} was reset by {1:s}".format( name, peer ))
+        write_timestamp( device[ 'lock-file' ], { 'device-name': name,
+            'reset-reason': "reset by {}".format( peer ) })
+        state.setdefault( name, {} )[ 'last-reset' ] = int( when )
+        log_event( opts, 'peer-reset', device=name, peer=peer )
+
+
+def local_fault( opts, stage, reason ):
+    """report a fault found by --diagnose that resets nothing
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  stage of the network the fault is in
+        3:  what is wrong
+    """
+
+    from . import metrics
+
+    progname = opts[ 'progname' ]
+    metrics.inc( 'local_faults_total', (( 'stage', stage ),))
+    log_event( opts, 'local-fault', stage=stage, reason=reason )
+
+    msg = "{0:s}: {1:s}.  not resetting\n".format( progname, reason )
+    dprint( msg.rstrip())
+    if opts[ 'logging-flag' ]:
+        try:
+            logit( opts[ 'log-file' ], msg )
+        except Exception as err:
+            sys.stderr.write( "%s: %s\n" % ( progname, err ))
+
+
+def log_event( opts, event, **fields ):
+    """add an event to the --event-log, if there is one
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  event name (see eventlog.py)
+        3:  keyword arguments: the fields of the event
+    """
+
+    if opts[ 'events' ] is not None:
+        opts[ 'events' ].log( event, **fields )
+
+
+def save_outcome( opts, device, dstate, reason ):
+    """save the outcome of probing a device's hosts in its lock-file,
+    if it changed
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  device dictionary (see parse_device())
+        3:  state dictionary for the device
+        4:  why it is down, or None if it is up
+    """
+
+    if 'probe' not in dstate:
+        saved = read_state( device[ 'lock-file' ] )
+        dstate[ 'probe' ] = saved.get( 'probe', {} )
+        dstate.setdefault( 'last-reset', saved.get( 'last-reset' ))
+
+    old = dstate[ 'probe' ]
+    if old.get( 'up' ) == ( reason is None ) and \
+       old.get( 'reason' ) == reason:
+        return
+
+    probe = { 'up': reason is None, 'reason': reason,
+              'since': int( clock.now()) }
+    try:
+        update_state( device[ 'lock-file' ],
+                      { 'device': device[ 'device-name' ], 'probe': probe })
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "%s: can't write lock-file: %s\n" % \
+            ( opts[ 'progname' ], err ))
+        return
+    dstate[ 'probe' ] = probe
+
+
+def write_history_metrics( history, groups ):
+    """set the loss and rtt gauges of each host from its probe history
+
+    Arguments:
+        1:  History
+        2:  array of arrays of hosts
+    """
+
+    from . import metrics
+
+    if not metrics.enabled():
+        return
+
+    for host in unique_hosts( groups ):
+        st = history.stats( host )
+        labels = (( 'host', host ),)
+        if st[ 'loss' ] is not None:
+            metrics.gauge( 'host_loss_ratio', st[ 'loss' ], labels )
+        if st[ 'p95' ] is not None:
+            metrics.gauge( 'host_rtt_p95_seconds', st[ 'p95' ], labels )
+
+
+def write_metrics( opts ):
+    """write the metrics textfile, if we were given one
+
+    Arguments:
+        1:  options dictionary built by main()
+    """
+
+    if not opts[ 'metrics-file' ]:
+        return
+
+    from . import metrics
+    try:
+        metrics.write_textfile( opts[ 'metrics-file' ] )
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "%s: can't write metrics: %s\n" % \
+            ( opts[ 'progname' ], err ))
+
+
+def write_record( opts ):
+    """append the probes of the check to the --record trace, if any
+
+    Arguments:
+        1:  options dictionary built by main()
+    """
+
+    if opts[ 'recorder' ] is None:
+        return
+
+    try:
+        opts[ 'recorder' ].flush()
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "%s: can't write probe trace: %s\n" % \
+            ( opts[ 'progname' ], err ))
+
+
+def save_health( opts, state ):
+    """save the host health index
+
+    From the cron, it is saved every time.  The daemon only saves it
+    every HEALTH_SAVE_INTERVAL seconds, to save writes to the SD card.
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  state dictionary
+    """
+
+    now = time.time()
+    if opts[ 'daemon-flag' ]:
+        if now - state.get( 'health-saved', 0 ) < HEALTH_SAVE_INTERVAL:
+            return
+    state[ 'health-saved' ] = now
+
+    try:
+        opts[ 'health' ].save()
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "%s: can't save host health: %s\n" % \
+            ( opts[ 'progname' ], err ))
+
+
+def check_device( opts, device, dstate, reason=None ):
+    """start a reset of an unreachable device, if it is not locked
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  device dictionary (see parse_device())
+        3:  state dictionary for the device
+        4:  optional reason for the reset, from --diagnose
+    Returns:
+        the Relay started, or None if no reset was done
+    """
+
+    from .relay import Relay, POWER_ON, RECOVERING, IDLE
+    from . import recovery
+    from . import metrics
+
+    progname    = opts[ 'progname' ]
+    device_name = device[ 'device-name' ]
+    lock_file   = device[ 'lock-file' ]
+
+    # a power cycle started by an earlier check may still be going
+    relay = dstate.get( 'relay' )
+    if relay is not None and relay.busy():
+        dprint( "reset of {0:s} still in progress ({1:s}).  skipping". \
+            format( device_name, relay.state ))
+        log_event( opts, 'busy-skip', device=device_name, state=relay.state )
+        return( None )
+
+    # see if the device is locked from a recent reset
+    device_locked = False
+    diff = None
+    if 'last-reset' not in dstate:
+        dstate[ 'last-reset' ] = read_timestamp( lock_file )
+    if dstate[ 'last-reset' ] is not None:
+        diff = int( clock.now()) - dstate[ 'last-reset' ]
+        dprint( "{0:d} seconds since last reset of {1:s}". \
+            format( diff, device_name ))
+        if diff < device[ 'wait-time' ]:
+            device_locked = True
+
+    if device_locked:
+        dprint( "found a timing lock: %s" % lock_file )
+        # the device is locked from resetting
+        if opts[ 'force-flag' ] == False:
+            dprint( "timing lock in effect.  skipping the reset" )
+            metrics.inc( 'resets_locked_total', (( 'device', device_name ),))
+            log_event( opts, 'lock-skip', device=device_name, since=diff,
+                       wait=device[ 'wait-time' ] )
+            return( None )
+        else:
+            # force the reset despite the lock
+            dprint( "over-riding device timing lock because of force flag" )
+    else:
+        dprint( "no device timing lock found" )
+
+    # with --peers, only one instance resets a device
+    if opts[ 'peers' ] is not None:
+        secs = device[ 'reset-time' ] + opts[ 'delay-exit' ]
+        holder = opts[ 'peers' ].claim( device_name, secs,
+                                        opts[ 'force-flag' ] )
+        if holder is not None:
+            dprint( "{0:s} is being reset by {1:s}.  skipping". \
+                format( device_name, holder ))
+            metrics.inc( 'peer_claims_lost_total',
+                         (( 'device', device_name ),))
+            log_event( opts, 'claim-lost', device=device_name, peer=holder )
+            return( None )
+
+    # ok, let's do it...
+    if ( opts[ 'logging-flag' ] ):
+        msg = "{0:s}: {1:s}.  resetting {2:s}\n". \
+            format( progname, reason or "network unreachable", device_name )
+        try:
+            logit( opts[ 'log-file' ], msg )
+        except Exception as err:
+            sys.stderr.write( "%s: %s\n" % ( progname, err ))
+            # keep going
+
+    def recover_check( relay ):
+        # poll the hosts of the device until it answers, for at most
+        # the delay exit time
+        return( recovery.watch( device[ 'hosts' ], opts[ 'delay-exit' ],
+            opts[ 'ping-timeout' ], opts[ 'concurrent-flag' ], opts[ 'probe' ],
+            lambda: relay.state != RECOVERING, device[ 'quorum' ] ))
+
+    vals = { 'quiet-flag':   opts[ 'quiet-flag' ],
+             'device-name':  device_name,
+             'reset-reason': reason or "network unreachable",
+             'recover-time': opts[ 'delay-exit' ] }
+    if opts[ 'delay-exit' ]:
+        vals[ 'recover-check' ] = recover_check
+
+    def relay_changed( relay, new_state ):
+        if new_state == POWER_ON:
+            write_timestamp( lock_file, vals )
+            log_event( opts, 'power-on', device=device_name )
+        elif new_state == IDLE and POWER_ON in relay.times:
+            # a cycle cancelled with the power off isn't watched
+            if opts[ 'delay-exit' ] and RECOVERING in relay.times:
+                labels = (( 'device', device_name ),)
+                log_event( opts, 'recovery', device=device_name,
+                           secs=relay.recovered_after )
+                if relay.recovered_after is None:
+                    metrics.inc( 'recovery_failures_total', labels )
+                    msg = "{0:s}: {1:s} did not recover within {2:d} secs". \
+                        format( progname, device_name, opts[ 'delay-exit' ] )
+                else:
+                    metrics.observe( 'recovery_seconds',
+                                     relay.recovered_after, labels )
+                    msg = "{0:s}: {1:s} recovered {2:.0f} secs after reset". \
+                        format( progname, device_name, relay.recovered_after )
+                msg = msg + "\n"
+                dprint( msg.rstrip())
+                if opts[ 'logging-flag' ]:
+                    try:
+                        logit( opts[ 'log-file' ], msg )
+                    except Exception as err:
+                        sys.stderr.write( "%s: %s\n" % ( progname, err ))
+
+            # Informational message to print, using the time power
+            # came back rather than after the delay exit
+
+            if not opts[ 'quiet-flag' ]:
+                when = time.localtime( relay.times[ POWER_ON ] )
+                print( "{0:s} reset at {1:s}".format( device_name,
+                    time.strftime( "%a %b %d, %Y %H:%M:%S", when )))
+                sys.stdout.flush()
+
+        # let the peers reset it again, and take our verdict on it
+        if new_state == IDLE and opts[ 'peers' ] is not None:
+            up = None
+            if opts[ 'delay-exit' ] and RECOVERING in relay.times:
+                up = relay.recovered_after is not None
+            opts[ 'peers' ].done( device_name, up )
+
+    # been long enough since last reset.  do it now.
+    # The delay exit is the most time the device is watched for
+    # recovering after power comes back
+
+    if opts[ 'delay-exit' ]:
+        dprint( "delay exit.  will wait up to {0:d} seconds after reset". \
+            format( opts[ 'delay-exit' ] ))
+
+    relay = Relay( device[ 'pin' ], device[ 'reset-time' ], vals,
+                   opts[ 'have-gpio' ], relay_changed, opts[ 'gpio' ] )
+    dstate[ 'relay' ] = relay
+    dstate[ 'last-reset' ] = int( clock.now())
+    log_event( opts, 'reset', device=device_name,
+               reason=reason or "network unreachable",
+               forced=opts[ 'force-flag' ] )
+    relay.start()
+    metrics.inc( 'resets_total', (( 'device', device_name ),))
+
+    return( relay )
+
+
+def force_reset( opts, state, name ):
+    """reset a device now, despite its timing lock
+
+    For the control socket of the daemon.
+
+    Arguments:
+        1:  options dictionary built by main()
+        2:  state dictionary, as for check()
+        3:  device name
+    Returns:
+        the Relay started, or None if a reset is already in progress
+    """
+
+    device = [ d for d in opts[ 'devices' ] if d[ 'device-name' ] == name ][0]
+    forced = dict( opts )
+    forced[ 'force-flag' ] = True
+    dstate = state.setdefault( name, {} )
+    relay = check_device( forced, device, dstate, "reset asked for" )
+    if relay is not None and opts.get( 'history' ) is not None:
+        opts[ 'history' ].clear( device[ 'hosts' ] )
+    return( relay )
+
+
+def forward_reset( opts ):
+    """pass --force-reset to a daemon listening on the control socket
+
+    Arguments:
+        1:  options dictionary built by main()
+    Returns:
+        0 or 1 as for main(), or None if no daemon is listening
+    """
+
+    from . import control
+
+    path = opts[ 'control-socket' ]
+    if not os.path.exists( path ):
+        return( None )
+
+    results = []
+    for device in opts[ 'devices' ]:
+        try:
+            reply = control.request( path, { 'command': 'force-reset',
+                'device': device[ 'device-name' ] })
+        except ( IOError, OSError ) as err:
+            dprint( "no daemon on {0:s}: {1}".format( path, err ))
+            return( None )
+        if not reply.get( 'ok' ):
+            sys.stderr.write( "%s: %s\n" % ( opts[ 'progname' ],
+                                             reply.get( 'error' )))
+            results.append(1)
+            continue
+        if not opts[ 'quiet-flag' ]:
+            print( "daemon: {0:s}".format( reply.get( 'message' )))
+        results.append(0)
+
+    return( max( results ))
+
+
 # main
 #
 # Arguments:
@@ -74,14 +706,15 @@ def die( error ):
 # Exceptions:
 #   none
 
-def main( argv=sys.argv ):
-    """main program
+def get_options( argv ):
+    """parse the command line options
 
-    use -h or --help for command line options
+    Any error in the options is fatal.
 
+    Arguments:
+        1:  command-line arguments
     Returns:
-        0:  ok
-        1:  not ok
+        options dictionary, or None if --help or --version was given
     """
 
     progname = os.path.basename( argv[0] )
@@ -90,7 +723,22 @@ def main( argv=sys.argv ):
 
     globals.progname = progname     # make available to other functions
 
-    # see if we are running on a raspberry Pi
+    # the options in a config file go in front of those on the command
+    # line, so the command line wins
+
+    config_file = ""
+    for i in range( 1, len( argv ) - 1 ):
+        if argv[i] == '-C' or argv[i] == '--config':
+            config_file = argv[ i + 1 ]
+    if config_file:
+        from . import config
+        try:
+            argv = config.merge( config.read( config_file ), argv )
+        except Exception as err:
+            die( err )
+
+    # see if we are running on a raspberry Pi.  The other GPIO drivers
+    # are used wherever they are asked for
     HAVE_GPIO = False
     if os.uname()[4].lower().startswith( 'arm' ):
         HAVE_GPIO = True
@@ -106,8 +754,42 @@ def main( argv=sys.argv ):
     device_name      = 'device'      # use device name in log message
     log_file         = ""            # LOG file.  none by default
     maint_times      = []            # array of maint times HH:MM-HH:MM
+    maint_file       = ""            # CSV or iCalendar windows.  none
+    device_specs     = []            # array of --device specifications
     quiet_flag       = False
     force_flag       = False
+    concurrent_flag  = False
+    health_flag      = True          # order hosts by their health
+    daemon_flag      = False
+    interval         = 60            # secs between checks in daemon mode
+    idle_interval    = 0             # most secs with --netlink.  4 x above
+    netlink_flag     = False         # check on network changes
+    quorum           = 1             # hosts that must answer to be up
+    max_loss         = 0             # % loss to reset at.  no limit
+    max_rtt          = 0             # p95 rtt (ms) to reset at.  no limit
+    history_size     = 100           # probes kept per host
+    metrics_file     = ""            # node_exporter textfile.  none
+    metrics_port     = 0             # HTTP port for metrics.  none
+    profile_file     = ""            # trace file for --profile.  none
+    simulate_file    = ""            # scenario for --simulate.  none
+    record_file      = ""            # probe trace for --record.  none
+    event_log        = ""            # JSON event log.  none
+    event_fsync      = 'flush'       # when to sync it.  see eventlog.py
+    event_max_size   = 1024          # KB to rotate it at
+    event_max_age    = 0             # hours to rotate it at.  no limit
+    event_keep       = 5             # rotated event logs kept
+    dns_ttl          = DEFAULT_TTL   # secs to use a looked-up address
+    diagnose_flag    = False         # find the fault before resetting
+    control_flag     = False         # listen on a control socket
+    control_socket   = ""            # lock-file with '.sock' by default
+    gateway          = ""            # gateway address.  default route's
+    modem            = ""            # modem management address.  none
+    reset_stages     = list( RESET_STAGES )
+    probe_backend    = 'system'      # how to probe hosts.  see probes.py
+    gpio_driver      = DEFAULT_GPIO_DRIVER   # see gpio.py
+    gpio_path        = ""            # gpiochip, or file for file driver
+    peer_hosts       = []            # other instances, for --peers
+    peer_port        = DEFAULT_PEER_PORT
     help_flag        = False
     logging_flag     = False
     dns_hosts        = [ '8.8.4.4', '8.8.8.8' ]
@@ -119,6 +801,10 @@ def main( argv=sys.argv ):
     max_wait_time    = 30 * 60
     max_ping_timeout = 10
     max_ping_tries   = 10
+    max_interval     = 60 * 60
+    max_history      = 10000
+    max_event_keep   = 100
+    max_dns_ttl      = 7 * 24 * 60 * 60
 
     # get options
 
@@ -129,6 +815,23 @@ def main( argv=sys.argv ):
             arg = argv[i]
             if arg == '-d' or arg == '--debug':
                 globals.debug_flag = True
+            elif arg == '-C' or arg == '--config':
+                i = i + 1               # already read
+            elif arg == '--daemon':
+                daemon_flag = True
+            elif arg == '--no-health':
+                health_flag = False
+            elif arg == '--diagnose':
+                diagnose_flag = True
+            elif arg == '--netlink':
+                netlink_flag = True
+            elif arg == '--control':
+                control_flag = True
+            elif arg == '--control-socket':
+                i = i + 1 ; control_socket = argv[i]
+                control_flag = True
+            elif arg == '-c' or arg == '--concurrent':
+                concurrent_flag = True
             elif arg == '-h' or arg == '--help':
                 help_flag = True
             elif arg == '-f' or arg == '--force-reset':
@@ -151,13 +854,145 @@ def main( argv=sys.argv ):
                     die( "wait time too large ({:s} > {:d})". \
                         format( val, max_wait_time ))
                 wait_time = int( val )
+            elif arg == '-i' or arg == '--interval':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if int( val ) < 1:
+                    die( "interval must be at least 1 second" )
+                if ( num_too_big( int( val ), max_interval )):
+                    die( "interval too large ({:s} > {:d})". \
+                        format( val, max_interval ))
+                interval = int( val )
+            elif arg == '--idle-interval':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if ( num_too_big( int( val ), max_interval )):
+                    die( "idle interval too large ({:s} > {:d})". \
+                        format( val, max_interval ))
+                idle_interval = int( val )
+            elif arg == '--max-loss':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if ( int( val ) < 0 ) or ( int( val ) > 100 ):
+                    die( "invalid max loss: \'{}\'".format( val ))
+                max_loss = int( val )
+            elif arg == '--max-rtt':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                max_rtt = int( val )
+            elif arg == '--history':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if int( val ) < 10:
+                    die( "history must be at least 10 probes" )
+                if ( num_too_big( int( val ), max_history )):
+                    die( "history too large ({:s} > {:d})". \
+                        format( val, max_history ))
+                history_size = int( val )
+            elif arg == '--quorum':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if int( val ) < 1:
+                    die( "quorum must be at least 1" )
+                quorum = int( val )
+            elif arg == '--metrics-file':
+                i = i + 1 ; metrics_file = argv[i]
+            elif arg == '--metrics-port':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if ( int( val ) < 1 ) or ( int( val ) > 65535 ):
+                    die( "invalid port num: \'{}\'".format( val ))
+                metrics_port = int( val )
+            elif arg == '--profile':
+                i = i + 1 ; profile_file = argv[i]
+            elif arg == '--simulate':
+                i = i + 1 ; simulate_file = argv[i]
+            elif arg == '--record':
+                i = i + 1 ; record_file = argv[i]
+            elif arg == '--event-log':
+                i = i + 1 ; event_log = argv[i]
+            elif arg == '--event-fsync':
+                i = i + 1 ; val = argv[i]
+                if val not in FSYNC_POLICIES:
+                    die( "unknown fsync policy: \'{0:s}\' (use {1:s})". \
+                        format( val, ','.join( FSYNC_POLICIES )))
+                event_fsync = val
+            elif arg == '--event-max-size':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                event_max_size = int( val )
+            elif arg == '--event-max-age':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                event_max_age = int( val )
+            elif arg == '--event-keep':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if ( num_too_big( int( val ), max_event_keep )):
+                    die( "event logs kept too many ({:s} > {:d})". \
+                        format( val, max_event_keep ))
+                event_keep = int( val )
+            elif arg == '--dns-ttl':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if ( num_too_big( int( val ), max_dns_ttl )):
+                    die( "DNS ttl too large ({:s} > {:d})". \
+                        format( val, max_dns_ttl ))
+                dns_ttl = int( val )
+            elif arg == '--gpio':
+                i = i + 1 ; val = argv[i]
+                if val not in GPIO_DRIVERS:
+                    die( "unknown GPIO driver: \'{0:s}\' (use one of {1:s})". \
+                        format( val, ','.join( sorted( GPIO_DRIVERS ))))
+                gpio_driver = val
+            elif arg == '--gpio-path':
+                i = i + 1 ; gpio_path = argv[i]
+            elif arg == '--peers':
+                i = i + 1 ; val = argv[i]
+                peer_hosts = [ p.strip() for p in val.split( "," )
+                               if p.strip() ]
+                from .peers import parse_peer
+                for peer in peer_hosts:
+                    try:
+                        parse_peer( peer )
+                    except Exception as err:
+                        die( err )
+            elif arg == '--peer-port':
+                i = i + 1 ; val = argv[i]
+                if is_int( val ) == False:
+                    die( "Not an integer: \'{0:s}\'".format( val ))
+                if ( int( val ) < 1 ) or ( int( val ) > 65535 ):
+                    die( "invalid port num: \'{}\'".format( val ))
+                peer_port = int( val )
+            elif arg == '--gateway':
+                i = i + 1 ; gateway = argv[i]
+            elif arg == '--modem':
+                i = i + 1 ; modem = argv[i]
+            elif arg == '--reset-stages':
+                i = i + 1 ; val = argv[i]
+                reset_stages = [ s for s in val.split( "," ) if s ]
             elif arg == '-m' or arg == '--maint':
                 i = i + 1
                 maint_times.append( argv[i] )
+            elif arg == '--maint-file':
+                i = i + 1 ; maint_file = argv[i]
             elif arg == '-t' or arg == '--tries':
                 i = i + 1 ; val = argv[i]
                 if is_int( val ) == False:
                     die( "Not an integer: \'{0:s}\'".format( val ))
+                if int( val ) < 1:
+                    die( "num ping tries must be at least 1" )
                 if ( num_too_big( int( val ), max_ping_tries )):
                     die( "num ping tries too large ({:s} > {:d})". \
                         format( val, max_ping_tries ))
@@ -183,6 +1018,15 @@ def main( argv=sys.argv ):
                 if ( val > 27 ) or ( val < 0 ):
                     die( "invalid pin num: \'{}\'".format( val ))
                 pin_number = val
+            elif arg == '-P' or arg == '--probe':
+                i = i + 1 ; val = argv[i]
+                if val not in probes.BACKENDS:
+                    die( "unknown probe type: \'{0:s}\' (use one of {1:s})". \
+                        format( val, ','.join( sorted( probes.BACKENDS ))))
+                probe_backend = val
+            elif arg == '--device':
+                i = i + 1
+                device_specs.append( argv[i] )
             elif arg == '-D' or arg == '--device-name':
                 i = i + 1 ; device_name = argv[i]
             elif arg == '-L' or arg == '--lockfile':
@@ -196,13 +1040,9 @@ def main( argv=sys.argv ):
                 dns_hosts = val.split( "," )
             elif arg == '-V' or arg == '--version':
                 print( "version: {0}".format( __version__ ))
-                return(0)
+                return( None )
             else:
-                m = re.match( "^\-", arg )
-                if m:
-                    die( "unknown option: \'%s\'" % arg )
-                else:
-                    die( "unknown option: \'%s\'" % arg )
+                die( "unknown option: \'%s\'" % arg )
 
         except IndexError as err:
             msg = "Missing argument value to \'{0:s}\'?".format( arg )
@@ -210,17 +1050,26 @@ def main( argv=sys.argv ):
 
         i = i+1
 
+    if idle_interval == 0:
+        idle_interval = min( 4 * interval, max_interval )
+
     # now that we have processed all our options, our usage can show
     # defaults properly
 
     if help_flag:
         print( "usage: {} [options]*".format( progname ))
+        print( "       {} tune [options]* trace-file".format( progname ))
+        print( "       {} control [options]* command [device]". \
+            format( progname ))
+        print( "       {} report [options]* log-file...".format( progname ))
 
         options = """\
+        [-c|--concurrent]          ping all hosts and tries at the same time
         [-d|--debug]               debugging output
-        [-e|--delay-exit num]      delay time before output and exit ({} secs)
+        [-e|--delay-exit num]      max wait for device recovery ({} secs)
         [-f|--force-reset]         reset now and quit, despite state or lock
         [-h|--help]                print this help info
+        [-i|--interval num]        secs between checks with --daemon ({})
         [-l|--logfile string]      log filename (none by default)
         [-m|--maint HH:MM-HH:MM]*  Maintenance time to NOT reset (none by default)
         [-p|--pin num ]            GPIO pin number ({})
@@ -229,110 +1078,446 @@ def main( argv=sys.argv ):
         [-t|--tries num]           max number of ping attempts per host ({})
         [-w|--wait-time num]       reset wait time after previous reset ({} secs)
         [-x|--ping-timeout num]    wait time for ping to time out ({} secs)
+        [-C|--config string]       read options from config file
         [-D|--device-name string]  name of thing being reset for log ({})
-        [-H|--hosts string(s)]     comma-delimited hosts to ping ({})
+        [-H|--hosts string(s)]     comma-delimited hosts, as [probe:]host ({})
         [-L|--lockfile string]     lock-file ({})
-        [-V|--version]             print version of this program ({})\
+        [-P|--probe string]        probe type: {} ({})
+        [-V|--version]             print version of this program ({})
+        [--control]                with --daemon, listen on a control socket
+        [--control-socket string]  control socket (lock-file with .sock)
+        [--daemon]                 keep running, checking every --interval
+        [--device key=val,...]*    a device with its own pin, hosts, etc
+        [--diagnose]               find the failing stage before resetting
+        [--dns-ttl num]            secs to use a host name's address ({})
+        [--event-log string]       log every decision as JSON lines to file
+        [--event-fsync string]     sync event log: {} ({})
+        [--event-keep num]         rotated event logs kept ({})
+        [--event-max-age num]      hours to rotate event log at (none)
+        [--event-max-size num]     KB to rotate event log at ({})
+        [--gateway string]         gateway for --diagnose (default route's)
+        [--gpio string]            GPIO driver: {} ({})
+        [--gpio-path string]       gpiochip ({}), or file for file driver
+        [--maint-file string]      maintenance windows from CSV or iCalendar file
+        [--max-loss num]           reset if hosts lose more % of probes (none)
+        [--max-rtt num]            reset if hosts' p95 rtt is more ms (none)
+        [--modem string]           modem address for --diagnose (none)
+        [--history num]            probes kept per host for --max-* ({})
+        [--idle-interval num]      most secs between checks with --netlink ({})
+        [--netlink]                also check on network changes, with --daemon
+        [--no-health]              don't order hosts, etc by their health
+        [--metrics-file string]    write Prometheus metrics to textfile
+        [--metrics-port num]       serve metrics on localhost with --daemon
+        [--peer-port num]          UDP port to talk to --peers on ({})
+        [--peers string(s)]        other instances watching the devices, as host:port
+        [--profile string]         write a trace of where time went to file
+        [--quorum num]             hosts that must answer to be up ({})
+        [--record string]          append every probe to trace file for tune
+        [--reset-stages string(s)] stages a device is reset for ({})
+        [--simulate string]        replay scenario file on a virtual clock\
         """
-        print( options.format( delay_exit_wait, pin_number, reset_time,
+        print( options.format( delay_exit_wait, interval, pin_number,
+            reset_time,
             ping_tries, wait_time, ping_timeout, device_name,
-            ','.join( dns_hosts ), lock_file, __version__ ))
+            ','.join( dns_hosts ), lock_file,
+            '|'.join( sorted( probes.BACKENDS )), probe_backend, __version__,
+            dns_ttl, '|'.join( FSYNC_POLICIES ), event_fsync, event_keep,
+            event_max_size, '|'.join( sorted( GPIO_DRIVERS )), gpio_driver,
+            DEFAULT_GPIO_CHIP, history_size, idle_interval, peer_port, quorum,
+            ','.join( reset_stages )))
 
-        return(0)
+        return( None )
+
+    # parse the maintenance windows once, up front.  Those in a file
+    # are cached, until it changes
+
+    schedule = None
+    if maint_times or maint_file:
+        from . import maintenance
+        try:
+            schedule = maintenance.compile( maint_times, maint_file,
+                maintenance.cache_filename( lock_file ))
+        except Exception as err:
+            die( err )
 
-    # if we were given any maintenance time intervals
-    if len( maint_times ):
-        current_time = time.localtime( None )
-        c_total_mins = current_time[3] * 60 + current_time[4]
-        dprint( "Current number of minutes into today is {0:d}". \
-            format( c_total_mins ))
+    # the devices to look after.  Without --device, there is one
+    # device, using the --pin, --hosts, etc options
 
-        for maint_str in maint_times:
+    defaults = {
+        'device-name':  device_name,
+        'pin':          pin_number,
+        'hosts':        dns_hosts,
+        'quorum':       quorum,
+        'max-loss':     max_loss,
+        'max-rtt':      max_rtt,
+        'reset-stages': reset_stages,
+        'reset-time':   reset_time,
+        'wait-time':    wait_time,
+        'lock-file':    lock_file,
+    }
+
+    devices = []
+    for spec in device_specs:
+        try:
+            device = parse_device( spec, defaults )
+        except Exception as err:
+            die( err )
+        if ( num_too_big( device[ 'reset-time' ], max_reset_time )):
+            die( "reset time for {} too large ({:d} > {:d})". \
+                format( device[ 'device-name' ], device[ 'reset-time' ],
+                        max_reset_time ))
+        if ( num_too_big( device[ 'wait-time' ], max_wait_time )):
+            die( "wait time for {} too large ({:d} > {:d})". \
+                format( device[ 'device-name' ], device[ 'wait-time' ],
+                        max_wait_time ))
+        for other in devices:
+            if other[ 'device-name' ] == device[ 'device-name' ]:
+                die( "device {} given more than once". \
+                    format( device[ 'device-name' ] ))
+            if other[ 'pin' ] == device[ 'pin' ]:
+                die( "devices {} and {} both use pin {:d}". \
+                    format( other[ 'device-name' ], device[ 'device-name' ],
+                            device[ 'pin' ] ))
+        devices.append( device )
+
+    if len( devices ) == 0:
+        devices.append( defaults )
+
+    for device in devices:
+        if device[ 'quorum' ] > len( device[ 'hosts' ] ):
+            die( "quorum for {} larger than its hosts ({:d} > {:d})". \
+                format( device[ 'device-name' ], device[ 'quorum' ],
+                        len( device[ 'hosts' ] )))
+        for host in device[ 'hosts' ]:
             try:
-                ( maint_start, maint_end ) = convert_times( maint_str )
+                probes.check_target( host, probe_backend )
             except Exception as err:
-                die( err )
-            dprint( "maint start={0:d}, end={1:d} (mins) for period {2:s}". \
-                format( maint_start, maint_end, maint_str ))
-
-            if ( c_total_mins > maint_start ) and ( c_total_mins < maint_end ):
-                dprint( "now in maintenance interval of {0:s}.  Quitting.". \
-                    format( maint_str ))
-                return(0)
-            else:
-                dprint( "not in maintenance interval of %s." % maint_str )
+                die( "bad host for {}: {}".format( device[ 'device-name' ],
+                                                   err ))
+        for stage in device[ 'reset-stages' ]:
+            if stage not in RESET_STAGES:
+                die( "unknown reset stage for {}: \'{}\' (use {})". \
+                    format( device[ 'device-name' ], stage,
+                            ','.join( RESET_STAGES )))
 
-    # See if we are running on our target Raspberry pi.
-    # Anything else will be a development or test environment
+    if ( gateway or modem ) and not diagnose_flag:
+        die( "--gateway and --modem can only be used with --diagnose" )
+
+    degrade = [ d for d in devices if d[ 'max-loss' ] or d[ 'max-rtt' ] ]
+    if degrade and not daemon_flag:
+        die( "--max-loss and --max-rtt can only be used with --daemon" )
+
+    if metrics_port and not daemon_flag:
+        die( "--metrics-port can only be used with --daemon" )
+
+    if not control_socket:
+        control_socket = socket_filename( lock_file )
 
-    if HAVE_GPIO == True:
-        dprint( "Running on a Raspberry Pi." )
+    if gpio_driver != 'rpi':
+        HAVE_GPIO = True
+    if gpio_driver == 'file' and not gpio_path:
+        gpio_path = lock_file + ".gpio"
+
+    if control_flag and not daemon_flag and not force_flag:
+        die( "--control can only be used with --daemon" )
+
+    if peer_hosts and not daemon_flag:
+        die( "--peers can only be used with --daemon" )
+
+    if netlink_flag and not daemon_flag:
+        die( "--netlink can only be used with --daemon" )
+
+    if idle_interval < interval:
+        die( "idle interval less than interval ({:d} < {:d})". \
+            format( idle_interval, interval ))
+
+    if daemon_flag and force_flag:
+        die( "--force-reset can not be used with --daemon" )
+
+    opts = {
+        'progname':         progname,
+        'have-gpio':        HAVE_GPIO,
+        'ping-timeout':     ping_timeout,
+        'ping-tries':       ping_tries,
+        'delay-exit':       delay_exit_wait,
+        'log-file':         log_file,
+        'logging-flag':     logging_flag,
+        'maint':            schedule,
+        'maint-file':       maint_file,
+        'quiet-flag':       quiet_flag,
+        'force-flag':       force_flag,
+        'concurrent-flag':  concurrent_flag,
+        'probe':            probe_backend,
+        'gpio-driver':      gpio_driver,
+        'gpio-path':        gpio_path,
+        'peer-hosts':       peer_hosts,
+        'peer-port':        peer_port,
+        'devices':          devices,
+        'health-flag':      health_flag,
+        'lock-file':        lock_file,
+        'metrics-file':     metrics_file,
+        'metrics-port':     metrics_port,
+        'interval':         interval,
+        'daemon-flag':      daemon_flag,
+        'netlink-flag':     netlink_flag,
+        'control-flag':     control_flag,
+        'control-socket':   control_socket,
+        'idle-interval':    idle_interval,
+        'history-size':     history_size,
+        'history-flag':     len( degrade ) > 0,
+        'profile-file':     profile_file,
+        'simulate-file':    simulate_file,
+        'config-file':      config_file,
+        'record-file':      record_file,
+        'event-log':        event_log,
+        'event-fsync':      event_fsync,
+        'event-max-size':   event_max_size,
+        'event-max-age':    event_max_age,
+        'event-keep':       event_keep,
+        'dns-ttl':          dns_ttl,
+        'diagnose-flag':    diagnose_flag,
+        'gateway':          gateway,
+        'modem':            modem,
+    }
+
+    return( opts )
+
+
+def setup( opts ):
+    """get ready to run, from the options
+
+    Sets up the host health index, probe recording, probe history, the
+    event log and metrics, if wanted, the cache of host addresses, the
+    GPIO driver, and the link to --peers.  Adds 'health', 'recorder',
+    'history', 'events', 'resolver', 'gpio' and 'peers' to the options.
+
+    Arguments:
+        1:  options dictionary built by get_options()
+    """
+
+    # learn which hosts answer best, and probe them first
+
+    opts[ 'health' ] = None
+    if opts[ 'health-flag' ]:
+        from .health import HealthIndex, health_filename
+        health = HealthIndex( health_filename( opts[ 'lock-file' ] )).load()
+        globals.probe_hooks.append( health.record )
+        opts[ 'health' ] = health
+
+    # keep every probe, for tune
+
+    opts[ 'recorder' ] = None
+    if opts[ 'record-file' ]:
+        from . import probetrace
+        recorder = probetrace.Recorder( opts[ 'record-file' ] )
+        globals.probe_hooks.append( recorder.record )
+        opts[ 'recorder' ] = recorder
+
+    # keep the recent probes of each host, to see it degrading
+
+    opts[ 'history' ] = None
+    if opts[ 'history-flag' ]:
+        from .history import History
+        history = History( opts[ 'history-size' ] )
+        globals.probe_hooks.append( history.record )
+        opts[ 'history' ] = history
 
-        # need to be root for access to memory
-        if getpass.getuser() != 'root':
-            die( "Need to be root to use GPIO" )
+    # log every decision.  The daemon holds events back, to save writes
+
+    opts[ 'events' ] = None
+    if opts[ 'event-log' ]:
+        from .eventlog import EventLog
+        flush_interval = 0
+        if opts[ 'daemon-flag' ]:
+            flush_interval = FLUSH_INTERVAL
+        events = EventLog( opts[ 'event-log' ], opts[ 'event-fsync' ],
+            opts[ 'event-max-size' ] * 1024, opts[ 'event-max-age' ] * 3600,
+            opts[ 'event-keep' ], flush_interval )
+        globals.probe_hooks.append( events.probe )
+        opts[ 'events' ] = events
+
+    # probe the addresses of host names, rather than look them up each
+    # time.  config.compile() finds them
+
+    from .resolver import Resolver
+    opts[ 'resolver' ] = Resolver()
+
+    if opts[ 'metrics-file' ] or opts[ 'metrics-port' ]:
+        from . import metrics
+        metrics.enable()
+        globals.probe_hooks.append( metrics.probe_hook )
+        if opts[ 'metrics-file' ] and not opts[ 'daemon-flag' ]:
+            # carry on counting from the last run
+            metrics.load_textfile( opts[ 'metrics-file' ] )
+
+    # See if we are running on our target Raspberry pi.
+    # Anything else will be a development or test environment.
+    # From the cron, the pins are only touched for a reset.  The daemon
+    # asks for them now and keeps them, so a reset has nothing to set
+    # up, and a pin it can't use is found straight away
+
+    opts[ 'gpio' ] = None
+    if opts[ 'have-gpio' ] == True:
+        dprint( "Using GPIO driver {0:s}.".format( opts[ 'gpio-driver' ] ))
+        from . import gpio
+        opts[ 'gpio' ] = gpio.open_driver( opts[ 'gpio-driver' ],
+            opts[ 'gpio-path' ], keep=opts[ 'daemon-flag' ] )
+        if opts[ 'daemon-flag' ]:
+            for device in opts[ 'devices' ]:
+                try:
+                    opts[ 'gpio' ].setup( device[ 'pin' ] )
+                except Exception as err:
+                    die( "can't use GPIO pin {0:d}: {1}".format(
+                        device[ 'pin' ], err ))
     else:
         # development/debugging code
         dprint( "I'm NOT running on a Raspberry Pi (" + os.uname()[4] + ")"  )
         dprint( "Assuming a development/test box - will NOT shutdown device" )
 
-    # see if the network still reachable
+    # agree with other instances watching the same devices which of
+    # them resets each
+
+    opts[ 'peers' ] = None
+    if opts[ 'peer-hosts' ]:
+        from .peers import Peers
+        peers = Peers( opts[ 'peer-hosts' ], opts[ 'peer-port' ] )
+        try:
+            peers.start()
+        except Exception as err:
+            die( err )
+        opts[ 'peers' ] = peers
+
+
+def main( argv=sys.argv ):
+    """main program
+
+    use -h or --help for command line options
+
+    Returns:
+        0:  ok
+        1:  not ok
+    """
+
+    main_start = time.time()
+
+    if len( argv ) > 1 and argv[1] in SUBCOMMANDS:
+        module = importlib.import_module( '.' + argv[1], __package__ )
+        return( module.main( argv ))
 
-    state = test_network( dns_hosts, ping_tries, ping_timeout )
-    if state:
-        # still up
-        dprint( "Nothing to do. All is well.  exiting." )
+    opts = get_options( argv )
+    if opts is None:
         return(0)
 
-    # see if the device is locked from a recent reset
-    device_locked = False
+    # now we know if we are profiling, account for the time so far
+
+    if opts[ 'profile-file' ]:
+        timing.enable()
+        process_start = timing.process_start_time()
+        if process_start is not None:
+            timing.add_span( 'startup', process_start, _import_start )
+        timing.add_span( 'imports', _import_start, _import_end )
+        timing.add_span( 'options', main_start, time.time())
+
+    if opts[ 'simulate-file' ]:
+        from . import simulate
+        return( simulate.run( opts ))
+
+    # a daemon already running does the reset, so it can't overlap
+    # one of its checks
+    if opts[ 'force-flag' ]:
+        result = forward_reset( opts )
+        if result is not None:
+            return( result )
+
+    # a run from the cron can take minutes, if the network is down.
+    # If the next one starts before it is done, it leaves it to it,
+    # rather than probe again and maybe reset the device twice
+
     try:
-        device_locked = is_reset_locked( lock_file, wait_time )
-    except Exception as err:
-        pass
+        instance = instance_lock( instance_filename( opts[ 'lock-file' ] ))
+    except ( IOError, OSError ) as err:
+        die( "can't lock: {}".format( err ))
+    if instance is None:
+        if opts[ 'force-flag' ]:
+            die( "another run is in progress.  try again" )
+        dprint( "another run is in progress.  quitting" )
+        return(0)
 
-    if device_locked:
-        dprint( "found a timing lock: %s" % lock_file )
-        # the device is locked from resetting
-        if force_flag == False:
-            dprint( "timing lock in effect.  skipping the reset" )
-            return(0)
-        else:
-            # force the reset despite the lock
-            dprint( "over-riding device timing lock because of force flag" )
+    setup( opts )
+    from . import config
+    opts = config.compile( opts )
+
+    if opts[ 'daemon-flag' ]:
+        from . import daemon
+        result = daemon.Daemon( opts, check, force_reset,
+            lambda old: reload_options( argv, old )).run()
     else:
-        dprint( "no device timing lock found" )
+        result = check( opts )
 
-    # ok, let's do it...
-    if ( logging_flag ):
-        msg = "{0:s}: network unreachable.  resetting {1:s}\n". \
-            format( progname, device_name )
-        try:
-            logit( log_file, msg )
-        except Exception as err:
-            sys.stderr.write( "%s: %s\n" % ( progname, err ))
-            # keep going
+    if opts[ 'events' ] is not None:
+        opts[ 'events' ].close()
+    if opts[ 'gpio' ] is not None:
+        opts[ 'gpio' ].close()
+    if opts[ 'peers' ] is not None:
+        opts[ 'peers' ].close()
+    write_profile( opts )
+    instance.close()
+    return( result )
+
+
+def reload_options( argv, old ):
+    """read the options and config file again, for the daemon
+
+    What setup() made, such as the health index, is carried over.
+
+    Arguments:
+        1:  command-line arguments
+        2:  the Policy in use
+    Returns:
+        the new Policy
+    Exceptions:
+        Exception if the options are no good.  The old ones stay in use
+    """
 
-    # been long enough since last reset.  do it now
     try:
-        vals = { 'quiet-flag': quiet_flag, 'device-name': device_name }
-        reset_device( pin_number, reset_time, lock_file, vals, HAVE_GPIO )
-    except Exception as err:
-        sys.stderr.write( "%s: error resetting device: %s\n" % \
-            ( progname, err ))
-        # keep going
+        opts = get_options( argv )
+    except SystemExit:
+        # the reason has been printed
+        raise Exception( "options not reloaded" )
+    if opts is None:
+        raise Exception( "options not reloaded" )
 
-    # Informational message to print
-    # Get the real time first before a potential delay exit
+    opts[ 'progname' ] = old[ 'progname' ]
+    for key in RESTART_OPTIONS:
+        if opts[ key ] != old[ key ]:
+            sys.stderr.write( "%s: %s can't change until restarted\n" % \
+                ( old[ 'progname' ], key ))
+            opts[ key ] = old[ key ]
 
-    msg = "{0:s} reset at {1:s}". \
-        format( device_name, time.strftime( "%a %b %d, %Y %H:%M:%S" ))
+    for key in ( 'health', 'recorder', 'history', 'events', 'resolver',
+                 'gpio', 'peers' ):
+        opts[ key ] = old[ key ]
+    if opts[ 'history-flag' ] and opts[ 'history' ] is None:
+        sys.stderr.write( "%s: --max-loss and --max-rtt need a restart\n" % \
+            old[ 'progname' ] )
 
-    if ( delay_exit_wait ):
-        dprint( "delay exit.  waiting {0:d} seconds".format( delay_exit_wait ))
-        time.sleep( delay_exit_wait )
+    from . import config
+    return( config.compile( opts ))
 
-    if not quiet_flag:
-        print( msg )
 
-    return(0)
+def write_profile( opts ):
+    """write the --profile trace and summary, if profiling
+
+    Arguments:
+        1:  options dictionary built by main()
+    """
+
+    if not opts[ 'profile-file' ]:
+        return
+
+    try:
+        summary = timing.write( opts[ 'profile-file' ] )
+        dprint( "profile:\n" + summary )
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "%s: can't write profile: %s\n" % \
+            ( opts[ 'progname' ], err ))
@@ -0,0 +1,553 @@
+"""probe backends
+
+Each backend sends a single probe to a host without going through a
+shell, and returns the round-trip time in seconds, or None if there
+was no answer.  Every backend takes the same arguments:
+
+    probe( host, timeout, cancel )
+
+where cancel is an optional threading.Event which, when set, makes the
+probe give up early.  Backends are looked up by name in BACKENDS.
+
+A host can be given with the backend to use for it in front, such as
+tcp:1.1.1.1:443 or dns:9.9.9.9, so one device can depend on hosts
+probed in different ways.  Otherwise the --probe backend is used.
+
+    system      run the ping command.  The original behaviour
+    icmp        unprivileged ICMP echo (SOCK_DGRAM/IPPROTO_ICMP).
+                Needs the group of the user in the sysctl
+                net.ipv4.ping_group_range
+    tcp         TCP connect to host:port (default port 53).  A refused
+                connection still counts as the host being reachable
+    dns         UDP DNS query to host:port (default port 53).  Any reply,
+                even an error, counts as the host being reachable
+"""
+
+import os
+import sys
+import time
+import re
+import errno
+
+from .functions import dprint
+
+# socket, select and struct are imported by the backends that use them,
+# so a run with the system ping doesn't load them
+
+# how often a blocked probe checks if it has been cancelled
+POLL_INTERVAL = 0.1
+
+DEFAULT_PORT = 53
+
+
+def split_host_port( host, port=DEFAULT_PORT ):
+    """split a host specification of host, host:port or [v6-addr]:port
+
+    Arguments:
+        1:  host specification
+        2:  port to use if none given.  default = 53
+    Returns:
+        ( host, port )
+    Exceptions:
+        Exception if the port is not a port number
+    """
+
+    val = None
+    m = re.match( r'^\[(.+)\](?::(.*))?$', host )
+    if m:
+        ( host, val ) = m.groups()
+
+    # a bare IPv6 address has more than one colon
+    elif host.count( ':' ) == 1:
+        ( host, val ) = host.split( ':' )
+
+    if val is not None:
+        try:
+            port = int( val )
+        except ValueError:
+            raise Exception( "invalid port number: \'{}\'".format( val ))
+        if ( port < 1 ) or ( port > 65535 ):
+            raise Exception( "invalid port number: \'{}\'".format( val ))
+
+    return( host, port )
+
+
+def strip_port( host ):
+    """return just the host part of a host specification"""
+
+    return( split_host_port( host )[0] )
+
+
+def _resolve( host, port, type ):
+    """resolve a host to the first ( family, sockaddr ) usable for type
+
+    Returns:
+        ( family, sockaddr ) or None if it can't be resolved
+    """
+
+    import socket
+
+    host = address_of( host )
+
+    # as bytes, so the IDNA codec isn't loaded just to pass an address
+    name = host
+    try:
+        name = host.encode( 'ascii' )
+    except UnicodeError:
+        pass
+
+    try:
+        info = socket.getaddrinfo( name, port, 0, type )
+    except socket.error as err:
+        dprint( "_resolve(): can't resolve {}: {}".format( host, err ))
+        return( None )
+
+    for ( family, socktype, proto, canonname, sockaddr ) in info:
+        if family in ( socket.AF_INET, socket.AF_INET6 ):
+            return( family, sockaddr )
+
+    return( None )
+
+
+def _random_id():
+    """return a random 16-bit number, without importing random"""
+
+    import struct
+
+    return( struct.unpack( "!H", os.urandom( 2 ))[0] )
+
+
+def _wait_readable( sock, deadline, cancel=None ):
+    """wait for a socket to be readable, the deadline, or a cancel
+
+    Returns:
+        True:   socket is readable
+        False:  timed out or cancelled
+    """
+
+    import select
+
+    while True:
+        left = deadline - time.time()
+        if left <= 0:
+            return( False )
+        if cancel is not None and cancel.is_set():
+            return( False )
+        ( r, w, x ) = select.select( [ sock ], [], [],
+                                     min( left, POLL_INTERVAL ))
+        if r:
+            return( True )
+
+
+def _checksum( data ):
+    """internet checksum of a bytes string"""
+
+    import struct
+
+    if len( data ) % 2:
+        data = data + b'\0'
+    total = sum( struct.unpack( "!%dH" % ( len( data ) // 2 ), data ))
+    total = ( total >> 16 ) + ( total & 0xffff )
+    total = total + ( total >> 16 )
+    return( ~total & 0xffff )
+
+
+def probe_system( host, timeout=2, cancel=None ):
+    """probe a host by running the ping command
+
+    The process is started directly, rather than through a shell, so it
+    can be killed if cancelled.
+
+    Arguments:
+        1:  host
+        2:  timeout in seconds
+        3:  optional threading.Event to cancel the probe
+    Returns:
+        round-trip time in seconds, or None if no reply
+    """
+
+    import subprocess
+
+    my_name = sys._getframe().f_code.co_name
+
+    # the address looked up ahead of time, as the other backends use
+    # through _resolve(), so ping doesn't wait on DNS
+    host = address_of( host )
+
+    start = time.time()
+    try:
+        proc = subprocess.Popen(
+            [ 'ping', '-c', '1', '-w', str( int( timeout )), host ],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL )
+    except OSError as err:
+        dprint( "{0:s}(): could not run ping: {1}".format( my_name, err ))
+        return( None )
+
+    # ping -w should give up by itself.  This is a backstop.
+    deadline = start + timeout + 1
+    while True:
+        try:
+            output = proc.communicate( timeout=POLL_INTERVAL )[0]
+            break
+        except subprocess.TimeoutExpired:
+            pass
+
+        if ( cancel is not None and cancel.is_set() ) or \
+           time.time() > deadline:
+            proc.kill()
+            proc.communicate()
+            return( None )
+
+    if proc.returncode != 0:
+        return( None )
+
+    rtt = ping_time( output )
+    if rtt is not None:
+        return( rtt )
+    return( time.time() - start )
+
+
+def ping_time( output ):
+    """find the round-trip time in the output of the ping command
+
+    Arguments:
+        1:  output of ping, as text or bytes
+    Returns:
+        seconds, or None if there is none in it
+    """
+
+    if isinstance( output, bytes ):
+        output = output.decode( 'ascii', 'replace' )
+    m = re.search( r'time[=<]([\d.]+) ?ms', output or '' )
+    if m:
+        return( float( m.group(1)) / 1000.0 )
+    return( None )
+
+
+def probe_icmp( host, timeout=2, cancel=None ):
+    """probe a host with an ICMP echo over an unprivileged datagram socket
+
+    Arguments:
+        1:  host
+        2:  timeout in seconds
+        3:  optional threading.Event to cancel the probe
+    Returns:
+        round-trip time in seconds, or None if no reply
+    """
+
+    import socket
+    import struct
+
+    my_name = sys._getframe().f_code.co_name
+
+    addr = _resolve( host, None, socket.SOCK_DGRAM )
+    if addr is None:
+        return( None )
+    ( family, sockaddr ) = addr
+
+    if family == socket.AF_INET6:
+        proto = socket.IPPROTO_ICMPV6
+        ( echo_request, echo_reply ) = ( 128, 129 )
+    else:
+        proto = socket.IPPROTO_ICMP
+        ( echo_request, echo_reply ) = ( 8, 0 )
+
+    try:
+        sock = socket.socket( family, socket.SOCK_DGRAM, proto )
+    except socket.error as err:
+        dprint( "{0:s}(): can't open ICMP socket: {1}. "
+                "check sysctl net.ipv4.ping_group_range".
+                format( my_name, err ))
+        return( None )
+
+    # the kernel fills in the identifier, so match on the sequence
+    # number and payload instead
+    seq     = _random_id()
+    payload = struct.pack( "!d", time.time())
+    header  = struct.pack( "!BBHHH", echo_request, 0, 0, 0, seq )
+    packet  = header + payload
+    if family == socket.AF_INET:
+        header = struct.pack( "!BBHHH", echo_request, 0,
+                              _checksum( packet ), 0, seq )
+        packet = header + payload
+
+    try:
+        start    = time.time()
+        deadline = start + timeout
+        sock.sendto( packet, sockaddr )
+        while _wait_readable( sock, deadline, cancel ):
+            data = sock.recv( 1024 )
+            if len( data ) < 8:
+                continue
+            ( type, code, csum, id, rseq ) = \
+                struct.unpack( "!BBHHH", data[:8] )
+            if type == echo_reply and rseq == seq and data[8:] == payload:
+                return( time.time() - start )
+    except socket.error as err:
+        dprint( "{0:s}(): {1:s}: {2}".format( my_name, host, err ))
+    finally:
+        sock.close()
+
+    return( None )
+
+
+def probe_tcp( host, timeout=2, cancel=None ):
+    """probe a host by opening a TCP connection to it
+
+    The host can be given as host:port.  The default port is 53.
+    A refused connection means the host answered, so it is up.
+
+    Arguments:
+        1:  host
+        2:  timeout in seconds
+        3:  optional threading.Event to cancel the probe
+    Returns:
+        round-trip time in seconds, or None if no reply
+    """
+
+    import socket
+    import select
+
+    my_name = sys._getframe().f_code.co_name
+
+    ( host, port ) = split_host_port( host )
+    addr = _resolve( host, port, socket.SOCK_STREAM )
+    if addr is None:
+        return( None )
+    ( family, sockaddr ) = addr
+
+    sock = socket.socket( family, socket.SOCK_STREAM )
+    sock.setblocking( False )
+    try:
+        start    = time.time()
+        deadline = start + timeout
+        err = sock.connect_ex( sockaddr )
+        if err not in ( 0, errno.EINPROGRESS ):
+            if err == errno.ECONNREFUSED:
+                return( time.time() - start )
+            return( None )
+
+        while True:
+            left = deadline - time.time()
+            if left <= 0:
+                return( None )
+            if cancel is not None and cancel.is_set():
+                return( None )
+            ( r, w, x ) = select.select( [], [ sock ], [],
+                                         min( left, POLL_INTERVAL ))
+            if w:
+                break
+
+        err = sock.getsockopt( socket.SOL_SOCKET, socket.SO_ERROR )
+        if err in ( 0, errno.ECONNREFUSED ):
+            return( time.time() - start )
+        dprint( "{0:s}(): {1:s}:{2:d}: {3:s}".
+                format( my_name, host, port, os.strerror( err )))
+    except socket.error as err:
+        dprint( "{0:s}(): {1:s}:{2:d}: {3}".format( my_name, host, port, err ))
+    finally:
+        sock.close()
+
+    return( None )
+
+
+def probe_dns( host, timeout=2, cancel=None ):
+    """probe a host by sending it a DNS query over UDP
+
+    Asks for the NS records of the root zone.  Any reply with our query
+    id counts as an answer, even a refusal, since it shows the host is
+    reachable.  The host can be given as host:port.
+
+    Arguments:
+        1:  host
+        2:  timeout in seconds
+        3:  optional threading.Event to cancel the probe
+    Returns:
+        round-trip time in seconds, or None if no reply
+    """
+
+    import socket
+    import struct
+
+    my_name = sys._getframe().f_code.co_name
+
+    ( host, port ) = split_host_port( host )
+    addr = _resolve( host, port, socket.SOCK_DGRAM )
+    if addr is None:
+        return( None )
+    ( family, sockaddr ) = addr
+
+    # header: id, flags (recursion desired), 1 question.
+    # question: root name, type NS (2), class IN (1)
+    id    = _random_id()
+    query = struct.pack( "!HHHHHH", id, 0x0100, 1, 0, 0, 0 ) + \
+            b'\0' + struct.pack( "!HH", 2, 1 )
+
+    sock = socket.socket( family, socket.SOCK_DGRAM )
+    try:
+        start    = time.time()
+        deadline = start + timeout
+        sock.connect( sockaddr )
+        sock.send( query )
+        while _wait_readable( sock, deadline, cancel ):
+            data = sock.recv( 4096 )
+            if len( data ) >= 2 and struct.unpack( "!H", data[:2] )[0] == id:
+                return( time.time() - start )
+    except socket.error as err:
+        dprint( "{0:s}(): {1:s}:{2:d}: {3}".format( my_name, host, port, err ))
+    finally:
+        sock.close()
+
+    return( None )
+
+
+BACKENDS = {
+    'system':   probe_system,
+    'icmp':     probe_icmp,
+    'tcp':      probe_tcp,
+    'dns':      probe_dns,
+}
+
+DEFAULT_BACKEND = 'system'
+
+# a backend used for every probe, whatever the host says.  For stand-ins
+# such as fakes.FakeNetwork, which want the host as it was given
+forced = None
+
+# addresses of host names, looked up ahead of time (see resolver.py),
+# so a probe doesn't wait on DNS.  Replaced, not changed, so a probe sees
+# either the old or the new dictionary
+addresses = {}
+
+
+def address_of( name ):
+    """return the address looked up for a host name, or the name"""
+
+    return( addresses.get( name, name ))
+
+
+def register( name, func ):
+    """add a probe backend, or replace one
+
+    Used by stand-ins such as fakes.FakeNetwork.
+
+    Arguments:
+        1:  backend name
+        2:  function called as func( host, timeout, cancel ), returning
+            the round-trip time in seconds, or None if no reply
+    """
+
+    BACKENDS[ name ] = func
+
+
+def split_target( host, backend=DEFAULT_BACKEND ):
+    """split a host into the backend to probe it with, and the host
+
+    Arguments:
+        1:  host, optionally with a backend in front, as tcp:1.1.1.1:443
+        2:  backend to use if none is given
+    Returns:
+        ( backend, host )
+    """
+
+    if forced is not None:
+        return( forced, host )
+
+    if ':' in host:
+        ( prefix, rest ) = host.split( ':', 1 )
+        if prefix in BACKENDS:
+            return( prefix, rest )
+
+    return( backend, host )
+
+
+def check_target( host, backend=None ):
+    """check a host given to -H or --device, before it is probed
+
+    Arguments:
+        1:  host, optionally with a backend in front, as tcp:1.1.1.1:443
+        2:  backend to use if none is given, or None if it isn't known
+            yet.  Then a port is allowed, as tcp and dns take one
+    Exceptions:
+        Exception saying what is wrong with the host
+    """
+
+    if not host:
+        raise Exception( "empty host" )
+    if forced is not None:
+        return
+
+    ( use, rest ) = split_target( host, backend )
+    if use is not None and use not in BACKENDS:
+        raise Exception( "unknown probe type: \'{}\'".format( use ))
+    if not rest:
+        raise Exception( "no host in \'{}\'".format( host ))
+    if ':' not in rest or _is_ipv6( rest ):
+        return
+
+    error = None
+    if use in ( None, 'tcp', 'dns' ):
+        if rest.startswith( '[' ) or rest.count( ':' ) == 1:
+            try:
+                split_host_port( rest )
+                return
+            except Exception as err:
+                error = err
+
+    # such as tpc:8.8.8.8, rather than a host with a port
+    ( prefix, tail ) = rest.split( ':', 1 )
+    if re.match( r'^[a-z]+$', prefix ) and re.search( r'[.:]', tail ):
+        raise Exception( "unknown probe type \'{}\' in \'{}\'". \
+            format( prefix, host ))
+    if error is not None:
+        raise Exception( "{}: {}".format( host, error ))
+    raise Exception( "a port can only be given to the tcp and dns probes: "
+                     "\'{}\'".format( host ))
+
+
+def _is_ipv6( host ):
+    return( host.count( ':' ) > 1 and
+            re.match( r'^[0-9a-fA-F:.]+(%\w+)?$', host ) is not None )
+
+
+def target_name( host, backend=DEFAULT_BACKEND ):
+    """return the name of the machine a host is probed at
+
+    Arguments:
+        1:  host, as given to -H
+        2:  backend to use if none is given
+    Returns:
+        the host, without any backend in front or port after
+    """
+
+    ( backend, host ) = split_target( host, backend )
+    if backend in ( 'tcp', 'dns' ):
+        try:
+            host = split_host_port( host )[0]
+        except Exception:
+            pass
+    return( host )
+
+
+def probe( backend, host, timeout=2, cancel=None ):
+    """send a single probe to a host using the named backend
+
+    Arguments:
+        1:  backend name.  One of BACKENDS.  Used unless the host has a
+            backend in front
+        2:  host
+        3:  timeout in seconds
+        4:  optional threading.Event to cancel the probe
+    Returns:
+        round-trip time in seconds, or None if no reply
+    Exceptions:
+        Exception if the backend is unknown
+    """
+
+    ( backend, host ) = split_target( host, backend )
+    try:
+        func = BACKENDS[ backend ]
+    except KeyError:
+        raise Exception( "unknown probe backend: \'{}\'".format( backend ))
+
+    return( func( host, timeout, cancel ))
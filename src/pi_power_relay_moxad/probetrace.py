@@ -0,0 +1,189 @@
+"""probe traces (--record), for tuning the options with 'tune'
+
+With --record, the outcome and round-trip time of every probe is
+appended to a compact binary file, grouped by the check it was part
+of.  The 'tune' subcommand (see tune.py) replays a trace against other
+settings of --tries, --ping-timeout, --wait-time and host order.
+
+The file starts with MAGIC and a version byte, followed by records,
+each starting with a one-byte type:
+
+    R                       a run of the program starts.  Host
+                            numbers from earlier runs no longer apply
+    H  <num:u16> <len:u8> <name>
+                            host number for a host name
+    C  <time:f64> <timeout:u8>
+                            a check starts, with the --ping-timeout
+    P  <num:u16> <rtt:f32>  a probe of a host.  rtt is NaN if there
+                            was no reply
+
+All numbers are little-endian.  A probe is 7 bytes, so a check every
+couple of minutes makes well under a megabyte a month.
+"""
+
+import math
+import struct
+import threading
+
+from .functions import dprint
+
+MAGIC   = b'PPRT'
+VERSION = 1
+
+_run   = struct.Struct( '<c' )
+_host  = struct.Struct( '<cHB' )
+_check = struct.Struct( '<cdB' )
+_probe = struct.Struct( '<cHf' )
+
+
+class Recorder( object ):
+    """buffer probes, and append them to a trace file
+
+    Arguments to constructor:
+        1:  filename
+    """
+
+    def __init__( self, file ):
+        self.file    = file
+        self.hosts   = {}           # name -> number
+        self.buffer  = [ _run.pack( b'R' ) ]
+        self.active  = False
+        self.lock    = threading.Lock()
+
+    def check_start( self, now, timeout ):
+        """note the start of a check
+
+        Arguments:
+            1:  time (seconds since epoch)
+            2:  --ping-timeout
+        """
+
+        with self.lock:
+            self.buffer.append( _check.pack( b'C', now,
+                                             min( 255, int( timeout ))))
+            self.active = True
+
+    def check_end( self ):
+        """note the network test of a check is over
+
+        Probes after this, such as those watching a device recover,
+        are not part of the decision, so are not recorded.
+        """
+
+        self.active = False
+
+    def record( self, host, rtt, backend=None ):
+        """add a probe.  For globals.probe_hooks
+
+        Arguments:
+            1:  host
+            2:  round-trip time in seconds, or None if no answer
+            3:  probe backend (not used)
+        """
+
+        if rtt is None:
+            rtt = float( 'nan' )
+
+        with self.lock:
+            if not self.active:
+                return
+            num = self.hosts.get( host )
+            if num is None:
+                num = len( self.hosts )
+                self.hosts[ host ] = num
+                name = host.encode( 'utf-8' )[ :255 ]
+                self.buffer.append( _host.pack( b'H', num, len( name )) +
+                                    name )
+            self.buffer.append( _probe.pack( b'P', num, rtt ))
+
+    def flush( self ):
+        """append what has been recorded to the file
+
+        Exceptions:
+            IOError/OSError if the file can't be written
+        """
+
+        with self.lock:
+            data = b''.join( self.buffer )
+            self.buffer = []
+        if not data:
+            return
+
+        with open( self.file, "ab" ) as f:
+            if f.tell() == 0:
+                f.write( MAGIC + struct.pack( '<B', VERSION ))
+            f.write( data )
+
+        dprint( "Recorder.flush(): wrote {0:d} bytes to {1:s}". \
+            format( len( data ), self.file ))
+
+
+def read( file ):
+    """read a trace file
+
+    A record cut short at the end of the file, as from a run that was
+    killed while writing, is ignored.
+
+    Arguments:
+        1:  filename
+    Returns:
+        list of checks, each ( time, timeout, [ ( host, rtt ), ... ] ),
+        with rtt None if there was no reply
+    Exceptions:
+        Exception if the file can't be read or is not a trace
+    """
+
+    try:
+        with open( file, "rb" ) as f:
+            data = f.read()
+    except ( IOError, OSError ) as err:
+        raise Exception( "can't read trace {}: {}".format( file, err ))
+
+    if len( data ) <= len( MAGIC ) or data[ :len( MAGIC ) ] != MAGIC:
+        raise Exception( "not a probe trace: {}".format( file ))
+    if struct.unpack_from( '<B', data, len( MAGIC ))[0] != VERSION:
+        raise Exception( "unknown version of probe trace: {}".format( file ))
+
+    checks = []
+    hosts  = {}
+    check  = None
+    pos    = len( MAGIC ) + 1
+    size   = len( data )
+    try:
+        while pos < size:
+            type = data[ pos : pos + 1 ]
+            if type == b'P':
+                ( t, num, rtt ) = _probe.unpack_from( data, pos )
+                pos = pos + _probe.size
+                if check is not None:
+                    if math.isnan( rtt ):
+                        rtt = None
+                    check[2].append(( hosts[ num ], rtt ))
+            elif type == b'C':
+                ( t, now, timeout ) = _check.unpack_from( data, pos )
+                pos = pos + _check.size
+                check = ( now, timeout, [] )
+                checks.append( check )
+            elif type == b'H':
+                ( t, num, length ) = _host.unpack_from( data, pos )
+                pos = pos + _host.size
+                name = data[ pos : pos + length ]
+                if len( name ) < length:
+                    break
+                hosts[ num ] = name.decode( 'utf-8', 'replace' )
+                pos = pos + length
+            elif type == b'R':
+                hosts = {}
+                check = None
+                pos = pos + _run.size
+            else:
+                raise Exception( "bad record at byte {:d} of {}". \
+                    format( pos, file ))
+    except struct.error:
+        pass                        # cut short
+    except KeyError as err:
+        raise Exception( "unknown host number {} at byte {:d} of {}". \
+            format( err, pos, file ))
+
+    dprint( "read(): {0:d} checks in {1:s}".format( len( checks ), file ))
+    return( checks )
@@ -0,0 +1,71 @@
+"""watch for a device to recover after a reset
+
+Once power is back on, the hosts of the device are probed on a
+schedule that starts fast and backs off, until one of them answers or
+the maximum wait (--delay-exit) runs out.  This replaces a fixed sleep,
+so the program can carry on as soon as the network is usable, and the
+time the device actually took to recover is known.
+"""
+
+import sys
+
+from .functions import dprint, test_network
+from . import clock
+
+FIRST_INTERVAL = 1.0        # secs before the 2nd poll
+BACKOFF        = 1.5        # each interval is this much longer ...
+MAX_INTERVAL   = 15.0       # ... up to this
+
+
+def watch( hosts, max_wait, timeout=2, concurrent=False, backend='system',
+           stopped=None, quorum=1 ):
+    """probe hosts until enough answer, or the maximum wait is over
+
+    Arguments:
+        1:  array of hosts
+        2:  maximum seconds to wait
+        3:  timeout for each probe
+        4:  probe hosts concurrently.  default = False
+        5:  probe backend (see probes.BACKENDS).  default = 'system'
+        6:  optional function returning True if the watch should stop
+        7:  number of hosts that must answer.  default = 1
+    Returns:
+        seconds until the network was reachable, or None if it
+        wasn't within the maximum wait
+    """
+
+    my_name = sys._getframe().f_code.co_name
+
+    start    = clock.now()
+    deadline = start + max_wait
+    interval = FIRST_INTERVAL
+    polls    = 0
+
+    while True:
+        now = clock.now()
+        if now >= deadline:
+            break
+        if stopped is not None and stopped():
+            dprint( "{0:s}(): stopped".format( my_name ))
+            return( None )
+
+        # don't let a probe run past the deadline
+        probe_timeout = max( 1, min( timeout, int( deadline - now )))
+        polls = polls + 1
+        if test_network( hosts, 1, probe_timeout, concurrent, backend,
+                         quorum ):
+            took = clock.now() - start
+            dprint( "{0:s}(): reachable after {1:.1f} secs ({2:d} polls)". \
+                format( my_name, took, polls ))
+            return( took )
+
+        # wait out the rest of this interval, then back off
+        next_time = min( now + interval, deadline )
+        delay = next_time - clock.now()
+        if delay > 0:
+            clock.sleep( delay )
+        interval = min( interval * BACKOFF, MAX_INTERVAL )
+
+    dprint( "{0:s}(): not reachable within {1:d} secs ({2:d} polls)". \
+        format( my_name, int( max_wait ), polls ))
+    return( None )
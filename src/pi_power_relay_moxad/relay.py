@@ -0,0 +1,232 @@
+"""power relay state machine
+
+A power cycle of a device goes through these states:
+
+    idle  ->  power-off  ->  power-on  ->  recovering  ->  idle
+
+    power-off   the GPIO pin is HIGH, so the relay has dropped power
+                to the device.  Lasts for the reset time.
+    power-on    the GPIO pin has gone back LOW and power is restored
+    recovering  waiting for the device to come back.  Lasts for the
+                recovery time (--delay-exit), or until a recover-check
+                function says the device is back
+
+The transitions are driven by timers, so nothing blocks while a cycle
+is in progress.  The caller can carry on probing and logging, ask for
+the state at any time, or wait() for the cycle to finish.  Each Relay
+has its own timers, so several relays can be cycled at the same time,
+or staggered with the delay argument to start().
+"""
+
+import sys
+import threading
+
+from .functions import dprint
+from . import timing
+from . import clock
+from . import gpio
+
+IDLE       = 'idle'
+POWER_OFF  = 'power-off'
+POWER_ON   = 'power-on'
+RECOVERING = 'recovering'
+
+class Relay( object ):
+    """a device on a GPIO pin that can be power cycled
+
+    Arguments to constructor:
+        1:  GPIO pin number
+        2:  seconds to leave the power off
+        3:  optional values dictionary containing:
+                quiet-flag    (default = False)
+                device-name   (default = 'device')
+                recover-time  seconds to stay recovering (default = 0)
+                recover-check optional function, called as func( relay )
+                              when recovering, in its own thread.  It
+                              returns the seconds the device took to
+                              recover, or None.  Recovering ends when
+                              it returns, rather than after recover-time
+        4:  flag if GPIO active.  default = True
+        5:  optional function called as func( relay, state ) on every
+            state change.  It is called from a timer thread
+        6:  optional GPIO driver (see gpio.py).  default = RPi.GPIO
+    """
+
+    def __init__( self, pin_num, reset_time, vals={}, GPIO_active=True,
+                  on_change=None, driver=None ):
+        self.pin          = pin_num
+        self.reset_time   = reset_time
+        self.recover_time = vals.get( 'recover-time', 0 )
+        self.device_name  = vals.get( 'device-name', 'device' )
+        self.quiet_flag   = vals.get( 'quiet-flag', False )
+        self.recover_check = vals.get( 'recover-check' )
+        self.GPIO_active  = GPIO_active
+        self.on_change    = on_change
+        self.driver       = driver
+
+        self.state      = IDLE
+        self.times      = {}        # state -> time it was entered
+        self.recovered_after = None # secs the last recovery took
+        self.timer      = None
+        self.lock       = threading.Lock()
+        self.idle_event = threading.Event()
+        self.idle_event.set()
+
+    def status( self ):
+        """return a dictionary describing the relay"""
+
+        with self.lock:
+            return({
+                'device-name':  self.device_name,
+                'pin':          self.pin,
+                'state':        self.state,
+                'since':        self.times.get( self.state ),
+            })
+
+    def busy( self ):
+        """True if a power cycle is in progress"""
+
+        return( not self.idle_event.is_set() )
+
+    def start( self, delay=0 ):
+        """start a power cycle
+
+        Arguments:
+            1:  optional seconds to wait before dropping power.
+                Used to stagger several relays
+        Returns:
+            True:   cycle started
+            False:  a cycle was already in progress
+        """
+
+        with self.lock:
+            if self.busy():
+                dprint( "Relay.start(): {0:s} already {1:s}". \
+                    format( self.device_name, self.state ))
+                return( False )
+            self.idle_event.clear()
+            self.times = {}
+            self.recovered_after = None
+
+        self._schedule( delay, self._power_off )
+        return( True )
+
+    def wait( self, timeout=None ):
+        """wait until the relay is idle again
+
+        Arguments:
+            1:  optional maximum seconds to wait
+        Returns:
+            True:   relay is idle
+            False:  timed out
+        """
+
+        return( clock.wait( self.idle_event, timeout ))
+
+    def cancel( self ):
+        """abandon a cycle.  Power is restored if it was off
+
+        If it was, the relay goes through power-on to idle, without
+        recovering, so on_change sees the device was reset.
+        """
+
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            was_off = ( self.state == POWER_OFF )
+
+        if was_off:
+            self._power_on( schedule_next=False )
+            self._enter( POWER_ON )
+        self._enter( IDLE )
+
+    def _driver( self ):
+        # made when first needed, so RPi.GPIO is only imported for a reset
+        if self.driver is None:
+            self.driver = gpio.open_driver()
+        return( self.driver )
+
+    def _schedule( self, delay, func ):
+        with self.lock:
+            self.timer = clock.timer( delay, func )
+
+    def _enter( self, state ):
+        now = clock.now()
+        with self.lock:
+            old_state = self.state
+            self.state = state
+            self.times[ state ] = now
+
+        if old_state != IDLE:
+            timing.add_span( 'relay ' + old_state, self.times[ old_state ],
+                             now, device=self.device_name )
+
+        dprint( "Relay: {0:s} (pin {1:d}) is now {2:s}". \
+            format( self.device_name, self.pin, state ))
+
+        if self.on_change is not None:
+            try:
+                self.on_change( self, state )
+            except Exception as err:
+                sys.stderr.write( "relay state change for {}: {}\n". \
+                    format( self.device_name, err ))
+
+        # only after the callback, so wait() returns after it is done
+        if state == IDLE:
+            self.idle_event.set()
+
+    def _power_off( self ):
+        if not self.GPIO_active and not self.quiet_flag:
+            print( "GPIO not active.  simulating RESET of '{0:s}'". \
+                format( self.device_name ))
+
+        dprint( "Relay: setting PIN {0:d} HIGH".format( self.pin ))
+        try:
+            if self.GPIO_active:
+                self._driver().set( self.pin, gpio.HIGH )
+        except Exception as err:
+            sys.stderr.write( "error resetting {}: {}\n". \
+                format( self.device_name, err ))
+            self._enter( IDLE )
+            return
+
+        self._enter( POWER_OFF )
+        self._schedule( self.reset_time, self._power_on )
+
+    def _power_on( self, schedule_next=True ):
+        dprint( "Relay: setting PIN {0:d} LOW".format( self.pin ))
+        try:
+            if self.GPIO_active:
+                self._driver().set( self.pin, gpio.LOW )
+                self._driver().release( self.pin )
+        except Exception as err:
+            sys.stderr.write( "error restoring power to {}: {}\n". \
+                format( self.device_name, err ))
+
+        if not schedule_next:
+            return
+
+        self._enter( POWER_ON )
+        self._enter( RECOVERING )
+        if self.recover_check is None:
+            self._schedule( self.recover_time, self._recovered )
+        else:
+            clock.timer( 0, self._watch )
+
+    def _watch( self ):
+        try:
+            self.recovered_after = self.recover_check( self )
+        except Exception as err:
+            sys.stderr.write( "error watching {} recover: {}\n". \
+                format( self.device_name, err ))
+
+        # a cancel() may have already made us idle
+        if self.state == RECOVERING:
+            self._recovered()
+
+    def _recovered( self ):
+        with self.lock:
+            self.timer = None
+        self._enter( IDLE )
+
@@ -0,0 +1,606 @@
+"""the 'report' subcommand: how often devices are reset, and if it helps
+
+    pi-power-relay report [options] log-file...
+
+Reads any number of --logfile logs, in the free-text format written by
+logit(), and --event-log logs of JSON events (see eventlog.py), either
+of which can be gzipped, such as rotated ones.  For each device it
+reports:
+
+    resets          the number of resets, per day and per week, and a
+                    table of them by day or week (--by)
+    between         mean time between resets
+    back-to-back    resets that came within 2 x --wait-time of the one
+                    before, as soon as the timing lock let them: a
+                    sign the first reset didn't help
+    recovery        how long the device took to answer after power
+                    came back, as a distribution
+    efficacy        resets after which the device recovered, and those
+                    not followed by another back-to-back
+
+A recovery is known from a 'recovered' or 'did not recover' line, which
+are logged with --delay-exit, or in an event log, from the first check
+after the reset that found the device up.  A reset with neither is
+counted as unknown.  Give the text log or the event log of a device,
+not both, or its resets are counted twice.
+
+The logs are read a line at a time, so memory use doesn't grow with
+their size, only with the number of devices and days.  The files are
+read in the order of their first events, so rotated logs can be given
+in any order.  Probes in event logs are skipped without being parsed,
+as are checks, unless a device is waiting to recover.
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import gzip
+import datetime
+
+from .functions import dprint, is_int
+
+PERIODS        = ( 'day', 'week' )
+RECOVERY_EDGES = ( 15, 30, 60, 120, 300, 600, 1800 )     # secs
+CLUSTER_FACTOR = 2          # x wait-time for resets to be back-to-back
+BAR_WIDTH      = 40
+FIRST_LINES    = 100        # lines read to find the first time of a file
+
+# logit() lines, such as:
+#   Fri Jun 08, 2018 @ 16:38: pi-power-relay: network unreachable.  \
+#       resetting cable-modem
+_TEXT_TIME = re.compile( r'^(\w{3} \w{3} \d{2}, \d{4} @ \d{2}:\d{2}): '
+                         r'\S+: (.*?)\s*$' )
+_RESET     = re.compile( r'^(.*)\.  resetting (.+)$' )
+_RECOVERED = re.compile( r'^(.+) recovered (\d+) secs after reset$' )
+_FAILED    = re.compile( r'^(.+) did not recover within (\d+) secs$' )
+_FAULT     = re.compile( r'^(.*)\.  not resetting$' )
+
+
+class DeviceStats( object ):
+    """what is known of the resets of a device, so far
+
+    Arguments to constructor:
+        1:  device name
+        2:  secs within which a reset is back-to-back with the last
+        3:  'day' or 'week', to count resets by
+    """
+
+    def __init__( self, name, cluster_secs, period ):
+        self.name    = name
+        self.cluster_secs = cluster_secs
+        self.period  = period
+        self.resets  = 0
+        self.first   = None
+        self.last    = None
+        self.gap_total = 0.0
+        self.periods = {}           # date -> resets
+        self.reasons = {}           # reason -> resets
+        self.locked  = 0            # resets held back by the timing lock
+
+        self.run       = 0          # resets in the current cluster
+        self.clusters  = 0
+        self.clustered = 0
+        self.largest   = 0
+
+        self.recovered = 0
+        self.failed    = 0
+        self.unknown   = 0
+        self.recovery_total = 0.0
+        self.recovery_max   = 0
+        self.bins = [ 0 ] * ( len( RECOVERY_EDGES ) + 1 )
+
+        # the last reset, until it is known if it recovered
+        self.pending  = None        # time to measure the recovery from
+        self.watched  = False       # a check has seen it down since
+
+    def reset( self, t, reason ):
+        self._unresolved()
+        self.resets = self.resets + 1
+        if self.first is None:
+            self.first = t
+
+        if self.last is not None:
+            self.gap_total = self.gap_total + t - self.last
+            if t - self.last <= self.cluster_secs:
+                self.run = self.run + 1
+            else:
+                self._end_cluster()
+        else:
+            self.run = 1
+        self.last = t
+
+        key = _period_start( t, self.period )
+        self.periods[ key ] = self.periods.get( key, 0 ) + 1
+        reason = reason.split( ':' )[0]
+        self.reasons[ reason ] = self.reasons.get( reason, 0 ) + 1
+
+        self.pending = t
+        self.watched = False
+
+    def power_on( self, t ):
+        if self.pending is not None:
+            self.pending = t
+
+    def recovery( self, secs ):
+        """a reset was found to recover after secs, or not if None"""
+
+        if self.pending is None:
+            return
+        self.pending = None
+        if secs is None:
+            self.failed = self.failed + 1
+            return
+        self.recovered = self.recovered + 1
+        self.recovery_total = self.recovery_total + secs
+        self.recovery_max = max( self.recovery_max, secs )
+        b = 0
+        while b < len( RECOVERY_EDGES ) and secs >= RECOVERY_EDGES[b]:
+            b = b + 1
+        self.bins[b] += 1
+
+    def check( self, t, up ):
+        if self.pending is None:
+            return
+        if up:
+            self.recovery( max( 0, t - self.pending ))
+        else:
+            self.watched = True
+
+    def finish( self ):
+        self._unresolved()
+        self._end_cluster()
+
+    def _unresolved( self ):
+        # a reset that was watched, and never seen up, did not recover
+        if self.pending is None:
+            return
+        if self.watched:
+            self.failed = self.failed + 1
+        else:
+            self.unknown = self.unknown + 1
+        self.pending = None
+
+    def _end_cluster( self ):
+        if self.run > 1:
+            self.clusters  = self.clusters + 1
+            self.clustered = self.clustered + self.run
+            self.largest   = max( self.largest, self.run )
+        self.run = 1
+
+    def summary( self ):
+        """return what is known, as a dictionary"""
+
+        known = self.recovered + self.failed
+        repeats = self.clustered - self.clusters
+        between = None
+        if self.resets > 1:
+            between = self.gap_total / ( self.resets - 1 )
+        mean_recovery = None
+        if self.recovered:
+            mean_recovery = self.recovery_total / self.recovered
+
+        return({
+            'device':           self.name,
+            'resets':           self.resets,
+            'first':            self.first,
+            'last':             self.last,
+            'mean-between':     between,
+            'back-to-back':     repeats,
+            'clusters':         self.clusters,
+            'largest-cluster':  self.largest,
+            'locked':           self.locked,
+            'reasons':          self.reasons,
+            'recovered':        self.recovered,
+            'not-recovered':    self.failed,
+            'unknown':          self.unknown,
+            'recovery-mean':    mean_recovery,
+            'recovery-max':     self.recovery_max if self.recovered else None,
+            'recovery-bins':    dict( zip( _bin_names(), self.bins )),
+            'recovery-rate':    self.recovered / float( known ) if known
+                                else None,
+            'not-repeated':     self.resets - repeats,
+            periods_key( self.period ): self.periods,
+        })
+
+
+def periods_key( period ):
+    return( "resets-per-{}".format( period ))
+
+
+def _bin_names():
+    names = [ "<{}".format( _dur( RECOVERY_EDGES[0] )) ]
+    for ( low, high ) in zip( RECOVERY_EDGES, RECOVERY_EDGES[1:] ):
+        names.append( "{}-{}".format( _dur( low ), _dur( high )))
+    names.append( ">={}".format( _dur( RECOVERY_EDGES[-1] )))
+    return( names )
+
+
+def _period_start( t, period ):
+    day = datetime.date( *time.localtime( t )[ :3 ] )
+    if period == 'week':
+        day = day - datetime.timedelta( days=day.weekday())
+    return( day.isoformat())
+
+
+def _dur( secs ):
+    """return a length of time, such as 45s, 12m or 2d 3h"""
+
+    secs = int( round( secs ))
+    if secs < 60:
+        return( "{:d}s".format( secs ))
+    if secs < 3600:
+        return( "{:d}m".format( secs // 60 ))
+    if secs < 86400:
+        return( "{:d}h{:02d}m".format( secs // 3600, secs % 3600 // 60 ))
+    return( "{:d}d {:d}h".format( secs // 86400, secs % 86400 // 3600 ))
+
+
+def open_log( file ):
+    """open a log for reading lines of text, gzipped or not"""
+
+    with open( file, "rb" ) as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        f = gzip.open( file, "rb" )
+    else:
+        f = open( file, "rb" )
+    if sys.version_info[0] < 3:
+        return( f )
+    return( io.TextIOWrapper( f, encoding='utf-8', errors='replace' ))
+
+
+def _text_time( stamp ):
+    return( time.mktime( time.strptime( stamp, "%a %b %d, %Y @ %H:%M" )))
+
+
+def first_time( file ):
+    """return the time of the first event in a log, or None"""
+
+    with open_log( file ) as f:
+        for ( n, line ) in enumerate( f ):
+            if n >= FIRST_LINES:
+                break
+            if line.startswith( '{' ):
+                m = re.search( r'"t": ([0-9.]+)', line )
+                if m:
+                    return( float( m.group(1) ))
+            else:
+                m = _TEXT_TIME.match( line )
+                if m:
+                    return( _text_time( m.group(1) ))
+    return( None )
+
+
+class Report( object ):
+    """read logs, a line at a time, into a DeviceStats for each device
+
+    Arguments to constructor:
+        1:  wait time (secs) of the devices
+        2:  'day' or 'week', to count resets by
+        3:  optional device name, to report on only that one
+    """
+
+    def __init__( self, wait_time=600, period='week', device=None ):
+        self.cluster_secs = CLUSTER_FACTOR * wait_time
+        self.period  = period
+        self.device  = device
+        self.devices = {}           # name -> DeviceStats
+        self.lines   = 0
+        self.first   = None
+        self.last    = None
+        self.faults  = 0
+        self.maint_skips = 0
+        self.bad     = 0            # JSON lines that couldn't be parsed
+
+    def stats( self, name ):
+        if self.device is not None and name != self.device:
+            return( None )
+        d = self.devices.get( name )
+        if d is None:
+            d = DeviceStats( name, self.cluster_secs, self.period )
+            self.devices[ name ] = d
+        return( d )
+
+    def _waiting( self ):
+        for d in self.devices.values():
+            if d.pending is not None:
+                return( True )
+        return( False )
+
+    def _seen( self, t ):
+        if self.first is None or t < self.first:
+            self.first = t
+        if self.last is None or t > self.last:
+            self.last = t
+
+    def read( self, file ):
+        """read a log
+
+        Exceptions:
+            IOError/OSError if it can't be read
+        """
+
+        dprint( "Report.read(): reading {}".format( file ))
+        waiting = self._waiting()
+        with open_log( file ) as f:
+            for line in f:
+                self.lines = self.lines + 1
+                if line.startswith( '{' ):
+                    # most lines are probes, and checks that don't
+                    # matter, so don't parse them
+                    if '"event": "probe"' in line:
+                        continue
+                    if not waiting and '"event": "check"' in line:
+                        continue
+                    self._json_line( line )
+                else:
+                    self._text_line( line )
+                waiting = self._waiting()
+
+    def _text_line( self, line ):
+        m = _TEXT_TIME.match( line )
+        if not m:
+            return
+        t = _text_time( m.group(1) )
+        message = m.group(2)
+        self._seen( t )
+
+        m = _RESET.match( message )
+        if m:
+            d = self.stats( m.group(2) )
+            if d is not None:
+                d.reset( t, m.group(1) )
+            return
+        m = _RECOVERED.match( message )
+        if m:
+            d = self.stats( m.group(1) )
+            if d is not None:
+                d.recovery( int( m.group(2) ))
+            return
+        m = _FAILED.match( message )
+        if m:
+            d = self.stats( m.group(1) )
+            if d is not None:
+                d.recovery( None )
+            return
+        if _FAULT.match( message ):
+            self.faults = self.faults + 1
+
+    def _json_line( self, line ):
+        try:
+            e = json.loads( line )
+            t = float( e[ 't' ] )
+            event = e[ 'event' ]
+        except ( ValueError, KeyError, TypeError ):
+            self.bad = self.bad + 1
+            return
+        self._seen( t )
+
+        if event == 'check':
+            for ( name, up ) in e.get( 'devices', {} ).items():
+                d = self.devices.get( name )
+                if d is not None:
+                    d.check( t, up )
+        elif event == 'local-fault':
+            self.faults = self.faults + 1
+        elif event == 'maint-skip':
+            self.maint_skips = self.maint_skips + 1
+        elif 'device' in e:
+            d = self.stats( e[ 'device' ] )
+            if d is None:
+                pass
+            elif event == 'reset':
+                d.reset( t, e.get( 'reason' ) or "network unreachable" )
+            elif event == 'power-on':
+                d.power_on( t )
+            elif event == 'recovery':
+                d.recovery( e.get( 'secs' ))
+            elif event == 'lock-skip':
+                d.locked = d.locked + 1
+
+    def finish( self ):
+        for d in self.devices.values():
+            d.finish()
+
+    def summary( self ):
+        """return the report, as a dictionary"""
+
+        return({ 'lines':           self.lines,
+                 'first':           self.first,
+                 'last':            self.last,
+                 'local-faults':    self.faults,
+                 'maint-skips':     self.maint_skips,
+                 'bad-lines':       self.bad,
+                 'devices':         [ self.devices[ name ].summary()
+                                      for name in sorted( self.devices ) ]})
+
+
+def _when( t ):
+    return( time.strftime( "%a %b %d, %Y", time.localtime( t )))
+
+
+def _percent( n, total ):
+    if not total:
+        return( "" )
+    return( " ({:.0f}%)".format( 100.0 * n / total ))
+
+
+def _table( periods, period ):
+    """print the resets in each day or week, with a bar for each
+
+    Weeks with none are shown too, to see the gaps.  Days with none
+    are left out.
+    """
+
+    if not periods:
+        return
+    most = max( periods.values())
+    keys = sorted( periods )
+    if period == 'week':
+        day = datetime.date( *[ int( v ) for v in keys[0].split( '-' ) ] )
+        end = datetime.date( *[ int( v ) for v in keys[-1].split( '-' ) ] )
+        keys = []
+        while day <= end:
+            keys.append( day.isoformat())
+            day = day + datetime.timedelta( days=7 )
+
+    print( "    {:<12s} {:>6s}".format( period + ' of' if period == 'week'
+                                         else period, 'resets' ))
+    for key in keys:
+        n = periods.get( key, 0 )
+        bar = '#' * int( round( BAR_WIDTH * n / float( most )))
+        print( "    {:<12s} {:>6d} {}".format( key, n, bar ).rstrip())
+
+
+def show( report, period ):
+    """print a report for a person"""
+
+    s = report.summary()
+    if s[ 'first' ] is None:
+        print( "no events in {:d} lines".format( s[ 'lines' ] ))
+        return
+
+    days = max(( s[ 'last' ] - s[ 'first' ] ) / 86400.0, 1 / 24.0 )
+    print( "{:d} lines, from {} to {} ({:.1f} days)".format( s[ 'lines' ],
+        _when( s[ 'first' ] ), _when( s[ 'last' ] ), days ))
+    if s[ 'local-faults' ] or s[ 'maint-skips' ]:
+        print( "{:d} local faults not reset, {:d} checks skipped for " \
+            "maintenance".format( s[ 'local-faults' ], s[ 'maint-skips' ] ))
+    if s[ 'bad-lines' ]:
+        print( "{:d} lines could not be read".format( s[ 'bad-lines' ] ))
+
+    for d in s[ 'devices' ]:
+        n = d[ 'resets' ]
+        print( "" )
+        print( "device {}".format( d[ 'device' ] ))
+        print( "    resets          {:d}  ({:.2f} a day, {:.2f} a week)". \
+            format( n, n / days, 7 * n / days ))
+        if n == 0:
+            continue
+        print( "    reasons         {}".format( ", ".join(
+            "{} {:d}".format( r, c ) for ( r, c ) in
+            sorted( d[ 'reasons' ].items(), key=lambda i: -i[1] ))))
+        if d[ 'mean-between' ] is not None:
+            print( "    mean between    {}".format(
+                _dur( d[ 'mean-between' ] )))
+        print( "    back-to-back    {:d}{} in {:d} runs, the longest {:d}". \
+            format( d[ 'back-to-back' ], _percent( d[ 'back-to-back' ], n ),
+                    d[ 'clusters' ], d[ 'largest-cluster' ] ))
+        if d[ 'locked' ]:
+            print( "    held back       {:d} by the timing lock". \
+                format( d[ 'locked' ] ))
+
+        known = d[ 'recovered' ] + d[ 'not-recovered' ]
+        print( "    recovered       {:d}{}, not {:d}, unknown {:d}".format(
+            d[ 'recovered' ], _percent( d[ 'recovered' ], known ),
+            d[ 'not-recovered' ], d[ 'unknown' ] ))
+        print( "    not repeated    {:d}{}".format( d[ 'not-repeated' ],
+            _percent( d[ 'not-repeated' ], n )))
+        if d[ 'recovered' ]:
+            print( "    recovery        mean {}, longest {}".format(
+                _dur( d[ 'recovery-mean' ] ), _dur( d[ 'recovery-max' ] )))
+            for name in _bin_names():
+                count = d[ 'recovery-bins' ][ name ]
+                bar = '#' * int( round( BAR_WIDTH * count /
+                                        float( d[ 'recovered' ] )))
+                print( "      {:>10s} {:>6d} {}".format( name, count,
+                                                     bar ).rstrip())
+        print( "" )
+        _table( d[ periods_key( period ) ], period )
+
+
+def main( argv ):
+    """the report subcommand
+
+    Arguments:
+        1:  command-line arguments, starting with the program name
+            and 'report'
+    Returns:
+        0:  ok
+        1:  not ok
+    """
+
+    progname  = os.path.basename( argv[0] ) + " " + argv[1]
+    wait_time = 600
+    period    = 'week'
+    device    = None
+    json_file = ""
+    files     = []
+
+    num_args = len( argv )
+    i = 2
+    while i < num_args:
+        try:
+            arg = argv[i]
+            if arg == '-h' or arg == '--help':
+                print( "usage: {} [options]* log-file...".format( progname ))
+                print( """\
+        [-h|--help]                print this help info
+        [-o|--output string]       write the report to JSON file
+        [-w|--wait-time num]       reset wait time of the devices ({} secs)
+        [-D|--device-name string]  report on only this device
+        [--by string]              count resets by: {} ({})\
+        """.format( wait_time, '|'.join( PERIODS ), period ))
+                return(0)
+            elif arg == '-o' or arg == '--output':
+                i = i + 1 ; json_file = argv[i]
+            elif arg == '-w' or arg == '--wait-time':
+                i = i + 1
+                if is_int( argv[i] ) == False:
+                    raise Exception( "Not an integer for {}: \'{}\'". \
+                        format( arg, argv[i] ))
+                wait_time = int( argv[i] )
+            elif arg == '-D' or arg == '--device-name':
+                i = i + 1 ; device = argv[i]
+            elif arg == '--by':
+                i = i + 1 ; period = argv[i]
+                if period not in PERIODS:
+                    raise Exception( "unknown period: \'{}\' (use {})". \
+                        format( period, '|'.join( PERIODS )))
+            elif arg.startswith( '-' ):
+                raise Exception( "unknown option: {}".format( arg ))
+            else:
+                files.append( arg )
+        except IndexError:
+            sys.stderr.write( "{}: missing value for {}\n".format(
+                progname, argv[ i - 1 ] ))
+            return(1)
+        except Exception as err:
+            sys.stderr.write( "{}: {}\n".format( progname, err ))
+            return(1)
+        i = i + 1
+
+    if not files:
+        sys.stderr.write( "{}: no log files given\n".format( progname ))
+        return(1)
+
+    report = Report( wait_time, period, device )
+    try:
+        # oldest first, so each device's resets are read in order
+        order = []
+        for file in files:
+            t = first_time( file )
+            order.append(( t is None, t or 0, file ))
+        for ( none, t, file ) in sorted( order ):
+            report.read( file )
+    except ( IOError, OSError ) as err:
+        sys.stderr.write( "{}: {}\n".format( progname, err ))
+        return(1)
+    report.finish()
+
+    show( report, period )
+
+    if json_file:
+        try:
+            with open( json_file, "w" ) as f:
+                json.dump( report.summary(), f, indent=2, sort_keys=True )
+                f.write( "\n" )
+        except ( IOError, OSError ) as err:
+            sys.stderr.write( "{}: can't write {}: {}\n".format( progname,
+                json_file, err ))
+            return(1)
+
+    return(0)
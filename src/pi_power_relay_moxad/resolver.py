@@ -0,0 +1,189 @@
+"""addresses of the host names probed, cached across runs
+
+A host given by name would be looked up by every probe, and while the
+modem is down, each look-up waits for the resolver to time out before
+the probe even starts.  Instead, each name is looked up once, and the
+address is probed.
+
+The addresses are kept in each device's lock-file (see read_state()),
+with when they were looked up, so a run from the cron uses those of
+the run before, and doesn't look anything up:
+
+    "addresses": { "dns.google": [ "8.8.8.8", 1792537200 ] }
+
+Only a name with no address yet is looked up as the policy is loaded.
+Once a check has found the network up, the names looked up more than
+--dns-ttl secs ago are looked up again, so a look-up is never made
+while the network, or DNS, is down.  If it fails, the last address
+found is kept, and the name is tried again RETRY secs later.  A DNS
+outage so never adds to the time taken to find an outage.
+"""
+
+import sys
+import socket
+import threading
+
+from .functions import dprint, read_state, update_state
+from . import globals
+from . import probes
+from . import timing
+from . import clock
+from .constants import DEFAULT_TTL
+
+RETRY = 300                 # secs before a failed name is tried again
+
+
+def is_address( name ):
+    """return True if name is an IPv4 or IPv6 address"""
+
+    for family in ( socket.AF_INET, socket.AF_INET6 ):
+        try:
+            socket.inet_pton( family, name )
+            return( True )
+        except ( socket.error, ValueError ):
+            pass
+    return( False )
+
+
+def lookup( name ):
+    """look up the address of a host name
+
+    Arguments:
+        1:  host name
+    Returns:
+        the first IPv4 or IPv6 address, or None if it can't be found
+    """
+
+    with timing.span( 'resolve' ):
+        try:
+            info = socket.getaddrinfo( name, None, 0, socket.SOCK_DGRAM )
+        except socket.error as err:
+            dprint( "lookup(): can't resolve {}: {}".format( name, err ))
+            return( None )
+
+    for ( family, socktype, proto, canonname, sockaddr ) in info:
+        if family in ( socket.AF_INET, socket.AF_INET6 ):
+            dprint( "lookup(): {} is {}".format( name, sockaddr[0] ))
+            return( sockaddr[0] )
+    return( None )
+
+
+class Resolver( object ):
+    """the addresses of the host names probed, for probes.address_of()
+
+    Made once by setup(), and kept across reloads of the policy.
+    """
+
+    def __init__( self ):
+        self.ttl     = DEFAULT_TTL
+        self.entries = {}           # name -> [ address, time looked up ]
+        self.files   = {}           # lock-file -> names of its devices
+        self.saved   = {}           # lock-file -> addresses saved in it
+        self.lock    = threading.Lock()
+
+    def load( self, devices, backend, ttl=DEFAULT_TTL ):
+        """find the addresses of the devices' hosts, when loading a policy
+
+        The addresses saved in the lock-files are used, however old.
+        Only names with none are looked up now.
+
+        Arguments:
+            1:  array of device dictionaries (see parse_device())
+            2:  default probe backend
+            3:  secs to use an address before looking it up again
+        """
+
+        with self.lock:
+            self.ttl   = ttl
+            self.files = {}
+            for device in devices:
+                names = self.files.setdefault( device[ 'lock-file' ], [] )
+                for host in device[ 'hosts' ]:
+                    name = probes.target_name( host, backend )
+                    if name not in names and not is_address( name ):
+                        names.append( name )
+
+            wanted = set()
+            for ( file, names ) in self.files.items():
+                if file not in self.saved:
+                    state = read_state( file, quiet=True )
+                    self.saved[ file ] = state.get( 'addresses' ) or {}
+                for name in names:
+                    wanted.add( name )
+                    entry = self.saved[ file ].get( name )
+                    if name not in self.entries and _valid( entry ):
+                        self.entries[ name ] = list( entry )
+
+            for name in list( self.entries ):
+                if name not in wanted:
+                    del self.entries[ name ]
+
+            for name in sorted( wanted ):
+                if name not in self.entries:
+                    self._lookup( name, int( clock.now()))
+
+            self._publish()
+            self._save()
+
+    def refresh( self ):
+        """look up again the names looked up more than the ttl ago
+
+        Only to be called once the network has been found up.
+        """
+
+        with self.lock:
+            now = int( clock.now())
+            due = [ name for ( name, ( address, t )) in self.entries.items()
+                    if now - t >= self.ttl ]
+            if not due:
+                return
+
+            for name in sorted( due ):
+                self._lookup( name, now )
+            self._publish()
+            self._save()
+
+    def _lookup( self, name, now ):
+        address = lookup( name )
+        if address is not None:
+            self.entries[ name ] = [ address, now ]
+            return
+
+        # keep the last address found, if any, and try again later
+        old = self.entries.get( name, [ None, 0 ] )[0]
+        self.entries[ name ] = [ old, now - self.ttl + RETRY ]
+
+    def _publish( self ):
+        # replaced, not changed, for any probe going on
+        addresses = {}
+        for ( name, ( address, t )) in self.entries.items():
+            if address is not None:
+                addresses[ name ] = address
+        probes.addresses = addresses
+
+    def _save( self ):
+        """save each lock-file's addresses in it, if they changed"""
+
+        for ( file, names ) in self.files.items():
+            addresses = dict(( name, self.entries[ name ] ) for name in names
+                             if name in self.entries )
+            if addresses == self.saved.get( file ):
+                continue
+            try:
+                update_state( file, { 'addresses': addresses })
+            except ( IOError, OSError ) as err:
+                sys.stderr.write( "{}: can't write lock-file: {}\n".format(
+                    globals.progname, err ))
+                continue
+            self.saved[ file ] = addresses
+
+
+def _valid( entry ):
+    """return True if a saved entry is [ address or None, time ]"""
+
+    try:
+        ( address, t ) = entry
+        return( ( address is None or is_address( address )) and
+                int( t ) == t )
+    except ( TypeError, ValueError ):
+        return( False )
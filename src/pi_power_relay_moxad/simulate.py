@@ -0,0 +1,406 @@
+"""simulate weeks of checks and outages in seconds (--simulate)
+
+The real check -> lock -> reset pipeline is run against a VirtualClock
+(see clock.py), a fake network and a fake GPIO, using the options
+given on the command line.  So the effect of a change to --wait-time,
+--reset-time, --tries, --maint, etc, can be seen before it goes into
+the field.
+
+The network is described by a JSON scenario file:
+
+    { "start":      "2026-03-01 00:00",
+      "length":     "30d",
+      "interval":   "2m",
+      "seed":       1,
+      "boot-time":  "90s",
+      "hosts": { "8.8.8.8": { "rtt": 0.02, "loss": 0.01 } },
+      "outages": [
+        { "start": "2026-03-03 02:10", "length": "45m",
+          "hosts": [ "8.8.8.8" ], "name": "upstream" },
+        { "start": "2026-03-07 14:00", "fixed-by-reset": true }
+      ] }
+
+    start       when the simulation starts.  "YYYY-MM-DD HH:MM" local
+                time, or seconds since the epoch
+    length      how long to simulate
+    interval    time between checks, as from the cron (default 2m).
+                With --daemon, --interval is used instead
+    seed        for the random probe loss (default 1)
+    boot-time   how long a device takes to get the network back once
+                power is restored (default 60s)
+    hosts       round-trip time and fraction of probes lost for hosts.
+                Hosts not given answer in 30ms, and never lose probes
+    outages     times the hosts (default all of them) don't answer.
+                An outage with fixed-by-reset, such as a hung modem,
+                ends once a device using those hosts is reset, and the
+                boot-time is over.  Otherwise it needs a length
+
+Lengths are seconds, or a number followed by s, m, h or d.
+
+Every reset that would have been made is reported, with the outage it
+was made in, if any, followed by each outage and how long it took to
+be acted on.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+from . import clock
+from . import probes
+from .fakes import FakeNetwork, FakeGPIO, HIGH
+
+BACKEND = 'simulate'
+
+DEFAULT_INTERVAL  = 120
+DEFAULT_BOOT_TIME = 60
+DEFAULT_RTT       = 0.03
+
+_units = { 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60 }
+
+
+def parse_length( val ):
+    """return seconds from a number, or a string like '90s', '5m', '2d'
+
+    Exceptions:
+        Exception if it is not a length
+    """
+
+    if isinstance( val, ( int, float )):
+        return( val )
+    val = str( val ).strip()
+    try:
+        if val and val[-1] in _units:
+            return( float( val[ :-1 ] ) * _units[ val[-1] ] )
+        return( float( val ))
+    except ValueError:
+        raise Exception( "bad length: \'{}\'".format( val ))
+
+
+def parse_time( val ):
+    """return seconds since the epoch from a number or 'YYYY-MM-DD HH:MM'
+
+    Exceptions:
+        Exception if it is not a time
+    """
+
+    if isinstance( val, ( int, float )):
+        return( float( val ))
+    for format in ( "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d" ):
+        try:
+            return( time.mktime( time.strptime( str( val ), format )))
+        except ValueError:
+            pass
+    raise Exception( "bad time: \'{}\'".format( val ))
+
+
+def load_scenario( file ):
+    """read and check a scenario file
+
+    Arguments:
+        1:  filename
+    Returns:
+        scenario dictionary, with times and lengths in seconds
+    Exceptions:
+        Exception for a file that can't be read or is not valid
+    """
+
+    try:
+        with open( file, "r" ) as f:
+            data = json.load( f )
+    except ( IOError, OSError ) as err:
+        raise Exception( "can't read scenario {}: {}".format( file, err ))
+    except ValueError as err:
+        raise Exception( "bad scenario {}: {}".format( file, err ))
+
+    if 'start' not in data or 'length' not in data:
+        raise Exception( "scenario {} needs a start and a length". \
+            format( file ))
+
+    scenario = {
+        'start':     parse_time( data[ 'start' ] ),
+        'length':    parse_length( data[ 'length' ] ),
+        'interval':  parse_length( data.get( 'interval', DEFAULT_INTERVAL )),
+        'boot-time': parse_length( data.get( 'boot-time',
+                                             DEFAULT_BOOT_TIME )),
+        'seed':      data.get( 'seed', 1 ),
+        'hosts':     data.get( 'hosts', {} ),
+        'outages':   [],
+    }
+    if scenario[ 'interval' ] <= 0:
+        raise Exception( "scenario interval must be more than 0" )
+
+    for ( n, o ) in enumerate( data.get( 'outages', [] )):
+        outage = {
+            'name':     o.get( 'name', "outage {:d}".format( n + 1 )),
+            'start':    parse_time( o[ 'start' ] ),
+            'end':      None,
+            'hosts':    o.get( 'hosts' ),
+            'fixed-by-reset': bool( o.get( 'fixed-by-reset', False )),
+            'resets':   [],
+        }
+        if 'length' in o:
+            outage[ 'end' ] = outage[ 'start' ] + \
+                parse_length( o[ 'length' ] )
+        elif not outage[ 'fixed-by-reset' ]:
+            raise Exception( "{} needs a length, or fixed-by-reset". \
+                format( outage[ 'name' ] ))
+        scenario[ 'outages' ].append( outage )
+
+    return( scenario )
+
+
+class SimNetwork( FakeNetwork ):
+    """a FakeNetwork whose outages are the scenario's, plus reboots"""
+
+    def __init__( self, scenario ):
+        FakeNetwork.__init__( self, seed=scenario[ 'seed' ] )
+        self.scenario = scenario
+        self.reboots  = []          # [ start, end, hosts ]
+
+    def reachable( self, host, now=None ):
+        if now is None:
+            now = clock.now()
+        for o in self.scenario[ 'outages' ]:
+            if _active( o[ 'start' ], o[ 'end' ], now ) and \
+               ( o[ 'hosts' ] is None or host in o[ 'hosts' ] ):
+                return( False )
+        for ( start, end, hosts ) in self.reboots:
+            if _active( start, end, now ) and host in hosts:
+                return( False )
+        return( True )
+
+
+def _active( start, end, now ):
+    return( now >= start and ( end is None or now < end ))
+
+
+def _covers( outage, now, hosts ):
+    """True if an outage is going on at a time, for any of the hosts"""
+
+    return( _active( outage[ 'start' ], outage[ 'end' ], now ) and
+            ( outage[ 'hosts' ] is None or
+              set( outage[ 'hosts' ] ) & set( hosts )))
+
+
+class SimGPIO( FakeGPIO ):
+    """a FakeGPIO that takes the network of a device down while it is
+    power cycled, and ends the outages a reset fixes
+    """
+
+    def __init__( self, net, devices, boot_time ):
+        FakeGPIO.__init__( self )
+        self.net       = net
+        self.devices   = dict(( d[ 'pin' ], d ) for d in devices )
+        self.boot_time = boot_time
+
+    def set( self, pin, value ):
+        FakeGPIO.set( self, pin, value )
+        device = self.devices.get( pin )
+        if device is None:
+            return
+
+        now = clock.now()
+        hosts = device[ 'hosts' ]
+        if value == HIGH:
+            self.net.reboots.append([ now, None, hosts ])
+            return
+
+        back = now + self.boot_time
+        for reboot in self.net.reboots:
+            if reboot[1] is None and reboot[2] == hosts:
+                reboot[1] = back
+        for o in self.net.scenario[ 'outages' ]:
+            if not o[ 'fixed-by-reset' ] or not _covers( o, now, hosts ):
+                continue
+            if o[ 'end' ] is None or o[ 'end' ] > back:
+                o[ 'end' ] = back
+
+
+def _when( secs ):
+    return( time.strftime( "%a %b %d, %Y %H:%M:%S", time.localtime( secs )))
+
+
+def _length( secs ):
+    secs = int( secs )
+    if secs >= 3600:
+        return( "{:d}h{:02d}m".format( secs // 3600, secs % 3600 // 60 ))
+    if secs >= 60:
+        return( "{:d}m{:02d}s".format( secs // 60, secs % 60 ))
+    return( "{:d}s".format( secs ))
+
+
+def run( opts ):
+    """run a simulation, and print what happened
+
+    Arguments:
+        1:  options dictionary built by main(), with simulate-file
+    Returns:
+        0:  ok
+        1:  not ok
+    """
+
+    from .pi_power_relay import check
+
+    progname = opts[ 'progname' ]
+    try:
+        scenario = load_scenario( opts[ 'simulate-file' ] )
+    except Exception as err:
+        sys.stderr.write( "{}: {}\n".format( progname, err ))
+        return(1)
+
+    start = scenario[ 'start' ]
+    end   = start + scenario[ 'length' ]
+    interval = scenario[ 'interval' ]
+    if opts[ 'daemon-flag' ]:
+        interval = opts[ 'interval' ]
+
+    net = SimNetwork( scenario )
+    for d in opts[ 'devices' ]:
+        for host in d[ 'hosts' ]:
+            net.add_host( host, DEFAULT_RTT )
+    for ( host, vals ) in scenario[ 'hosts' ].items():
+        net.add_host( host, vals.get( 'rtt', DEFAULT_RTT ),
+                      vals.get( 'loss', 0.0 ))
+
+    # lock-files go in a directory of our own, so real ones are left
+    # alone, and nothing is logged, printed or saved
+
+    tmpdir = tempfile.mkdtemp( prefix='pi-power-relay-sim.' )
+    devices = []
+    for d in opts[ 'devices' ]:
+        d = dict( d )
+        d[ 'lock-file' ] = os.path.join( tmpdir, d[ 'device-name' ] )
+        devices.append( d )
+
+    opts = dict( opts )
+    opts.update({
+        'devices':          devices,
+        'probe':            BACKEND,
+        'concurrent-flag':  False,  # the virtual clock is not thread-safe
+        'have-gpio':        True,
+        'logging-flag':     False,
+        'quiet-flag':       True,
+        'force-flag':       False,
+        'diagnose-flag':    False,  # /proc and /sys are not the scenario
+        'health':           None,
+        'recorder':         None,
+        'history':          None,
+        'events':           None,
+        'resolver':         None,
+        'peers':            None,
+        'metrics-file':     "",
+    })
+
+    gpio = SimGPIO( net, devices, scenario[ 'boot-time' ] )
+    opts[ 'gpio' ] = gpio
+    probes.register( BACKEND, net.probe )
+    probes.forced = BACKEND
+    old_clock = clock.use( clock.VirtualClock( start ))
+
+    ticks   = 0
+    skipped = 0
+    state   = {}
+    real_start = time.time()
+    try:
+        tick = start
+        while tick < end:
+            clock.sleep( tick - clock.now())
+            if not opts[ 'daemon-flag' ]:
+                state = {}          # a new process every time from cron
+            check( opts, state )
+            ticks = ticks + 1
+
+            # a check still going when the next one is due would
+            # overlap with it from cron.  Skip those, so they don't
+            tick = tick + interval
+            while tick < clock.now():
+                tick = tick + interval
+                skipped = skipped + 1
+
+        clock.sleep( max( 0, end - clock.now()))
+    finally:
+        clock.use( old_clock )
+        probes.forced = None
+        del probes.BACKENDS[ BACKEND ]
+        shutil.rmtree( tmpdir, True )
+
+    report( scenario, devices, gpio, net, ticks, skipped,
+            time.time() - real_start )
+    return(0)
+
+
+def report( scenario, devices, gpio, net, ticks, skipped, took ):
+    """print the resets made, and how each outage was handled"""
+
+    by_pin = dict(( d[ 'pin' ], d ) for d in devices )
+    outages = scenario[ 'outages' ]
+
+    print( "simulated {} from {}: {:d} checks, {:d} probes, in {:.1f} secs". \
+        format( _length( scenario[ 'length' ] ), _when( scenario[ 'start' ] ),
+                ticks, net.probes, took ))
+    if skipped:
+        print( "{:d} checks not made while a reset was still going". \
+            format( skipped ))
+    print( "" )
+
+    resets = [ ( when, pin ) for ( when, pin, value ) in gpio.events
+               if value == HIGH ]
+    false_resets = 0
+    useless = 0
+    print( "resets:" )
+    for ( when, pin ) in resets:
+        device = by_pin[ pin ]
+        hosts  = device[ 'hosts' ]
+        cause  = None
+        for o in outages:
+            if _covers( o, when, hosts ):
+                cause = o
+                break
+        if cause is None:
+            false_resets = false_resets + 1
+            why = "no outage"
+            for ( start, end, reboot_hosts ) in net.reboots:
+                if start < when and _active( start, end, when ) and \
+                   set( reboot_hosts ) & set( hosts ):
+                    why = "no outage, during a reboot"
+        else:
+            cause[ 'resets' ].append( when )
+            why = cause[ 'name' ]
+            if not cause[ 'fixed-by-reset' ]:
+                useless = useless + 1
+                why = why + " (not fixed by a reset)"
+        print( "    {}  {:<12s}  {}".format( _when( when ),
+                                             device[ 'device-name' ], why ))
+    if not resets:
+        print( "    none" )
+    print( "" )
+
+    print( "outages:" )
+    missed = 0
+    for o in outages:
+        end = o[ 'end' ]
+        if end is None:
+            length = "still down"
+        else:
+            length = _length( end - o[ 'start' ] )
+        if o[ 'resets' ]:
+            acted = "first reset after {}, {:d} resets". \
+                format( _length( o[ 'resets' ][0] - o[ 'start' ] ),
+                        len( o[ 'resets' ] ))
+        else:
+            acted = "no reset"
+            if o[ 'fixed-by-reset' ]:
+                missed = missed + 1
+        print( "    {}  {:<12s}  {:<10s}  {}".format( _when( o[ 'start' ] ),
+            o[ 'name' ], length, acted ))
+    if not outages:
+        print( "    none" )
+    print( "" )
+
+    print( "{:d} resets: {:d} with no outage, {:d} that could not help. " \
+        "{:d} outages a reset would fix were not reset". \
+        format( len( resets ), false_resets, useless, missed ))
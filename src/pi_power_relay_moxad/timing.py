@@ -0,0 +1,187 @@
+"""timing spans for --profile
+
+Parts of the program are wrapped in spans:
+
+    with timing.span( 'ping', host=host ):
+        ...
+
+With --profile, each span is recorded, and at the end they are written
+as a Chrome trace-event JSON file (load it in chrome://tracing or
+https://ui.perfetto.dev), along with a plain-text summary of where the
+time went in a file of the same name with '.txt' added.
+
+When profiling is not on, span() returns the same do-nothing object
+every time, so a span costs about a function call.
+"""
+
+import os
+import time
+import threading
+
+_tracer = None
+
+
+class _NoSpan( object ):
+    """what span() returns when not profiling"""
+
+    def __enter__( self ):
+        return( self )
+
+    def __exit__( self, type, value, tb ):
+        return( False )
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span( object ):
+    def __init__( self, tracer, name, args ):
+        self.tracer = tracer
+        self.name   = name
+        self.args   = args
+
+    def __enter__( self ):
+        self.start = time.time()
+        return( self )
+
+    def __exit__( self, type, value, tb ):
+        self.tracer.add( self.name, self.start, time.time(), self.args )
+        return( False )
+
+
+class Tracer( object ):
+    """collects completed spans"""
+
+    def __init__( self ):
+        self.events = []
+        self.lock   = threading.Lock()
+        self.pid    = os.getpid()
+
+    def add( self, name, start, end, args=None ):
+        event = {
+            'name': name,
+            'ph':   'X',
+            'ts':   int( start * 1000000 ),
+            'dur':  int(( end - start ) * 1000000 ),
+            'pid':  self.pid,
+            'tid':  threading.current_thread().ident,
+        }
+        if args:
+            event[ 'args' ] = args
+        with self.lock:
+            self.events.append( event )
+
+    def write_trace( self, file ):
+        import json
+
+        with self.lock:
+            events = list( self.events )
+        with open( file, "w" ) as f:
+            json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, f )
+
+    def summary( self ):
+        """return a plain-text table of time spent, by span name"""
+
+        with self.lock:
+            events = list( self.events )
+
+        totals = {}
+        for event in events:
+            t = totals.setdefault( event[ 'name' ], [ 0, 0, 0 ] )
+            t[0] = t[0] + 1
+            t[1] = t[1] + event[ 'dur' ]
+            t[2] = max( t[2], event[ 'dur' ] )
+
+        lines = [ "{0:<24s} {1:>6s} {2:>12s} {3:>12s} {4:>12s}".format(
+            'span', 'count', 'total ms', 'mean ms', 'max ms' ) ]
+        for name in sorted( totals, key=lambda n: -totals[n][1] ):
+            ( count, total, max_dur ) = totals[ name ]
+            lines.append( "{0:<24s} {1:>6d} {2:>12.1f} {3:>12.1f} {4:>12.1f}".
+                format( name, count, total / 1000.0,
+                        total / 1000.0 / count, max_dur / 1000.0 ))
+
+        return( "\n".join( lines ) + "\n" )
+
+
+def enable():
+    """start recording spans
+
+    Returns:
+        the Tracer
+    """
+
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return( _tracer )
+
+
+def enabled():
+    return( _tracer is not None )
+
+
+def span( name, **args ):
+    """return a context manager that times what it wraps
+
+    Arguments:
+        1:  name of the span
+        keyword arguments are recorded with the span
+    """
+
+    if _tracer is None:
+        return( _NO_SPAN )
+    return( _Span( _tracer, name, args ))
+
+
+def add_span( name, start, end, **args ):
+    """record a span that has already happened
+
+    Arguments:
+        1:  name of the span
+        2:  start time (seconds since epoch)
+        3:  end time
+        keyword arguments are recorded with the span
+    """
+
+    if _tracer is None:
+        return
+    _tracer.add( name, start, end, args )
+
+
+def process_start_time():
+    """return when this process started, from /proc, or None"""
+
+    try:
+        with open( '/proc/self/stat' ) as f:
+            # the command name can have spaces in it, so skip past it
+            fields = f.read().rsplit( ')', 1 )[1].split()
+        start_ticks = int( fields[19] )
+        with open( '/proc/uptime' ) as f:
+            uptime = float( f.read().split()[0] )
+    except ( IOError, OSError, ValueError, IndexError ):
+        return( None )
+
+    age = uptime - start_ticks / float( os.sysconf( 'SC_CLK_TCK' ))
+    return( time.time() - age )
+
+
+def write( file ):
+    """write the trace to a file, and the summary to the file with .txt
+
+    Arguments:
+        1:  filename
+    Returns:
+        the summary
+    Exceptions:
+        IOError/OSError if a file can't be written
+    """
+
+    if _tracer is None:
+        return( '' )
+
+    _tracer.write_trace( file )
+    summary = _tracer.summary()
+    with open( file + ".txt", "w" ) as f:
+        f.write( summary )
+
+    return( summary )
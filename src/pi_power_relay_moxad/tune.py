@@ -0,0 +1,476 @@
+"""the 'tune' subcommand: try other settings against a probe trace
+
+    pi-power-relay tune [options] trace-file
+
+A trace recorded with --record (see probetrace.py) is replayed against
+every combination of --tries, --ping-timeout, --wait-time and host
+order given, and for each one it reports:
+
+    resets      resets it would have made
+    false       resets made while some host was answering
+    outages     outages (checks in a row with no host answering) that
+                got a reset, out of all of them
+    latency     mean and worst time from the first check of an outage
+                to the reset
+    probes      probes sent, in total
+    fast        mean time of a check while the network is up
+
+The best are listed first: fewest false resets, then fewest outages
+missed, then quickest, then fewest resets, then fewest probes.
+
+The trace only holds the probes that were actually sent, since a check
+stops at the first host that answers.  The gaps are filled in:
+
+  - a host that answered in a check answers every later try as well
+  - a host that didn't answer in a check doesn't answer any more tries
+  - a host not probed in a check does what it did the nearest time it
+    was probed
+  - a probe that timed out would also time out with a longer timeout
+
+Checks are replayed as sequential probing.  With NumPy, each setting is
+evaluated across all the checks at once, so thousands of settings over
+months of checks take seconds.  Without it, the same is done a check
+at a time, which is much slower.
+"""
+
+import os
+import sys
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import probetrace
+from .functions import dprint, is_int
+
+ORDERS = ( 'recorded', 'reliable', 'fast' )
+
+
+def host_matrix( checks, max_tries ):
+    """fill in the probes of every host and try, for every check
+
+    Arguments:
+        1:  checks, as from probetrace.read()
+        2:  number of tries to fill in
+    Returns:
+        ( hosts, rtts ) where rtts[ check ][ host ][ try ] is the
+        round-trip time, or None for no answer
+    """
+
+    hosts = []
+    index = {}
+    for ( now, timeout, probes ) in checks:
+        for ( host, rtt ) in probes:
+            if host not in index:
+                index[ host ] = len( hosts )
+                hosts.append( host )
+
+    # what each host did in each check it was probed in
+    seen = []
+    for ( now, timeout, probes ) in checks:
+        tries = {}
+        for ( host, rtt ) in probes:
+            tries.setdefault( index[ host ], [] ).append( rtt )
+        seen.append( tries )
+
+    rtts = [ None ] * len( checks )
+    last = [ None ] * len( hosts )      # tries the last time probed
+    for ( c, tries ) in enumerate( seen ):
+        row = []
+        for h in range( len( hosts )):
+            if h in tries:
+                last[h] = tries[h]
+            row.append( last[h] )
+        rtts[c] = row
+
+    # hosts not probed yet at the start take what they did first
+    first = [ None ] * len( hosts )
+    for c in range( len( seen ) - 1, -1, -1 ):
+        for ( h, t ) in seen[c].items():
+            first[h] = t
+        for h in range( len( hosts )):
+            if rtts[c][h] is None:
+                rtts[c][h] = first[h]
+
+    for row in rtts:
+        for h in range( len( hosts )):
+            row[h] = _fill( row[h], max_tries )
+
+    return( hosts, rtts )
+
+
+def _fill( tries, max_tries ):
+    """extend the tries of a host to max_tries"""
+
+    if tries is None:
+        return( [ None ] * max_tries )
+
+    tries = list( tries[ :max_tries ] )
+    answered = [ r for r in tries if r is not None ]
+    more = None
+    if answered:
+        more = answered[0]
+    while len( tries ) < max_tries:
+        tries.append( more )
+    return( tries )
+
+
+def host_orders( hosts, rtts ):
+    """return the host orders to try, as lists of host numbers"""
+
+    n = len( hosts )
+    answered = [ 0 ] * n
+    total    = [ 0.0 ] * n
+    for row in rtts:
+        for h in range( n ):
+            if row[h][0] is not None:
+                answered[h] = answered[h] + 1
+                total[h] = total[h] + row[h][0]
+
+    def mean_rtt( h ):
+        if answered[h] == 0:
+            return( float( 'inf' ))
+        return( total[h] / answered[h] )
+
+    return({
+        'recorded': list( range( n )),
+        'reliable': sorted( range( n ), key=lambda h: -answered[h] ),
+        'fast':     sorted( range( n ), key=mean_rtt ),
+    })
+
+
+def evaluate( rtts, order, tries, timeout ):
+    """replay sequential probing over every check
+
+    Arguments:
+        1:  rtts from host_matrix(), or the NumPy array of them
+        2:  host order, as a list of host numbers
+        3:  tries
+        4:  timeout
+    Returns:
+        ( up, probes, secs ), each a list with one entry per check:
+        if the network was found up, the probes sent, and the time taken
+    """
+
+    if numpy is not None:
+        return( _evaluate_numpy( rtts, order, tries, timeout ))
+
+    up     = []
+    probes = []
+    secs   = []
+    for row in rtts:
+        found = False
+        sent  = 0
+        took  = 0.0
+        for h in order:
+            for rtt in row[h][ :tries ]:
+                sent = sent + 1
+                if rtt is not None and rtt <= timeout:
+                    took = took + rtt
+                    found = True
+                    break
+                took = took + timeout
+            if found:
+                break
+        up.append( found )
+        probes.append( sent )
+        secs.append( took )
+
+    return( up, probes, secs )
+
+
+def _evaluate_numpy( rtts, order, tries, timeout ):
+    # rtts is an array [ check, host, try ], NaN for no answer
+    r = rtts[ :, order, :tries ]
+    with numpy.errstate( invalid='ignore' ):
+        ok = r <= timeout
+
+    host_up  = ok.any( axis=2 )
+    first    = ok.argmax( axis=2 )
+    used     = numpy.where( host_up, first + 1, tries )
+    rtt      = numpy.take_along_axis( r, first[ :, :, None ], 2 )[ :, :, 0 ]
+    host_secs = numpy.where( host_up, first * timeout + rtt, tries * timeout )
+
+    up = host_up.any( axis=1 )
+    last = numpy.where( up, host_up.argmax( axis=1 ), len( order ) - 1 )
+    probed = numpy.arange( len( order ))[ None, : ] <= last[ :, None ]
+
+    return( up, ( used * probed ).sum( axis=1 ),
+            ( host_secs * probed ).sum( axis=1 ))
+
+
+def outages( down ):
+    """return the outages, as ( first, last ) check numbers"""
+
+    found = []
+    start = None
+    for ( c, d ) in enumerate( down ):
+        if d and start is None:
+            start = c
+        elif not d and start is not None:
+            found.append(( start, c - 1 ))
+            start = None
+    if start is not None:
+        found.append(( start, len( down ) - 1 ))
+    return( found )
+
+
+def resets( times, down, secs, wait_time ):
+    """return the checks that would have reset, honouring the wait time
+
+    Arguments:
+        1:  time of each check
+        2:  the checks that found the network down, in order
+        3:  time each check took
+        4:  wait time
+    Returns:
+        list of check numbers
+    """
+
+    made = []
+    last = None
+    for c in down:
+        when = times[c] + secs[c]
+        if last is None or when - last >= wait_time:
+            made.append( c )
+            last = when
+    return( made )
+
+
+def sweep( checks, tries_list, timeout_list, wait_list, order_names ):
+    """replay a trace with every combination of settings
+
+    Arguments:
+        1:  checks, as from probetrace.read()
+        2:  list of tries
+        3:  list of timeouts
+        4:  list of wait times
+        5:  list of host order names.  See ORDERS
+    Returns:
+        list of results, best first
+    """
+
+    ( hosts, rtts ) = host_matrix( checks, max( tries_list ))
+    orders = host_orders( hosts, rtts )
+    times  = [ now for ( now, timeout, probes ) in checks ]
+
+    # the truth: checks where no host answered at all
+    down = [ all( r is None for h in row for r in h ) for row in rtts ]
+    all_outages = outages( down )
+
+    if numpy is not None:
+        rtts = numpy.array([[[ numpy.nan if r is None else r for r in h ]
+                             for h in row ] for row in rtts ], dtype=float )
+        if rtts.size == 0:
+            rtts = rtts.reshape(( len( checks ), len( hosts ),
+                                  max( tries_list )))
+
+    results = []
+    for name in order_names:
+        order = orders[ name ]
+        for tries in tries_list:
+            for timeout in timeout_list:
+                ( up, probes, secs ) = evaluate( rtts, order, tries, timeout )
+                ( found_down, total, fast ) = _summary( up, probes, secs )
+                for wait_time in wait_list:
+                    made = resets( times, found_down, secs, wait_time )
+                    results.append( _result( name, tries, timeout, wait_time,
+                        made, down, all_outages, times, secs, total, fast ))
+
+    results.sort( key=lambda r: ( r[ 'false-resets' ],
+        r[ 'outages' ] - r[ 'outages-reset' ],
+        r[ 'mean-latency' ] if r[ 'mean-latency' ] is not None else 0,
+        r[ 'resets' ], r[ 'probes' ] ))
+    return( results )
+
+
+def _summary( up, probes, secs ):
+    """return ( checks found down, total probes, mean secs of checks up )"""
+
+    if numpy is not None:
+        fast = None
+        if up.any():
+            fast = float( secs[ up ].mean())
+        return( numpy.flatnonzero( ~up ).tolist(), int( probes.sum()), fast )
+
+    found_down = [ c for c in range( len( up )) if not up[c] ]
+    fast = [ s for ( s, u ) in zip( secs, up ) if u ]
+    mean_fast = None
+    if fast:
+        mean_fast = sum( fast ) / len( fast )
+    return( found_down, sum( probes ), mean_fast )
+
+
+def _result( order, tries, timeout, wait_time, made, down, all_outages,
+             times, secs, probes, fast ):
+    false_resets = len([ c for c in made if not down[c] ])
+
+    latencies = []
+    made_set = set( made )
+    for ( first, last ) in all_outages:
+        for c in range( first, last + 1 ):
+            if c in made_set:
+                latencies.append( float( times[c] + secs[c] - times[ first ] ))
+                break
+
+    mean_latency = None
+    max_latency  = None
+    if latencies:
+        mean_latency = sum( latencies ) / len( latencies )
+        max_latency  = max( latencies )
+
+    return({
+        'order':            order,
+        'tries':            tries,
+        'timeout':          timeout,
+        'wait-time':        wait_time,
+        'resets':           len( made ),
+        'false-resets':     false_resets,
+        'outages':          len( all_outages ),
+        'outages-reset':    len( latencies ),
+        'mean-latency':     mean_latency,
+        'max-latency':      max_latency,
+        'probes':           probes,
+        'fast':             fast,
+    })
+
+
+def _int_list( val ):
+    items = val.split( ',' )
+    for item in items:
+        if is_int( item ) == False or int( item ) < 1:
+            raise Exception( "not a list of numbers: \'{}\'".format( val ))
+    return( sorted( set( int( item ) for item in items )))
+
+
+def _secs( val, format="{:.1f}" ):
+    if val is None:
+        return( '-' )
+    return( format.format( val ))
+
+
+def main( argv ):
+    """the tune subcommand
+
+    Arguments:
+        1:  command-line arguments, starting with the program name
+            and 'tune'
+    Returns:
+        0:  ok
+        1:  not ok
+    """
+
+    progname = os.path.basename( argv[0] ) + " " + argv[1]
+
+    tries_list   = [ 1, 2, 3, 4, 5 ]
+    timeout_list = [ 1, 2, 3, 5 ]
+    wait_list    = [ 300, 600, 900, 1800 ]
+    order_names  = list( ORDERS )
+    top          = 20
+    json_file    = ""
+    trace_file   = ""
+
+    num_args = len( argv )
+    i = 2
+    while i < num_args:
+        try:
+            arg = argv[i]
+            if arg == '-h' or arg == '--help':
+                print( "usage: {} [options]* trace-file".format( progname ))
+                print( """\
+        [-h|--help]                print this help info
+        [-n|--top num]             number of settings to show ({})
+        [-o|--output string]       write all the results to JSON file
+        [-t|--tries list]          comma-delimited tries to try ({})
+        [-w|--wait-time list]      wait times to try ({})
+        [-x|--ping-timeout list]   ping timeouts to try ({})
+        [--order list]             host orders to try: {} ({})\
+        """.format( top, ','.join( str( t ) for t in tries_list ),
+                    ','.join( str( w ) for w in wait_list ),
+                    ','.join( str( x ) for x in timeout_list ),
+                    '|'.join( ORDERS ), ','.join( order_names )))
+                return(0)
+            elif arg == '-n' or arg == '--top':
+                i = i + 1
+                if is_int( argv[i] ) == False:
+                    raise Exception( "Not an integer for {}: \'{}\'". \
+                        format( arg, argv[i] ))
+                top = int( argv[i] )
+            elif arg == '-o' or arg == '--output':
+                i = i + 1 ; json_file = argv[i]
+            elif arg == '-t' or arg == '--tries':
+                i = i + 1 ; tries_list = _int_list( argv[i] )
+            elif arg == '-w' or arg == '--wait-time':
+                i = i + 1 ; wait_list = _int_list( argv[i] )
+            elif arg == '-x' or arg == '--ping-timeout':
+                i = i + 1 ; timeout_list = _int_list( argv[i] )
+            elif arg == '--order':
+                i = i + 1 ; order_names = argv[i].split( ',' )
+                for name in order_names:
+                    if name not in ORDERS:
+                        raise Exception( "unknown host order: \'{}\'". \
+                            format( name ))
+            elif arg.startswith( '-' ):
+                raise Exception( "unknown option: {}".format( arg ))
+            elif trace_file:
+                raise Exception( "only one trace file can be given" )
+            else:
+                trace_file = arg
+        except IndexError:
+            sys.stderr.write( "{}: missing value for {}\n".format(
+                progname, argv[ i - 1 ] ))
+            return(1)
+        except Exception as err:
+            sys.stderr.write( "{}: {}\n".format( progname, err ))
+            return(1)
+        i = i + 1
+
+    if not trace_file:
+        sys.stderr.write( "{}: no trace file given\n".format( progname ))
+        return(1)
+
+    try:
+        checks = probetrace.read( trace_file )
+    except Exception as err:
+        sys.stderr.write( "{}: {}\n".format( progname, err ))
+        return(1)
+
+    if not checks:
+        sys.stderr.write( "{}: no checks in {}\n".format( progname,
+                                                          trace_file ))
+        return(1)
+
+    if numpy is None:
+        dprint( "tune: NumPy not found.  evaluating a check at a time" )
+
+    results = sweep( checks, tries_list, timeout_list, wait_list,
+                     order_names )
+
+    print( "{:d} checks from {:.1f} days, {:d} settings". \
+        format( len( checks ), ( checks[-1][0] - checks[0][0] ) / 86400.0,
+                len( results )))
+    print( "{:<9s} {:>5s} {:>7s} {:>5s} {:>6s} {:>5s} {:>7s} {:>8s} " \
+        "{:>8s} {:>8s} {:>7s}".format( 'order', 'tries', 'timeout', 'wait',
+        'resets', 'false', 'outages', 'latency', 'worst', 'probes', 'fast' ))
+    for r in results[ :top ]:
+        print( "{:<9s} {:>5d} {:>7d} {:>5d} {:>6d} {:>5d} {:>7s} {:>8s} " \
+            "{:>8s} {:>8d} {:>7s}".format( r[ 'order' ], r[ 'tries' ],
+            r[ 'timeout' ], r[ 'wait-time' ], r[ 'resets' ],
+            r[ 'false-resets' ],
+            "{:d}/{:d}".format( r[ 'outages-reset' ], r[ 'outages' ] ),
+            _secs( r[ 'mean-latency' ] ), _secs( r[ 'max-latency' ] ),
+            r[ 'probes' ], _secs( r[ 'fast' ], "{:.3f}" )))
+
+    if json_file:
+        try:
+            with open( json_file, "w" ) as f:
+                json.dump( results, f, indent=2, sort_keys=True )
+                f.write( "\n" )
+        except ( IOError, OSError ) as err:
+            sys.stderr.write( "{}: can't write {}: {}\n".format( progname,
+                json_file, err ))
+            return(1)
+
+    return(0)
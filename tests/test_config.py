@@ -0,0 +1,150 @@
+"""tests of config files, the compiled policy, and reloading them"""
+
+import pytest
+
+from pi_power_relay_moxad import globals
+from pi_power_relay_moxad import config
+from pi_power_relay_moxad import pi_power_relay
+
+CONFIG = """# pi-power-relay.conf
+hosts       = 8.8.8.8, 1.1.1.1
+tries       = 3
+daemon      = yes
+quiet       = no
+maint       = 02:00-02:30, sat+sun 23:00-01:00
+
+[device modem]
+pin         = 25
+hosts       = 8.8.8.8, 1.1.1.1
+wait-time   = 900
+"""
+
+
+@pytest.fixture( autouse=True )
+def probe_hooks( monkeypatch ):
+    # setup() adds the health index to them
+    monkeypatch.setattr( globals, 'probe_hooks', [] )
+
+
+def write_config( tmp_path, text ):
+    path = tmp_path / "pi-power-relay.conf"
+    path.write_text( text )
+    return( str( path ))
+
+
+def test_read( tmp_path ):
+    args = config.read( write_config( tmp_path, CONFIG ))
+
+    assert args == [ '--hosts', '8.8.8.8,1.1.1.1', '--tries', '3',
+                     '--daemon',
+                     '--maint', '02:00-02:30',
+                     '--maint', 'sat+sun 23:00-01:00',
+                     '--device',
+                     'name=modem,pin=25,hosts=8.8.8.8+1.1.1.1,wait-time=900' ]
+
+
+@pytest.mark.parametrize( 'text', [
+    "tries\n",
+    "nosuch = 1\n",
+    "daemon = maybe\n",
+    "[router]\n",
+    "[device modem]\nname = a, b\n",
+])
+def test_read_mistakes( tmp_path, text ):
+    with pytest.raises( Exception ):
+        config.read( write_config( tmp_path, text ))
+
+
+def test_merge():
+    file_args = [ '--tries', '3', '--maint', '02:00-02:30',
+                  '--device', 'name=modem,pin=25' ]
+
+    # the command line comes last, so wins
+    assert config.merge( file_args, [ 'prog', '-t', '5' ] ) == \
+        [ 'prog' ] + file_args + [ '-t', '5' ]
+
+    # and lists on it replace those in the file
+    assert config.merge( file_args, [ 'prog', '-m', '01:00-02:00',
+                                      '--device', 'name=router,pin=24' ] ) == \
+        [ 'prog', '--tries', '3', '-m', '01:00-02:00',
+          '--device', 'name=router,pin=24' ]
+
+
+def test_command_line_wins( tmp_path ):
+    path = write_config( tmp_path, CONFIG )
+    lock_file = str( tmp_path / "lock" )
+
+    opts = pi_power_relay.get_options([ 'pi-power-relay', '-C', path,
+                                        '-L', lock_file ])
+    assert opts[ 'ping-tries' ] == 3
+    assert opts[ 'daemon-flag' ]
+    assert [ d[ 'device-name' ] for d in opts[ 'devices' ]] == [ 'modem' ]
+    assert opts[ 'devices' ][0][ 'wait-time' ] == 900
+
+    opts = pi_power_relay.get_options([ 'pi-power-relay', '-C', path,
+        '-L', lock_file, '-t', '5', '--device', 'name=router,pin=24' ])
+    assert opts[ 'ping-tries' ] == 5
+    assert [ d[ 'device-name' ] for d in opts[ 'devices' ]] == [ 'router' ]
+
+
+def compiled( argv ):
+    opts = pi_power_relay.get_options( argv )
+    pi_power_relay.setup( opts )
+    return( config.compile( opts ))
+
+
+def test_policy_is_frozen( tmp_path ):
+    policy = compiled([ 'pi-power-relay', '-q', '-H', '8.8.8.8',
+                        '-L', str( tmp_path / "lock" ) ])
+
+    assert isinstance( policy, config.Policy )
+    with pytest.raises( TypeError ):
+        policy[ 'ping-tries' ] = 10
+    with pytest.raises( TypeError ):
+        policy.update({ 'ping-tries': 10 })
+    with pytest.raises( TypeError ):
+        del policy[ 'devices' ]
+    with pytest.raises( TypeError ):
+        policy[ 'devices' ][0][ 'hosts' ] = ( '1.1.1.1', )
+    assert policy[ 'devices' ][0][ 'hosts' ] == ( '8.8.8.8', )
+
+    # a copy can be changed, as for a forced reset
+    forced = dict( policy )
+    forced[ 'force-flag' ] = True
+    assert not policy[ 'force-flag' ]
+
+
+def test_reload_keeps_restart_options( tmp_path, capsys ):
+    first = str( tmp_path / "first" )
+    path  = write_config( tmp_path,
+                          "lockfile = {}\n".format( first ) + CONFIG )
+    argv  = [ 'pi-power-relay', '-q', '-C', path ]
+    old   = compiled( argv )
+
+    # as after a SIGHUP
+    write_config( tmp_path, "lockfile = {}\nno-health = yes\n".format(
+        str( tmp_path / "second" )) + CONFIG.replace( "tries       = 3",
+                                                      "tries       = 4" ))
+    new = pi_power_relay.reload_options( argv, old )
+
+    assert isinstance( new, config.Policy )
+    assert new[ 'ping-tries' ] == 4
+    assert new[ 'lock-file' ] == first
+    assert new[ 'health-flag' ]
+    assert new[ 'health' ] is old[ 'health' ]
+    assert new[ 'resolver' ] is old[ 'resolver' ]
+    err = capsys.readouterr().err
+    assert "lock-file can't change until restarted" in err
+    assert "health-flag can't change until restarted" in err
+
+
+def test_reload_mistake_keeps_options( tmp_path ):
+    path = write_config( tmp_path, CONFIG )
+    argv = [ 'pi-power-relay', '-q', '-C', path,
+             '-L', str( tmp_path / "lock" ) ]
+    old = compiled( argv )
+
+    write_config( tmp_path, "tries = many\n" + CONFIG )
+    with pytest.raises( Exception ):
+        pi_power_relay.reload_options( argv, old )
+    assert old[ 'ping-tries' ] == 3
@@ -0,0 +1,167 @@
+"""tests of the daemon: its loop, the control socket and signals, with
+the relays on a virtual clock"""
+
+import os
+import time
+import signal
+import threading
+
+import pytest
+
+from pi_power_relay_moxad import clock
+from pi_power_relay_moxad import config
+from pi_power_relay_moxad import control
+from pi_power_relay_moxad import daemon
+from pi_power_relay_moxad import globals
+from pi_power_relay_moxad import gpio
+from pi_power_relay_moxad import probes
+from pi_power_relay_moxad import functions
+from pi_power_relay_moxad import pi_power_relay
+
+START   = 1792537200.0
+SIGNALS = ( signal.SIGTERM, signal.SIGINT, signal.SIGHUP )
+
+
+@pytest.fixture
+def virtual_clock():
+    vc  = clock.VirtualClock( START )
+    old = clock.use( vc )
+    yield vc
+    clock.use( old )
+
+
+@pytest.fixture
+def network( monkeypatch ):
+    """hosts that answer, for a 'fake' backend"""
+
+    # setup() and the control socket add to them
+    monkeypatch.setattr( globals, 'probe_hooks', [] )
+    up = set([ 'a' ])
+    probes.register( 'fake', lambda host, timeout, cancel:
+                     0.01 if host in up else None )
+    yield up
+    del probes.BACKENDS[ 'fake' ]
+
+
+@pytest.fixture
+def handlers():
+    # Daemon.run() takes these over
+    old = dict(( signum, signal.getsignal( signum )) for signum in SIGNALS )
+    yield
+    for ( signum, handler ) in old.items():
+        signal.signal( signum, handler )
+
+
+def pin_changes( path ):
+    """return the lines of a FileDriver file, as ( time, pin, value )"""
+
+    with open( path ) as f:
+        return([ ( float( t ), int( p ), int( v ))
+                 for ( t, p, v ) in ( line.split() for line in f ) ])
+
+
+def wait_for( test, timeout=10 ):
+    """wait, in real time, for test() to be true"""
+
+    end = time.time() + timeout
+    while not test():
+        assert time.time() < end, "timed out"
+        time.sleep( 0.01 )
+
+
+def test_daemon( tmp_path, virtual_clock, network, handlers ):
+    lock_file = str( tmp_path / "lock" )
+    conf      = tmp_path / "pi-power-relay.conf"
+    conf.write_text( "tries = 2\n" )
+    argv = [ 'pi-power-relay', '-q', '--no-health', '-C', str( conf ),
+             '--daemon', '--control', '-i', '60', '-r', '15',
+             '-L', lock_file, '--gpio', 'file', '-P', 'fake', '-H', 'a',
+             '-D', 'modem' ]
+
+    opts = pi_power_relay.get_options( argv )
+    pi_power_relay.setup( opts )
+    opts = config.compile( opts )
+
+    reloads = []
+
+    def load( old ):
+        reloads.append( old )
+        return( pi_power_relay.reload_options( argv, old ))
+
+    d = daemon.Daemon( opts, pi_power_relay.check, pi_power_relay.force_reset,
+                       load )
+    sock = opts[ 'control-socket' ]
+    errors = []
+
+    def ask( command, **request ):
+        request[ 'command' ] = command
+        return( control.request( sock, request, timeout=10 ))
+
+    def advance( to ):
+        # the relay timers run here, so not during a check
+        with d.check_lock:
+            virtual_clock.advance( to )
+
+    def drive():
+        try:
+            wait_for( lambda: os.path.exists( sock ))
+            wait_for( lambda: ask( 'status' )[ 'last-check' ] is not None )
+            status = ask( 'status' )
+            assert status[ 'network-up' ] is True
+            assert status[ 'devices' ][ 'modem' ][ 'state' ] == 'idle'
+            assert status[ 'hosts' ][ 'a' ][ 'rtt' ] == 0.01
+
+            # checks come when asked for, not only every --interval
+            assert ask( 'pause' )[ 'ok' ]
+            assert ask( 'status' )[ 'paused' ]
+            assert ask( 'resume' ) == { 'ok': True, 'message': "resumed" }
+            last = ask( 'status' )[ 'last-check' ]
+            time.sleep( 0.01 )
+            assert ask( 'check' )[ 'ok' ]
+            wait_for( lambda: ask( 'status' )[ 'last-check' ] != last )
+            reply = ask( 'nosuch' )
+            assert not reply[ 'ok' ]
+            assert reply[ 'error' ] == "unknown command: nosuch"
+
+            # a power cycle, despite the network being up
+            assert ask( 'force-reset', device='modem' ) == \
+                { 'ok': True, 'message': "resetting modem" }
+            advance( START + 5 )
+            modem = ask( 'status' )[ 'devices' ][ 'modem' ]
+            assert ( modem[ 'state' ], modem[ 'since' ] ) == \
+                ( 'power-off', START )
+            reply = ask( 'force-reset' )
+            assert reply[ 'error' ] == "reset of modem already in progress"
+            advance( START + 20 )
+            assert functions.read_timestamp( lock_file ) == int( START + 15 )
+            assert ask( 'status' )[ 'devices' ][ 'modem' ][ 'state' ] == \
+                'idle'
+
+            # new options between checks
+            conf.write_text( "tries = 4\n" )
+            os.kill( os.getpid(), signal.SIGHUP )
+            wait_for( lambda: d.opts[ 'ping-tries' ] == 4 )
+            assert len( reloads ) == 1
+
+            # stopped in the middle of another
+            assert ask( 'force-reset' )[ 'ok' ]
+            advance( START + 25 )
+        except Exception as err:
+            errors.append( err )
+        finally:
+            os.kill( os.getpid(), signal.SIGTERM )
+
+    driver = threading.Thread( target=drive )
+    driver.start()
+    assert d.run() == 0
+    driver.join()
+    if errors:
+        raise errors[0]
+
+    # not left without power, and the lock written
+    assert pin_changes( lock_file + ".gpio" ) == [
+        ( START, 25, gpio.HIGH ), ( START + 15, 25, gpio.LOW ),
+        ( START + 20, 25, gpio.HIGH ), ( START + 25, 25, gpio.LOW ) ]
+    assert functions.read_timestamp( lock_file ) == int( START + 25 )
+    assert not d.state[ 'modem' ][ 'relay' ].busy()
+    assert not os.path.exists( sock )
@@ -0,0 +1,136 @@
+"""tests of finding the failing network stage, with /proc and /sys faked"""
+
+import os
+
+import pytest
+
+from pi_power_relay_moxad import probes
+from pi_power_relay_moxad import diagnose
+
+HEADINGS = "Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\t" \
+           "Mask\t\tMTU\tWindow\tIRTT\n"
+
+
+def route( iface, dest, gateway, flags, metric, mask ):
+    return( "{}\t{}\t{}\t{:04X}\t0\t0\t{:d}\t{}\t0\t0\t0\n".format( iface,
+            dest, gateway, flags, metric, mask ))
+
+
+@pytest.fixture
+def proc( tmp_path, monkeypatch ):
+    """write the routes, and the state of the interfaces"""
+
+    monkeypatch.setattr( diagnose, 'PROC_ROUTE', str( tmp_path / "route" ))
+    monkeypatch.setattr( diagnose, 'PROC_IPV6_ROUTE',
+                         str( tmp_path / "ipv6_route" ))
+    monkeypatch.setattr( diagnose, 'SYS_NET', str( tmp_path / "net" ))
+
+    def write( routes=(), ipv6_routes=(), interfaces={} ):
+        with open( diagnose.PROC_ROUTE, "w" ) as f:
+            f.write( HEADINGS + ''.join( routes ))
+        with open( diagnose.PROC_IPV6_ROUTE, "w" ) as f:
+            f.write( ''.join( ipv6_routes ))
+        for ( iface, files ) in interfaces.items():
+            base = os.path.join( diagnose.SYS_NET, iface )
+            os.makedirs( base )
+            for ( name, value ) in files.items():
+                with open( os.path.join( base, name ), "w" ) as f:
+                    f.write( value + "\n" )
+    return( write )
+
+
+UP   = diagnose.RTF_UP
+GW   = diagnose.RTF_UP | diagnose.RTF_GATEWAY
+ANY  = '00000000'
+
+
+def test_lowest_metric_route( proc ):
+    proc([ route( 'eth0', ANY, '0101A8C0', GW, 100, ANY ),
+           route( 'eth0', '0001A8C0', ANY, UP, 100, '00FFFFFF' ),
+           route( 'wlan0', ANY, 'FE01A8C0', GW, 50, ANY ),
+           # not up
+           route( 'usb0', ANY, '0100000A', diagnose.RTF_GATEWAY, 0, ANY ) ])
+
+    assert diagnose.default_route() == ( 'wlan0', '192.168.1.254' )
+
+
+def test_route_without_gateway( proc ):
+    proc([ route( 'ppp0', ANY, ANY, UP, 0, ANY ) ])
+
+    assert diagnose.default_route() == ( 'ppp0', None )
+
+
+def test_ipv6_route( proc ):
+    zeros = '0' * 32
+    proc( ipv6_routes=[
+        "{0} 00 {0} 00 {0} 00000400 00000001 00000000 00000003 lo\n". \
+            format( zeros ),
+        "{0} 00 {0} 00 {0} 00000400 00000001 00000000 00000003 eth0\n". \
+            format( zeros ) ])
+
+    assert diagnose.default_route() == ( 'eth0', None )
+
+
+def test_no_route( proc ):
+    proc([ route( 'eth0', '0001A8C0', ANY, UP, 100, '00FFFFFF' ) ])
+
+    assert diagnose.default_route() is None
+    assert diagnose.check_link() == ( False, "link: no default route", None )
+
+
+@pytest.mark.parametrize( 'files,ok,reason', [
+    ({ 'operstate': 'up', 'carrier': '1' }, True, None ),
+    ({ 'operstate': 'unknown', 'carrier': '1' }, True, None ),
+    ({ 'operstate': 'up', 'carrier': '0' }, False, "no carrier on eth0" ),
+    # administratively down, so carrier can't be read
+    ({ 'operstate': 'down' }, False, "interface eth0 is down" ),
+    ({ 'operstate': 'dormant', 'carrier': '1' }, False,
+     "interface eth0 is dormant" ),
+])
+def test_link_state( proc, files, ok, reason ):
+    proc( interfaces={ 'eth0': files })
+
+    assert diagnose.link_state( 'eth0' ) == ( ok, reason )
+
+
+def test_check_link( proc ):
+    proc([ route( 'eth0', ANY, '0101A8C0', GW, 100, ANY ) ],
+         interfaces={ 'eth0': { 'operstate': 'up', 'carrier': '0' }})
+
+    assert diagnose.check_link() == ( False, "link: no carrier on eth0",
+                                      '192.168.1.1' )
+    assert diagnose.link_state( 'wlan0' ) == ( False, "no interface wlan0" )
+
+
+@pytest.fixture
+def network():
+    """hosts that answer, for a 'fake' backend"""
+
+    up = set()
+    probes.register( 'fake', lambda host, timeout, cancel:
+                     0.01 if host in up else None )
+    yield up
+    del probes.BACKENDS[ 'fake' ]
+
+
+def test_locate( network ):
+    gateway = '192.168.1.1'
+    modem   = '192.168.100.1'
+
+    def locate( gateway, modem ):
+        return( diagnose.locate( gateway, modem, 2, 1, 'fake' ))
+
+    assert locate( gateway, modem ) == \
+        ( diagnose.GATEWAY, "gateway: no answer from 192.168.1.1" )
+
+    network.add( gateway )
+    assert locate( gateway, modem ) == \
+        ( diagnose.MODEM, "modem: no answer from 192.168.100.1" )
+
+    network.add( modem )
+    assert locate( gateway, modem ) == \
+        ( diagnose.WAN, "wan: no answer from the hosts" )
+
+    # a stage without an address is skipped
+    assert locate( None, '192.168.100.2' )[0] == diagnose.MODEM
+    assert locate( None, None )[0] == diagnose.WAN
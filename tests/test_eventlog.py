@@ -0,0 +1,92 @@
+"""tests of the event log: buffering and rotation"""
+
+import os
+import gzip
+import json
+
+import pytest
+
+from pi_power_relay_moxad import clock
+from pi_power_relay_moxad.eventlog import EventLog
+
+START = 1792537200.0
+
+
+@pytest.fixture
+def virtual_clock():
+    vc  = clock.VirtualClock( START )
+    old = clock.use( vc )
+    yield vc
+    clock.use( old )
+
+
+def events( path ):
+    """return the events in a log, rotated or not"""
+
+    opener = gzip.open if path.endswith( ".gz" ) else open
+    with opener( path, "rt" ) as f:
+        return([ json.loads( line ) for line in f ])
+
+
+def test_buffered_until_flush( tmp_path, virtual_clock ):
+    path = str( tmp_path / "events" )
+    log  = EventLog( path )
+
+    log.log( 'check', up=True, devices={ 'modem': True })
+    assert not os.path.exists( path )
+    # resets are written straight away, with what is in the buffer
+    log.log( 'reset', device='modem', reason="network unreachable",
+             forced=False )
+    assert [ e[ 'event' ] for e in events( path )] == [ 'check', 'reset' ]
+
+    log.probe( '8.8.8.8', None, 'tcp' )
+    log.close()
+    assert events( path )[-1] == { 'event': 'probe', 'host': '8.8.8.8',
+        'backend': 'tcp', 'rtt': None, 't': START }
+
+
+def test_rotated_by_size( tmp_path, virtual_clock ):
+    path = str( tmp_path / "events" )
+    log  = EventLog( path, 'never', max_size=200, keep=2 )
+
+    for i in range( 12 ):
+        log.log( 'check', up=True, n=i )
+        log.flush()
+        virtual_clock.advance( START + i + 1 )
+    log.close()
+
+    assert sorted( os.listdir( str( tmp_path ))) == \
+        [ 'events', 'events.1.gz', 'events.2.gz' ]
+    assert os.path.getsize( path ) <= 200
+
+    # newest last, and none lost but those past --event-keep
+    logged = [ e[ 'n' ] for name in ( 'events.2.gz', 'events.1.gz',
+                                      'events' )
+               for e in events( str( tmp_path / name )) ]
+    assert logged == list( range( logged[0], 12 ))
+    assert logged[0] > 0
+
+
+def test_rotated_by_age( tmp_path, virtual_clock ):
+    path = str( tmp_path / "events" )
+    log  = EventLog( path, max_age=3600 )
+
+    log.log( 'check', up=True )
+    log.flush()
+    virtual_clock.advance( START + 3599 )
+    log.log( 'check', up=False )
+    log.flush()
+    assert not os.path.exists( path + ".1.gz" )
+
+    virtual_clock.advance( START + 3600 )
+    log.log( 'check', up=True )
+    log.close()
+    assert [ e[ 'up' ] for e in events( path + ".1.gz" )] == [ True, False ]
+    assert [ e[ 't' ] for e in events( path )] == [ START + 3600 ]
+
+    # the age is that of the first event in the file, when opened again
+    log = EventLog( path, max_age=3600 )
+    virtual_clock.advance( START + 7200 )
+    log.log( 'check', up=True )
+    log.close()
+    assert os.path.exists( path + ".2.gz" )
@@ -0,0 +1,109 @@
+"""tests of testing the network, with a stand-in probe backend"""
+
+import os
+import stat
+
+import pytest
+
+from pi_power_relay_moxad import globals
+from pi_power_relay_moxad import probes
+from pi_power_relay_moxad import functions
+from pi_power_relay_moxad import pi_power_relay
+
+
+@pytest.fixture
+def network():
+    """hosts that answer, for a 'fake' backend"""
+
+    up = set()
+    probes.register( 'fake', lambda host, timeout, cancel:
+                     0.01 if host in up else None )
+    yield up
+    del probes.BACKENDS[ 'fake' ]
+
+
+@pytest.mark.parametrize( 'concurrent', [ False, True ])
+def test_test_networks( network, concurrent ):
+    network.add( 'a' )
+    results = functions.test_networks([[ 'a', 'b' ], [ 'b' ]], 2, 1,
+                                      concurrent, 'fake' )
+    assert results == [ 1, 0 ]
+
+
+@pytest.mark.parametrize( 'concurrent', [ False, True ])
+def test_no_tries_is_down( network, concurrent ):
+    network.add( 'a' )
+    results = functions.test_networks([[ 'a' ]], 0, 1, concurrent, 'fake' )
+    assert results == [ 0 ]
+
+
+def test_tries_below_one_rejected( capsys ):
+    with pytest.raises( SystemExit ):
+        pi_power_relay.get_options([ 'pi-power-relay', '-c', '-t', '0' ])
+    assert "at least 1" in capsys.readouterr().err
+
+
+def test_concurrent_probe_that_raises( network ):
+    def broken( host, timeout, cancel ):
+        raise Exception( "invalid port number: 'abc'" )
+
+    probes.register( 'broken', broken )
+    try:
+        network.add( 'a' )
+        results = functions.test_networks([[ 'broken:x' ], [ 'a' ]], 2, 1,
+                                          True, 'fake' )
+    finally:
+        del probes.BACKENDS[ 'broken' ]
+    assert results == [ 0, 1 ]
+
+
+@pytest.mark.parametrize( 'args', [
+    [ '-H', 'tcp:1.2.3.4:abc' ],
+    [ '-H', '8.8.8.8,tpc:1.1.1.1' ],
+    [ '--device', 'name=modem,pin=25,hosts=8.8.8.8+1.1.1.1:53' ],
+])
+def test_bad_hosts_rejected( capsys, args ):
+    with pytest.raises( SystemExit ):
+        pi_power_relay.get_options([ 'pi-power-relay' ] + args )
+    assert "bad host" in capsys.readouterr().err
+
+
+def test_host_port_with_tcp_probe():
+    opts = pi_power_relay.get_options([ 'pi-power-relay', '-H',
+                                        'pi2:53', '-P', 'tcp' ])
+    assert opts[ 'devices' ][0][ 'hosts' ] == [ 'pi2:53' ]
+
+
+def test_bad_host_in_config( tmp_path, capsys ):
+    path = tmp_path / "pi-power-relay.conf"
+    path.write_text( u"[device modem]\nhosts = 8.8.8.8, tcp:1.1.1.1:x\n" )
+    with pytest.raises( SystemExit ):
+        pi_power_relay.get_options([ 'pi-power-relay', '-C', str( path ) ])
+    assert "conf:2: tcp:1.1.1.1:x: invalid port" in capsys.readouterr().err
+
+
+@pytest.fixture
+def system_ping( tmp_path, monkeypatch ):
+    """a ping command that is slow to start, and answers for 'up'"""
+
+    path = tmp_path / "ping"
+    path.write_text( "#!/bin/sh\n"
+                     "sleep 0.2\n"
+                     "case \"$*\" in *up) ;; *) exit 1 ;; esac\n"
+                     "echo '64 bytes from up: icmp_seq=1 time=12.5 ms'\n" )
+    os.chmod( str( path ), stat.S_IRWXU )
+    monkeypatch.setenv( 'PATH', "{}:{}".format( str( tmp_path ),
+                                                os.environ[ 'PATH' ] ))
+    probed = []
+    monkeypatch.setattr( globals, 'probe_hooks',
+                         [ lambda host, rtt, backend: probed.append( rtt ) ])
+    return( probed )
+
+
+def test_system_ping_reports_its_time( system_ping ):
+    # not the time it took to start the shell and ping
+    assert functions.ping( 'up', 2, 1 ) == 1
+    assert system_ping == [ 0.0125 ]
+
+    assert functions.ping( 'down', 2, 1 ) == 0
+    assert system_ping == [ 0.0125, None, None ]
@@ -0,0 +1,205 @@
+"""tests of the GPIO drivers, and of power cycles through them"""
+
+import os
+import struct
+
+import pytest
+
+from pi_power_relay_moxad import clock
+from pi_power_relay_moxad import gpio
+from pi_power_relay_moxad import functions
+from pi_power_relay_moxad import pi_power_relay
+from pi_power_relay_moxad.relay import Relay, IDLE, POWER_OFF, POWER_ON
+
+START = 1792537200.0
+
+
+@pytest.fixture
+def virtual_clock():
+    vc  = clock.VirtualClock( START )
+    old = clock.use( vc )
+    yield vc
+    clock.use( old )
+
+
+def pin_changes( path ):
+    """return the lines of a FileDriver file, as ( time, pin, value )"""
+
+    with open( path ) as f:
+        return([ ( float( t ), int( p ), int( v ))
+                 for ( t, p, v ) in ( line.split() for line in f ) ])
+
+
+def test_power_cycle( tmp_path, virtual_clock ):
+    path   = str( tmp_path / "gpio" )
+    states = []
+    relay  = Relay( 25, 15, { 'quiet-flag': True, 'recover-time': 30 },
+                    True, lambda r, state: states.append( state ),
+                    gpio.FileDriver( path ))
+
+    assert relay.start()
+    assert relay.wait( 100 )
+
+    assert pin_changes( path ) == [ ( START, 25, gpio.HIGH ),
+                                    ( START + 15, 25, gpio.LOW ) ]
+    assert states == [ POWER_OFF, POWER_ON, 'recovering', IDLE ]
+    assert relay.times[ POWER_ON ] - relay.times[ POWER_OFF ] == 15
+    assert virtual_clock.now() == START + 15 + 30
+
+
+def test_staggered_start( tmp_path, virtual_clock ):
+    path   = str( tmp_path / "gpio" )
+    driver = gpio.FileDriver( path )
+    relay  = Relay( 17, 5, { 'quiet-flag': True }, True, None, driver )
+
+    relay.start( delay=3 )
+    relay.wait( 100 )
+
+    assert pin_changes( path ) == [ ( START + 3, 17, gpio.HIGH ),
+                                    ( START + 8, 17, gpio.LOW ) ]
+
+
+def test_cancel_restores_power( tmp_path, virtual_clock ):
+    path  = str( tmp_path / "gpio" )
+    relay = Relay( 25, 15, { 'quiet-flag': True }, True, None,
+                   gpio.FileDriver( path ))
+
+    relay.start()
+    virtual_clock.advance( START + 4 )
+    assert relay.state == POWER_OFF
+    relay.cancel()
+
+    assert not relay.busy()
+    assert pin_changes( path ) == [ ( START, 25, gpio.HIGH ),
+                                    ( START + 4, 25, gpio.LOW ) ]
+
+
+def test_cancel_writes_lock( tmp_path, virtual_clock ):
+    # as the daemon stopping in the middle of a reset
+    lock_file = str( tmp_path / "lock" )
+    opts = pi_power_relay.get_options([ 'pi-power-relay', '-q', '--no-health',
+        '-r', '15', '-L', lock_file, '--gpio', 'file' ])
+    pi_power_relay.setup( opts )
+
+    relay = pi_power_relay.check_device( opts, opts[ 'devices' ][0], {} )
+    virtual_clock.advance( START + 4 )
+    assert relay.state == POWER_OFF
+    relay.cancel()
+
+    assert not relay.busy()
+    assert functions.read_timestamp( lock_file ) == int( START + 4 )
+    assert pin_changes( lock_file + ".gpio" )[-1] == \
+        ( START + 4, 25, gpio.LOW )
+
+
+def test_no_gpio_sets_nothing( tmp_path, virtual_clock ):
+    path  = str( tmp_path / "gpio" )
+    relay = Relay( 25, 15, { 'quiet-flag': True }, False, None,
+                   gpio.FileDriver( path ))
+
+    relay.start()
+    relay.wait( 100 )
+    assert not os.path.exists( path )
+
+
+def test_file_driver_needs_file():
+    with pytest.raises( Exception ):
+        gpio.FileDriver( "" )
+
+
+def test_open_driver():
+    assert isinstance( gpio.open_driver( 'file', "/tmp/x" ),
+                       gpio.FileDriver )
+    with pytest.raises( Exception ):
+        gpio.open_driver( 'nosuch' )
+
+
+# the chardev driver, with the ioctls caught
+
+def test_chardev_sizes():
+    # struct gpiohandle_request and struct gpiohandle_data in
+    # linux/gpio.h, and the ioctl numbers made from them
+    assert struct.calcsize( gpio._HANDLE_REQUEST ) == 364
+    assert struct.calcsize( gpio._HANDLE_DATA ) == 64
+    assert gpio.GPIO_GET_LINEHANDLE_IOCTL == 0xc16cb403
+    assert gpio.GPIOHANDLE_SET_LINE_VALUES_IOCTL == 0xc040b409
+
+
+@pytest.fixture
+def ioctls( monkeypatch ):
+    """catch the chardev driver's device opens and ioctls"""
+
+    import fcntl
+
+    calls  = []
+    closed = []
+    line_fd = 42
+
+    def ioctl( fd, request, buf ):
+        calls.append(( fd, request, bytes( buf )))
+        if request == gpio.GPIO_GET_LINEHANDLE_IOCTL:
+            # the kernel hands back the line handle in the last field
+            buf[-4:] = struct.pack( "@i", line_fd )
+        return( 0 )
+
+    monkeypatch.setattr( fcntl, 'ioctl', ioctl )
+    monkeypatch.setattr( gpio.os, 'open', lambda path, flags: 7 )
+    monkeypatch.setattr( gpio.os, 'close', closed.append )
+    return( calls, closed )
+
+
+def test_chardev_request( ioctls ):
+    ( calls, closed ) = ioctls
+    driver = gpio.ChardevDriver( "/dev/gpiochip0", keep=True )
+
+    driver.set( 25, gpio.HIGH )
+
+    ( fd, request, buf ) = calls[0]
+    assert ( fd, request ) == ( 7, gpio.GPIO_GET_LINEHANDLE_IOCTL )
+    fields  = struct.unpack( gpio._HANDLE_REQUEST, buf )
+    n       = gpio.GPIOHANDLES_MAX
+    offsets = fields[:n]
+    flags   = fields[n]
+    values  = fields[n + 1:2 * n + 1]
+    ( label, lines, line_fd ) = fields[2 * n + 1:]
+
+    assert offsets[0] == 25 and not any( offsets[1:] )
+    assert flags == gpio.GPIOHANDLE_REQUEST_OUTPUT
+    assert values[0] == gpio.HIGH and not any( values[1:] )
+    assert label.rstrip( b'\0' ) == gpio.LABEL
+    assert ( lines, line_fd ) == ( 1, -1 )
+    assert closed == [ 7 ]                  # the chip, not the line
+    assert driver.lines == { 25: 42 }
+
+
+def test_chardev_set_values( ioctls ):
+    ( calls, closed ) = ioctls
+    driver = gpio.ChardevDriver( "", keep=True )
+
+    driver.setup( 25 )
+    driver.set( 25, gpio.HIGH )
+    driver.set( 25, gpio.LOW )
+
+    values = [ struct.unpack( gpio._HANDLE_DATA, buf )
+               for ( fd, request, buf ) in calls[1:] ]
+    assert [ fd for ( fd, request, buf ) in calls[1:] ] == [ 42, 42 ]
+    assert [ request for ( fd, request, buf ) in calls[1:] ] == \
+           [ gpio.GPIOHANDLE_SET_LINE_VALUES_IOCTL ] * 2
+    assert [ v[0] for v in values ] == [ gpio.HIGH, gpio.LOW ]
+    assert not any( v for v in values[0][1:] )
+
+    # kept until closed
+    driver.release( 25 )
+    assert closed == [ 7 ]
+    driver.close()
+    assert closed == [ 7, 42 ]
+
+
+def test_chardev_release( ioctls ):
+    ( calls, closed ) = ioctls
+    driver = gpio.ChardevDriver( "" )
+
+    driver.set( 25, gpio.HIGH )
+    driver.release( 25 )
+    assert closed == [ 7, 42 ]
+    assert driver.lines == {}
@@ -0,0 +1,123 @@
+"""tests of the probe history: ring buffers, binned percentiles and
+degradation"""
+
+import pytest
+
+from pi_power_relay_moxad import history
+from pi_power_relay_moxad.history import Ring, History
+
+BIN_WIDTH = 2 ** ( 1.0 / history.BINS_PER_OCTAVE ) - 1      # about 9%
+
+
+def near( value, rtt ):
+    return( value == pytest.approx( rtt, rel=BIN_WIDTH ))
+
+
+def test_bins():
+    assert history.bin_of( None ) == history.LOST
+    assert history.bin_of( 0.0005 ) == 0
+    assert history.bin_of( 0.002 ) == history.BINS_PER_OCTAVE
+    assert history.bin_of( 60 ) == history.NUM_BINS - 1
+    for rtt in ( 0.0013, 0.012, 0.0456, 0.3, 2.5 ):
+        assert near( history.bin_value( history.bin_of( rtt )), rtt )
+
+
+def test_ring_wraps():
+    ring = Ring( 4 )
+    assert ring.loss() is None
+    assert ring.percentile( 0.5 ) is None
+
+    for rtt in ( 0.01, None, 0.02, 0.03 ):
+        ring.add( rtt )
+    assert ring.loss() == 0.25
+    assert near( ring.percentile( 0 ), 0.01 )
+
+    # the oldest two go
+    ring.add( 0.04 )
+    ring.add( 0.05 )
+    assert ring.length == 4
+    assert sum( ring.counts ) == 4
+    assert ring.loss() == 0
+    assert near( ring.percentile( 0 ), 0.02 )
+    assert near( ring.percentile( 1 ), 0.05 )
+    assert ring.next == 2
+    assert list( ring.rtts ) == pytest.approx([ 0.04, 0.05, 0.02, 0.03 ])
+
+
+def test_ring_of_lost_probes():
+    ring = Ring( 3 )
+    for i in range( 5 ):
+        ring.add( None )
+    assert ring.loss() == 1.0
+    assert ring.percentile( 0.95 ) is None
+    assert ring.ewma_loss == 1.0
+    assert ring.ewma_rtt is None
+
+
+def test_p95():
+    ring = Ring( 100 )
+    for i in range( 95 ):
+        ring.add( 0.010 )
+    for i in range( 5 ):
+        ring.add( 1.0 )
+    assert near( ring.percentile( 0.5 ), 0.010 )
+    assert near( ring.percentile( 0.95 ), 0.010 )
+
+    # one more slow one pushes a fast one out, and the p95 up
+    ring.add( 1.0 )
+    assert near( ring.percentile( 0.95 ), 1.0 )
+    assert near( ring.percentile( 0.5 ), 0.010 )
+
+
+@pytest.fixture
+def hosts():
+    """a good host, a lossy one, a slow one, and one not probed enough"""
+
+    h = History( 20 )
+    for i in range( 10 ):
+        h.record( 'good', 0.010 )
+        h.record( 'lossy', None if i % 2 else 0.010, 'tcp' )
+        h.record( 'slow', 0.300 )
+    for i in range( history.MIN_SAMPLES - 1 ):
+        h.record( 'new', None )
+    return( h )
+
+
+def test_stats( hosts ):
+    st = hosts.stats( 'lossy' )
+    assert st[ 'samples' ] == 10
+    assert st[ 'loss' ] == 0.5
+    assert near( st[ 'p95' ], 0.010 )
+    assert hosts.stats( 'nosuch' )[ 'samples' ] == 0
+
+
+def test_degraded_against_quorum( hosts ):
+    every = [ 'good', 'lossy', 'slow' ]
+
+    assert hosts.degraded( every, 1, 20, 200 ) is None
+    reason = hosts.degraded( every, 2, 20, 200 )
+    assert reason.startswith( "degraded: lossy loss 50%, slow p95 rtt " )
+
+    # without limits, nothing is judged bad
+    assert hosts.degraded( every, 3, 0, 0 ) is None
+    assert hosts.degraded( every, 2, 60, 0 ) is None
+    assert hosts.degraded( every, 2, 0, 200 ) is None
+
+
+def test_too_few_samples( hosts ):
+    # not judged until it has MIN_SAMPLES
+    assert hosts.degraded([ 'new' ], 1, 20, 0 ) is None
+    assert hosts.degraded([ 'lossy', 'new' ], 1, 20, 0 ) == \
+        "degraded: lossy loss 50%"
+    # the quorum is at most the hosts judged
+    assert hosts.degraded([ 'good', 'new' ], 2, 20, 0 ) is None
+
+    hosts.record( 'new', None )
+    assert hosts.degraded([ 'good', 'new' ], 2, 20, 0 ) == \
+        "degraded: new loss 100%"
+
+
+def test_clear( hosts ):
+    hosts.clear([ 'lossy', 'nosuch' ])
+    assert hosts.stats( 'lossy' )[ 'samples' ] == 0
+    assert hosts.degraded([ 'good', 'lossy' ], 2, 20, 0 ) is None
@@ -0,0 +1,139 @@
+"""tests of maintenance windows, compiled into a Schedule"""
+
+import os
+import time
+
+import pytest
+
+from pi_power_relay_moxad import maintenance
+
+
+@pytest.fixture( autouse=True )
+def local_time():
+    """a time zone 5 hours behind UTC, without summer time"""
+
+    old = os.environ.get( 'TZ' )
+    os.environ[ 'TZ' ] = 'EST5'
+    time.tzset()
+    yield
+    if old is None:
+        del os.environ[ 'TZ' ]
+    else:
+        os.environ[ 'TZ' ] = old
+    time.tzset()
+
+
+def at( when ):
+    """return the time for a local YYYY-MM-DD HH:MM"""
+
+    return( time.mktime( time.strptime( when, "%Y-%m-%d %H:%M" )))
+
+
+# Saturday 2026-10-17 to Wednesday 2026-10-28
+
+def test_window_past_midnight():
+    schedule = maintenance.compile([ '22:30-01:30' ])
+
+    assert schedule.window_end( at( "2026-10-17 22:29" )) is None
+    assert schedule.window_end( at( "2026-10-17 22:30" )) == \
+        at( "2026-10-18 01:30" )
+    assert schedule.window_end( at( "2026-10-18 01:29" )) == \
+        at( "2026-10-18 01:30" )
+    assert schedule.window_end( at( "2026-10-18 01:30" )) is None
+
+
+def test_weekdays():
+    assert maintenance._days( 'mon-fri' ) == [ 0, 1, 2, 3, 4 ]
+    assert maintenance._days( 'fri-mon' ) == [ 4, 5, 6, 0 ]
+    assert maintenance._days( 'sat+sun' ) == [ 5, 6 ]
+
+    schedule = maintenance.compile([ 'sat+sun 23:00-01:00' ])
+    assert schedule.window_end( at( "2026-10-16 23:30" )) is None
+    assert schedule.window_end( at( "2026-10-17 23:30" )) == \
+        at( "2026-10-18 01:00" )
+    # Sunday's goes past the end of the week
+    assert schedule.window_end( at( "2026-10-18 23:30" )) == \
+        at( "2026-10-19 01:00" )
+    assert schedule.window_end( at( "2026-10-19 00:30" )) == \
+        at( "2026-10-19 01:00" )
+    assert schedule.window_end( at( "2026-10-20 00:30" )) is None
+
+
+def test_dated_windows():
+    schedule = maintenance.compile([ '2026-11-03 22:00-2026-11-04 04:00',
+                                     '2026-10-17 01:00-02:00' ])
+
+    assert schedule.window_end( at( "2026-10-17 01:30" )) == \
+        at( "2026-10-17 02:00" )
+    assert schedule.window_end( at( "2026-10-18 01:30" )) is None
+    assert schedule.window_end( at( "2026-11-04 03:59" )) == \
+        at( "2026-11-04 04:00" )
+    assert schedule.window_end( at( "2026-11-03 21:59" )) is None
+
+    with pytest.raises( Exception ):
+        maintenance.parse( '2026-11-04 04:00-2026-11-03 22:00' )
+
+
+def test_touching_windows_merged():
+    schedule = maintenance.compile([ '01:00-02:00', 'sat 02:00-03:00' ])
+
+    assert len( schedule ) == 7
+    assert schedule.window_end( at( "2026-10-17 01:30" )) == \
+        at( "2026-10-17 03:00" )
+    assert schedule.window_end( at( "2026-10-18 01:30" )) == \
+        at( "2026-10-18 02:00" )
+
+
+ICAL = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+DTSTART:20261017T020000
+DTEND:20261017T030000
+RRULE:FREQ=DAILY
+END:VEVENT
+BEGIN:VEVENT
+DTSTART:20261019T220000
+DURATION:PT2H
+RRULE:FREQ=WEEKLY;BYDAY=MO,WE;COUNT=3
+END:VEVENT
+BEGIN:VEVENT
+STATUS:CANCELLED
+DTSTART:20261020T100000
+DTEND:20261020T110000
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+def test_ical_rrules( tmp_path ):
+    path = tmp_path / "maint.ics"
+    path.write_text( ICAL )
+    schedule = maintenance.compile( [], str( path ))
+
+    # daily, for ever
+    assert schedule.window_end( at( "2026-10-20 02:30" )) == \
+        at( "2026-10-20 03:00" )
+    assert schedule.window_end( at( "2026-10-20 03:30" )) is None
+
+    # Monday and Wednesday, three times
+    assert schedule.window_end( at( "2026-10-19 23:00" )) == \
+        at( "2026-10-20 00:00" )
+    assert schedule.window_end( at( "2026-10-20 23:00" )) is None
+    assert schedule.window_end( at( "2026-10-21 23:00" )) == \
+        at( "2026-10-22 00:00" )
+    assert schedule.window_end( at( "2026-10-26 23:59" )) == \
+        at( "2026-10-27 00:00" )
+    assert schedule.window_end( at( "2026-10-28 23:00" )) is None
+
+    # cancelled
+    assert schedule.window_end( at( "2026-10-20 10:30" )) is None
+
+
+def test_cached_schedule( tmp_path ):
+    path  = tmp_path / "maint.ics"
+    cache = str( tmp_path / "maint.cache" )
+    path.write_text( ICAL )
+
+    first = maintenance.load( str( path ), cache )
+    assert os.path.exists( cache )
+    again = maintenance.load( str( path ), cache )
+    assert ( again.weekly, again.dated ) == ( first.weekly, first.dated )
@@ -0,0 +1,98 @@
+"""tests of the metrics registry, as threads come and go"""
+
+import threading
+
+import pytest
+
+from pi_power_relay_moxad import metrics
+
+
+@pytest.fixture
+def registry( monkeypatch ):
+    monkeypatch.setattr( metrics, '_registry', None )
+    return( metrics.enable())
+
+
+def in_threads( n, func ):
+    threads = [ threading.Thread( target=func ) for i in range( n ) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_counts_of_ended_threads_kept( registry ):
+    labels = (( 'host', 'a' ),)
+    for i in range( 5 ):
+        in_threads( 4, lambda: metrics.inc( 'probe_attempts_total',
+                                            labels ))
+    metrics.inc( 'probe_attempts_total', labels )
+
+    assert registry.collect()[ ( 'probe_attempts_total', labels ) ] == 21
+    # only the shard of this thread is left
+    assert len( registry.shards ) == 1
+    assert registry.shards[0][0] is threading.current_thread()
+
+    # and counts carry on from the total
+    in_threads( 2, lambda: metrics.inc( 'probe_attempts_total', labels ))
+    assert registry.collect()[ ( 'probe_attempts_total', labels ) ] == 23
+
+
+def test_shards_dropped_without_collect( registry ):
+    for i in range( 20 ):
+        in_threads( 1, lambda: metrics.inc( 'resets_total' ))
+    assert len( registry.shards ) <= 1
+    assert registry.collect()[ ( 'resets_total', () ) ] == 20
+
+
+def test_live_threads_counted( registry ):
+    counted = threading.Event()
+    finish  = threading.Event()
+
+    def work():
+        metrics.observe( 'check_duration_seconds', 0.3 )
+        counted.set()
+        finish.wait( 5 )
+
+    t = threading.Thread( target=work )
+    t.start()
+    try:
+        counted.wait( 5 )
+        totals = registry.collect()
+        assert totals[ ( 'check_duration_seconds_count', () ) ] == 1
+        assert totals[ ( 'check_duration_seconds_bucket',
+                         (( 'le', '0.5' ),)) ] == 1
+    finally:
+        finish.set()
+        t.join()
+    assert registry.collect()[ ( 'check_duration_seconds_count', () ) ] == 1
+
+
+def test_gauge_is_last_set( registry ):
+    labels = (( 'host', 'a' ),)
+    metrics.gauge( 'host_loss_ratio', 0.5, labels )
+    in_threads( 1, lambda: metrics.gauge( 'host_loss_ratio', 0.25, labels ))
+
+    # a thread that sets it later wins, whichever shard came first
+    assert registry.collect()[ ( 'host_loss_ratio', labels ) ] == 0.25
+    metrics.gauge( 'host_loss_ratio', 0.0, labels )
+    assert registry.collect()[ ( 'host_loss_ratio', labels ) ] == 0.0
+    assert 'pi_power_relay_host_loss_ratio{host="a"} 0' in \
+        metrics.render().splitlines()
+
+
+def test_load_textfile_adds_counters( registry, tmp_path, monkeypatch ):
+    path = str( tmp_path / "metrics.prom" )
+    metrics.inc( 'resets_total', (( 'device', 'modem' ),), 2 )
+    metrics.gauge( 'host_loss_ratio', 1.0 )
+    metrics.write_textfile( path )
+
+    # as the next run from the cron
+    monkeypatch.setattr( metrics, '_registry', None )
+    metrics.enable()
+    metrics.load_textfile( path )
+    metrics.inc( 'resets_total', (( 'device', 'modem' ),))
+
+    totals = metrics._registry.collect()
+    assert totals[ ( 'resets_total', (( 'device', 'modem' ),)) ] == 3
+    assert ( 'host_loss_ratio', () ) not in totals
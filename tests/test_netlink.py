@@ -0,0 +1,157 @@
+"""tests of parsing rtnetlink notifications, from messages made by hand"""
+
+import socket
+
+import pytest
+
+from pi_power_relay_moxad import netlink
+from pi_power_relay_moxad.netlink import Watcher
+
+UP_CARRIER = netlink.IFF_UP | netlink.IFF_RUNNING | netlink.IFF_LOWER_UP
+RT_SCOPE_UNIVERSE = 0
+
+
+def message( type, body ):
+    """a netlink message, padded as the kernel sends it"""
+
+    length = netlink._nlmsghdr.size + len( body )
+    data = netlink._nlmsghdr.pack( length, type, 0, 0, 0 ) + body
+    return( data + b'\0' * ( netlink._align( length ) - length ))
+
+
+def attr( type, payload ):
+    length = netlink._rtattr.size + len( payload )
+    data = netlink._rtattr.pack( length, type ) + payload
+    return( data + b'\0' * ( netlink._align( length ) - length ))
+
+
+def link( type, index, flags, name=None ):
+    body = netlink._ifinfomsg.pack( socket.AF_UNSPEC, 1, index, flags, 0 )
+    if name is not None:
+        body = body + attr( netlink.IFLA_IFNAME,
+                            name.encode( 'utf-8' ) + b'\0' )
+    return( message( type, body ))
+
+
+def addr( type, index, scope=RT_SCOPE_UNIVERSE ):
+    return( message( type, netlink._ifaddrmsg.pack( socket.AF_INET, 24, 0,
+                                                     scope, index )))
+
+
+def route( type, dst_len=0, table=netlink.RT_TABLE_MAIN ):
+    return( message( type, netlink._rtmsg.pack( socket.AF_INET, dst_len, 0,
+                                                0, table, 3, 0, 1, 0 )))
+
+
+@pytest.fixture
+def watcher():
+    w = Watcher( None )
+    w.parse( link( netlink.RTM_NEWLINK, 2, UP_CARRIER, 'eth0' ))
+    return( w )
+
+
+def test_new_link( watcher ):
+    assert watcher.parse( link( netlink.RTM_NEWLINK, 3, 0, 'wlan0' )) == \
+        [ 'wlan0 appeared' ]
+    assert watcher.links[ 3 ] == ( 'wlan0', 0 )
+
+
+@pytest.mark.parametrize( 'flags, event', [
+    ( netlink.IFF_UP | netlink.IFF_RUNNING, 'eth0 lost carrier' ),
+    ( netlink.IFF_RUNNING | netlink.IFF_LOWER_UP, 'eth0 down' ),
+    ( netlink.IFF_UP | netlink.IFF_LOWER_UP, 'eth0 not running' ),
+])
+def test_link_changes( watcher, flags, event ):
+    assert watcher.parse( link( netlink.RTM_NEWLINK, 2, flags, 'eth0' )) == \
+        [ event ]
+
+
+def test_link_unchanged( watcher ):
+    # such as the MTU changing
+    assert watcher.parse( link( netlink.RTM_NEWLINK, 2, UP_CARRIER | 0x1000,
+                                'eth0' )) == []
+
+
+def test_link_removed( watcher ):
+    assert watcher.parse( link( netlink.RTM_DELLINK, 2, 0, 'eth0' )) == \
+        [ 'eth0 removed' ]
+    assert 2 not in watcher.links
+
+
+def test_link_without_name( watcher ):
+    assert watcher.parse( link( netlink.RTM_NEWLINK, 9, 0 )) == \
+        [ 'interface 9 appeared' ]
+
+
+def test_addresses( watcher ):
+    assert watcher.parse( addr( netlink.RTM_NEWADDR, 2 )) == \
+        [ 'address added to eth0' ]
+    assert watcher.parse( addr( netlink.RTM_DELADDR, 7 )) == \
+        [ 'address removed from interface 7' ]
+    assert watcher.parse( addr( netlink.RTM_NEWADDR, 1,
+                                netlink.RT_SCOPE_HOST )) == []
+
+
+def test_routes( watcher ):
+    assert watcher.parse( route( netlink.RTM_NEWROUTE )) == \
+        [ 'default route added' ]
+    assert watcher.parse( route( netlink.RTM_DELROUTE )) == \
+        [ 'default route removed' ]
+
+    # the local network, and the local table, don't matter
+    assert watcher.parse( route( netlink.RTM_DELROUTE, dst_len=24 )) == []
+    assert watcher.parse( route( netlink.RTM_DELROUTE, table=255 )) == []
+
+
+def test_several_messages( watcher ):
+    data = route( netlink.RTM_DELROUTE ) + \
+           message( netlink.NLMSG_ERROR, b'\0' * 20 ) + \
+           link( netlink.RTM_NEWLINK, 2, netlink.IFF_UP, 'eth0' ) + \
+           message( netlink.NLMSG_OVERRUN, b'' )
+    assert watcher.parse( data ) == [ 'default route removed',
+                                      'eth0 lost carrier',
+                                      'lost notifications (overrun)' ]
+
+
+def test_done_ends_dump():
+    w = Watcher( None )
+    assert w.parse( message( netlink.NLMSG_DONE, b'\0' * 4 )) == []
+    assert w.dumped
+
+
+def test_truncated_messages( watcher ):
+    data = route( netlink.RTM_DELROUTE )
+
+    # cut off in the header, or in the body the header promises
+    for cut in ( 1, netlink._nlmsghdr.size - 1, netlink._nlmsghdr.size,
+                 len( data ) - 1 ):
+        assert watcher.parse( data[:cut] ) == []
+
+    # a whole message is still reported before a truncated one
+    assert watcher.parse( data + data[:10] ) == [ 'default route removed' ]
+
+
+def test_short_bodies( watcher ):
+    # a header whose length is too short for the message type
+    for type in ( netlink.RTM_NEWLINK, netlink.RTM_NEWADDR,
+                  netlink.RTM_DELROUTE ):
+        assert watcher.parse( message( type, b'\0\0\0\0' )) == []
+    assert watcher.parse( message( netlink.RTM_DELROUTE, b'' ) +
+                          route( netlink.RTM_DELROUTE )) == \
+        [ 'default route removed' ]
+
+
+def test_bad_length_stops( watcher ):
+    # a length shorter than the header would never move on
+    data = netlink._nlmsghdr.pack( 4, netlink.RTM_DELROUTE, 0, 0, 0 )
+    assert watcher.parse( data + route( netlink.RTM_DELROUTE )) == []
+
+
+def test_truncated_attribute( watcher ):
+    # the name runs past the end of the message, into the next one
+    body = netlink._ifinfomsg.pack( socket.AF_UNSPEC, 1, 4, 0, 0 ) + \
+           netlink._rtattr.pack( 40, netlink.IFLA_IFNAME ) + b'eth1'
+    data = message( netlink.RTM_NEWLINK, body ) + \
+           route( netlink.RTM_DELROUTE )
+    assert watcher.parse( data ) == [ 'interface 4 appeared',
+                                      'default route removed' ]
@@ -0,0 +1,247 @@
+"""tests of --peers, with several instances on localhost"""
+
+import json
+import socket
+import threading
+
+import pytest
+
+from pi_power_relay_moxad import peers as peers_module
+from pi_power_relay_moxad.peers import Peers
+
+
+def free_ports( n ):
+    """return n UDP ports free on localhost"""
+
+    socks = []
+    for i in range( n ):
+        s = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+        s.bind(( '127.0.0.1', 0 ))
+        socks.append( s )
+    ports = [ s.getsockname()[1] for s in socks ]
+    for s in socks:
+        s.close()
+    return( ports )
+
+
+@pytest.fixture
+def instances():
+    """start n instances, each with the others as peers"""
+
+    started = []
+
+    def start( n ):
+        ports = free_ports( n )
+        specs = [ "127.0.0.1:{:d}".format( p ) for p in ports ]
+        for port in ports:
+            p = Peers( specs, port )
+            p.start()
+            started.append( p )
+        return( started )
+
+    yield start
+    for p in started:
+        p.close()
+
+
+def wait_for( test, secs=2 ):
+    """wait until test() is true, as messages take a moment"""
+
+    for i in range( int( secs / 0.02 )):
+        if test():
+            return( True )
+        threading.Event().wait( 0.02 )
+    return( test())
+
+
+def claim_all( instances, device, secs=5 ):
+    """claim a device from every instance at once"""
+
+    results = {}
+    barrier = threading.Barrier( len( instances ))
+
+    def claim( p ):
+        barrier.wait()
+        results[ p.id ] = p.claim( device, secs )
+
+    threads = [ threading.Thread( target=claim, args=( p, ))
+                for p in instances ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return( results )
+
+
+@pytest.mark.parametrize( 'n', [ 2, 3 ])
+def test_one_claim_wins( instances, n ):
+    group = instances( n )
+    for device in ( 'modem', 'router', 'switch' ):
+        results = claim_all( group, device )
+        winners = [ id for ( id, holder ) in results.items()
+                    if holder is None ]
+        assert len( winners ) == 1
+
+        # a loser may only know of another claim that beat its own,
+        # until the reset message comes
+        ids = [ p.id for p in group ]
+        for ( id, holder ) in results.items():
+            if id != winners[0]:
+                assert holder in ids and holder != id
+
+
+def test_losers_hold_off( instances ):
+    group = instances( 3 )
+    results = claim_all( group, 'modem' )
+    winner = [ id for ( id, holder ) in results.items() if holder is None ][0]
+
+    for p in group:
+        if p.id != winner:
+            assert wait_for( lambda: 'modem' in p.resets )
+            assert p.held() == { 'modem': winner }
+            assert p.claim( 'modem', 5 ) == winner
+
+
+def test_done_ends_lease( instances ):
+    ( a, b ) = instances( 2 )
+    assert a.claim( 'modem', 5 ) is None
+    assert wait_for( lambda: 'modem' in b.resets )
+    assert b.held() == { 'modem': a.id }
+    assert b.take_resets()[ 'modem' ][0] == a.id
+
+    a.done( 'modem', True )
+    assert wait_for( lambda: b.held() == {})
+    assert b.claim( 'modem', 5 ) is None
+
+
+def test_silent_peer_grants():
+    ( port, silent ) = free_ports( 2 )
+    p = Peers([ "127.0.0.1:{:d}".format( silent ) ], port )
+    p.start()
+    try:
+        assert p.claim( 'modem', 5 ) is None
+    finally:
+        p.close()
+
+
+class FakePeer( object ):
+    """a peer we write the messages of by hand"""
+
+    def __init__( self, id ):
+        self.id   = id
+        self.sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+        self.sock.bind(( '127.0.0.1', 0 ))
+        self.sock.settimeout( 5 )
+        self.port = self.sock.getsockname()[1]
+
+    def send( self, message, port ):
+        message = dict( message, **{ 'from': self.id })
+        self.sock.sendto( json.dumps( message ).encode( 'utf-8' ),
+                          ( '127.0.0.1', port ))
+
+    def receive( self, kind ):
+        while True:
+            message = json.loads( self.sock.recv( 8192 ).decode( 'utf-8' ))
+            if message[ 'type' ] == kind:
+                return( message )
+
+    def close( self ):
+        self.sock.close()
+
+
+@pytest.mark.parametrize( 'other, wins', [
+    ( '!lower:1', True ),       # a lower id wins a tie
+    ( '~higher:1', False ),
+])
+def test_tie_break_by_id( monkeypatch, other, wins ):
+    """two claims made at the same time are decided by the ids"""
+
+    monkeypatch.setattr( peers_module.clock, 'now', lambda: 1000.0 )
+    fake = FakePeer( other )
+    ( port, ) = free_ports( 1 )
+    p = Peers([ "127.0.0.1:{:d}".format( fake.port ) ], port )
+    p.start()
+    try:
+        result = {}
+        t = threading.Thread( target=lambda: result.update(
+            holder=p.claim( 'modem', 5 )))
+        t.start()
+
+        # answer its claim with one of our own, made at the same time
+        claim = fake.receive( 'claim' )
+        assert claim[ 'time' ] == 1000.0
+        fake.send({ 'type': 'claim', 'device': 'modem',
+                    'time': claim[ 'time' ] }, port )
+        reply = fake.receive( 'grant' if wins else 'deny' )
+        if not wins:
+            assert reply[ 'holder' ] == p.id
+            fake.send({ 'type': 'grant', 'device': 'modem' }, port )
+        t.join()
+
+        if wins:
+            assert result[ 'holder' ] == other
+        else:
+            assert result[ 'holder' ] is None
+    finally:
+        p.close()
+        fake.close()
+
+
+def test_granted_claim_not_held( monkeypatch ):
+    """a claim we granted may lose to another, so isn't a reset yet"""
+
+    monkeypatch.setattr( peers_module.clock, 'now', lambda: 1000.0 )
+    first  = FakePeer( 'first:1' )
+    second = FakePeer( 'second:1' )
+    ( port, ) = free_ports( 1 )
+    p = Peers([ "127.0.0.1:{:d}".format( f.port )
+                for f in ( first, second ) ], port )
+    p.start()
+    try:
+        second.send({ 'type': 'claim', 'device': 'modem',
+                      'time': 999.5 }, port )
+        second.receive( 'grant' )
+        assert p.held() == {}
+        assert p.status()[ 'leases' ] == {}
+
+        # a later claim loses to the one granted
+        first.send({ 'type': 'claim', 'device': 'modem',
+                     'time': 999.8 }, port )
+        assert first.receive( 'deny' )[ 'holder' ] == 'second:1'
+        assert p.held() == {}
+
+        # first forced a reset, despite the deny
+        first.send({ 'type': 'reset', 'device': 'modem', 'secs': 60 }, port )
+        assert wait_for( lambda: p.held() == { 'modem': 'first:1' })
+        assert p.status()[ 'leases' ][ 'modem' ][ 'holder' ] == 'first:1'
+        assert p.claim( 'modem', 5 ) == 'first:1'
+    finally:
+        p.close()
+        first.close()
+        second.close()
+
+
+def test_late_start_learns_of_reset( instances ):
+    """an instance that missed the reset message learns of it"""
+
+    ( a, b ) = instances( 2 )
+    with b.cond:
+        addresses = b.addresses
+        b.addresses = []            # b hears nothing a says yet
+    assert a.claim( 'modem', 5 ) is None
+    with b.cond:
+        b.addresses = addresses
+    assert b.held() == {}
+
+    assert b.claim( 'modem', 5 ) == a.id
+    assert b.held() == { 'modem': a.id }
+    assert b.take_resets()[ 'modem' ][0] == a.id
+
+
+def test_parse_peer():
+    assert peers_module.parse_peer( 'pi2' ) == ( 'pi2',
+                                                 peers_module.DEFAULT_PORT )
+    assert peers_module.parse_peer( 'pi2:7000' ) == ( 'pi2', 7000 )
+    for bad in ( 'pi2:', 'pi2:x', ':7000', 'pi2:70000' ):
+        with pytest.raises( Exception ):
+            peers_module.parse_peer( bad )
@@ -0,0 +1,84 @@
+"""tests of the probe backends, without the network"""
+
+import socket
+import subprocess
+
+import pytest
+
+from pi_power_relay_moxad import probes
+
+
+def test_probe_system_pings_cached_address( monkeypatch ):
+    argvs = []
+
+    def popen( argv, **kwargs ):
+        argvs.append( argv )
+        raise OSError( "no ping here" )
+
+    monkeypatch.setattr( subprocess, 'Popen', popen )
+    monkeypatch.setattr( probes, 'addresses', { 'dns.google': '8.8.8.8' })
+
+    assert probes.probe_system( 'dns.google', 1 ) is None
+    assert argvs == [[ 'ping', '-c', '1', '-w', '1', '8.8.8.8' ]]
+
+
+def test_probe_system_pings_unknown_name( monkeypatch ):
+    argvs = []
+
+    def popen( argv, **kwargs ):
+        argvs.append( argv )
+        raise OSError( "no ping here" )
+
+    monkeypatch.setattr( subprocess, 'Popen', popen )
+    monkeypatch.setattr( probes, 'addresses', {})
+
+    probes.probe_system( 'example.com', 2 )
+    assert argvs[0][-1] == 'example.com'
+
+
+@pytest.mark.parametrize( 'output,rtt', [
+    ( b"64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=12.3 ms\n", 0.0123 ),
+    ( "64 bytes from 8.8.8.8: seq=0 ttl=117 time=4.067 ms\n", 0.004067 ),
+    ( "64 bytes from 127.0.0.1: icmp_seq=1 ttl=64 time<1ms\n", 0.001 ),
+    ( b"1 packets transmitted, 1 received\n", None ),
+    ( None, None ),
+])
+def test_ping_time( output, rtt ):
+    assert probes.ping_time( output ) == pytest.approx( rtt )
+
+
+def test_resolve_uses_cached_address( monkeypatch ):
+    monkeypatch.setattr( probes, 'addresses', { 'nowhere.invalid':
+                                                '127.0.0.1' })
+
+    ( family, sockaddr ) = probes._resolve( 'nowhere.invalid', 53,
+                                            socket.SOCK_DGRAM )
+    assert sockaddr[:2] == ( '127.0.0.1', 53 )
+
+
+@pytest.mark.parametrize( 'host', [
+    'tcp:1.2.3.4:abc', 'tcp:1.2.3.4:70000', 'tcp:[::1]:x', 'tpc:8.8.8.8',
+    '1.2.3.4:53', 'tcp:', '',
+])
+def test_bad_targets( host ):
+    with pytest.raises( Exception ):
+        probes.check_target( host, 'system' )
+
+
+@pytest.mark.parametrize( 'host', [
+    '8.8.8.8', 'dns.google', 'tcp:1.1.1.1:443', 'dns:9.9.9.9',
+    'tcp:[2001:db8::1]:53', '2001:db8::1', 'fe80::1%eth0', 'icmp:1.1.1.1',
+])
+def test_good_targets( host ):
+    probes.check_target( host, 'system' )
+
+
+def test_port_needs_tcp_or_dns():
+    with pytest.raises( Exception ):
+        probes.check_target( 'pi2:53', 'icmp' )
+    probes.check_target( 'pi2:53', 'tcp' )
+
+    # not known yet, as in a config file
+    probes.check_target( 'pi2:53' )
+    with pytest.raises( Exception ):
+        probes.check_target( 'pi2:abc' )
@@ -0,0 +1,140 @@
+"""tests of the report subcommand, from event logs and text logs"""
+
+import gzip
+import json
+
+from pi_power_relay_moxad import report
+
+START = 1792537200.0
+DAY   = 24 * 60 * 60
+
+
+def event( t, name, **fields ):
+    # as EventLog writes them
+    fields[ 't' ]     = START + t
+    fields[ 'event' ] = name
+    return( json.dumps( fields, sort_keys=True ) + "\n" )
+
+
+# rotated, so older
+ROTATED = [
+    event( 0, 'check', up=True, devices={ 'modem': True }),
+    event( 100, 'probe', host='8.8.8.8', backend='tcp', rtt=None ),
+    event( 200, 'check', up=False, devices={ 'modem': False }),
+    event( 200, 'reset', device='modem', reason="network unreachable",
+           forced=False ),
+    event( 215, 'power-on', device='modem' ),
+    event( 245, 'check', up=False, devices={ 'modem': False }),
+    event( 275, 'check', up=True, devices={ 'modem': True }),
+    # back-to-back with the first, and it didn't help
+    event( 1000, 'reset', device='modem',
+           reason="hosts degraded: loss 50%", forced=False ),
+    event( 1015, 'power-on', device='modem' ),
+    event( 1100, 'recovery', device='modem', secs=None ),
+]
+
+CURRENT = [
+    event( 2 * DAY, 'lock-skip', device='modem', since=300, wait=600 ),
+    event( 2 * DAY + 10, 'reset', device='router',
+           reason="network unreachable", forced=False ),
+    event( 2 * DAY + 25, 'power-on', device='router' ),
+    event( 3 * DAY, 'local-fault', stage='link', reason="carrier lost" ),
+    event( 3 * DAY + 60, 'maint-skip', until=START + 3 * DAY + 600 ),
+    "{ not json\n",
+]
+
+
+def write_logs( tmp_path ):
+    rotated = str( tmp_path / "events.1.gz" )
+    with gzip.open( rotated, "wt" ) as f:
+        f.writelines( ROTATED )
+    current = str( tmp_path / "events" )
+    with open( current, "w" ) as f:
+        f.writelines( CURRENT )
+    return( current, rotated )
+
+
+def test_event_logs( tmp_path, capsys ):
+    ( current, rotated ) = write_logs( tmp_path )
+    output = str( tmp_path / "report.json" )
+
+    # given newest first, but read oldest first
+    assert report.main([ 'pi-power-relay', 'report', '-w', '600',
+                         '-o', output, current, rotated ]) == 0
+    assert "device modem" in capsys.readouterr().out
+    with open( output ) as f:
+        s = json.load( f )
+
+    assert s[ 'lines' ] == len( ROTATED ) + len( CURRENT )
+    # checks before the first reset are passed over without parsing
+    assert ( s[ 'first' ], s[ 'last' ] ) == \
+        ( START + 200, START + 3 * DAY + 60 )
+    assert ( s[ 'local-faults' ], s[ 'maint-skips' ], s[ 'bad-lines' ] ) == \
+        ( 1, 1, 1 )
+
+    ( modem, router ) = s[ 'devices' ]
+    assert modem[ 'device' ] == 'modem'
+    assert modem[ 'resets' ] == 2
+    assert modem[ 'reasons' ] == { 'network unreachable': 1,
+                                   'hosts degraded': 1 }
+    assert modem[ 'mean-between' ] == 800
+    assert ( modem[ 'back-to-back' ], modem[ 'clusters' ],
+             modem[ 'largest-cluster' ], modem[ 'not-repeated' ] ) == \
+        ( 1, 1, 2, 1 )
+    assert modem[ 'locked' ] == 1
+    # up 60 secs after power came back, by the checks
+    assert ( modem[ 'recovered' ], modem[ 'not-recovered' ],
+             modem[ 'unknown' ] ) == ( 1, 1, 0 )
+    assert modem[ 'recovery-mean' ] == 60
+    assert modem[ 'recovery-bins' ][ '1m-2m' ] == 1
+    assert modem[ 'recovery-rate' ] == 0.5
+    assert sum( modem[ 'resets-per-week' ].values()) == 2
+
+    assert router[ 'resets' ] == 1
+    assert ( router[ 'recovered' ], router[ 'not-recovered' ],
+             router[ 'unknown' ] ) == ( 0, 0, 1 )
+
+
+def test_one_device( tmp_path, capsys ):
+    ( current, rotated ) = write_logs( tmp_path )
+    r = report.Report( 600, 'day', 'router' )
+    for file in ( rotated, current ):
+        r.read( file )
+    r.finish()
+
+    s = r.summary()
+    assert [ d[ 'device' ] for d in s[ 'devices' ]] == [ 'router' ]
+    assert list( s[ 'devices' ][0][ 'resets-per-day' ].values()) == [ 1 ]
+
+
+def test_text_log( tmp_path, capsys ):
+    path = tmp_path / "power-relay"
+    path.write_text(
+        "Sat Oct 17, 2026 @ 10:00: pi-power-relay: network unreachable.  "
+        "resetting modem\n"
+        "Sat Oct 17, 2026 @ 10:02: pi-power-relay: modem recovered 45 secs "
+        "after reset\n"
+        "Sun Oct 18, 2026 @ 09:00: pi-power-relay: link down.  "
+        "not resetting\n"
+        "Mon Oct 19, 2026 @ 12:00: pi-power-relay: network unreachable.  "
+        "resetting modem\n"
+        "Mon Oct 19, 2026 @ 12:10: pi-power-relay: modem did not recover "
+        "within 600 secs\n"
+        "something else\n" )
+
+    r = report.Report()
+    r.read( str( path ))
+    r.finish()
+
+    s = r.summary()
+    assert s[ 'local-faults' ] == 1
+    ( modem, ) = s[ 'devices' ]
+    assert modem[ 'resets' ] == 2
+    assert ( modem[ 'recovered' ], modem[ 'not-recovered' ] ) == ( 1, 1 )
+    assert modem[ 'recovery-mean' ] == 45
+    assert modem[ 'back-to-back' ] == 0
+
+
+def test_no_files( capsys ):
+    assert report.main([ 'pi-power-relay', 'report' ]) == 1
+    assert "no log files" in capsys.readouterr().err
@@ -0,0 +1,44 @@
+"""tests that a run from the cron only imports what it needs"""
+
+import os
+import subprocess
+import sys
+
+from pi_power_relay_moxad import constants
+from pi_power_relay_moxad import diagnose
+from pi_power_relay_moxad import gpio
+
+# only imported when an option, or a reset, needs them
+LAZY = ( 'control', 'peers', 'diagnose', 'history', 'probetrace',
+         'recovery', 'metrics', 'config', 'eventlog', 'resolver', 'gpio',
+         'health', 'relay', 'maintenance', 'daemon', 'simulate' )
+
+
+def imported_by( code ):
+    src = os.path.join( os.path.dirname( __file__ ), '..', 'src' )
+    env = dict( os.environ, PYTHONPATH=src )
+    output = subprocess.check_output([ sys.executable, '-c', code +
+        "\nimport sys\nprint( ' '.join( sys.modules ))" ], env=env )
+    return( set( output.decode().split()))
+
+
+def test_import_is_lean():
+    modules = imported_by( "import pi_power_relay_moxad.pi_power_relay" )
+    for name in LAZY:
+        assert 'pi_power_relay_moxad.' + name not in modules
+    for name in ( 'socket', 'select', 'json', 'queue' ):
+        assert name not in modules
+
+
+def test_options_are_lean():
+    modules = imported_by(
+        "from pi_power_relay_moxad.pi_power_relay import get_options\n"
+        "get_options([ 'p', '-H', 'tcp:8.8.8.8:53', '--gpio', 'file' ])" )
+    for name in LAZY:
+        assert 'pi_power_relay_moxad.' + name not in modules
+
+
+def test_constants_agree():
+    assert set( constants.GPIO_DRIVERS ) == set( gpio.DRIVERS )
+    assert gpio.DEFAULT_DRIVER in gpio.DRIVERS
+    assert set( constants.RESET_STAGES ) <= set( diagnose.STAGES )
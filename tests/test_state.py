@@ -0,0 +1,87 @@
+"""tests of the lock-file state, and the instance lock"""
+
+import os
+import json
+
+import pytest
+
+from pi_power_relay_moxad import clock
+from pi_power_relay_moxad import functions
+
+START = 1792537200.0
+
+
+@pytest.fixture
+def virtual_clock():
+    vc  = clock.VirtualClock( START )
+    old = clock.use( vc )
+    yield vc
+    clock.use( old )
+
+
+def test_version_1_read( tmp_path ):
+    path = tmp_path / "lock"
+    path.write_text( "1792537000\nSat Oct 17, 2026 22:56:40\n" )
+
+    assert functions.read_state( str( path )) == \
+        { 'version': 1, 'last-reset': 1792537000 }
+    assert functions.read_timestamp( str( path )) == 1792537000
+
+
+def test_version_1_migrated( tmp_path, virtual_clock ):
+    path = tmp_path / "lock"
+    path.write_text( "1792537000\nSat Oct 17, 2026 22:56:40\n" )
+
+    functions.update_state( str( path ), { 'probe': { 'up': True }})
+
+    with open( str( path )) as f:
+        state = json.load( f )
+    assert state == { 'version': functions.STATE_VERSION,
+                      'last-reset': 1792537000,
+                      'probe': { 'up': True }}
+
+    functions.write_timestamp( str( path ), { 'device-name': 'modem' })
+    state = functions.read_state( str( path ))
+    assert state[ 'version' ] == 2
+    assert state[ 'last-reset' ] == int( START )
+    assert state[ 'device' ] == 'modem'
+    assert state[ 'probe' ] == { 'up': True }
+    # nothing is left of the temporary file
+    assert os.listdir( str( tmp_path )) == [ 'lock' ]
+
+
+@pytest.mark.parametrize( 'data', [
+    "not json\n",
+    "[ 1, 2 ]\n",
+    '{ "version": 2, "last-reset": "yesterday" }\n',
+])
+def test_corrupt_state( tmp_path, capsys, data ):
+    path = tmp_path / "lock"
+    path.write_text( data )
+
+    assert functions.read_state( str( path )) == {}
+    assert "ignoring corrupt state" in capsys.readouterr().err
+    assert functions.read_state( str( path ), quiet=True ) == {}
+    assert capsys.readouterr().err == ""
+
+
+def test_no_state( tmp_path ):
+    assert functions.read_state( str( tmp_path / "lock" )) == {}
+    assert functions.read_timestamp( str( tmp_path / "lock" )) is None
+
+
+def test_instance_lock( tmp_path ):
+    path  = functions.instance_filename( str( tmp_path / "lock" ))
+    first = functions.instance_lock( path )
+    assert first is not None
+    with open( path ) as f:
+        assert f.read() == "{:d}\n".format( os.getpid())
+
+    # a second run finds it held, and leaves the file alone
+    assert functions.instance_lock( path ) is None
+    assert os.path.exists( path )
+
+    first.close()
+    again = functions.instance_lock( path )
+    assert again is not None
+    again.close()